@@ -0,0 +1,260 @@
+import heapq
+import json
+import random
+import argparse
+import numpy as np
+from sim_core import (IntersectionSimulation, noOfSignals, noOfLanes, directionNumbers, vehicleTypes, vehicleLengths,
+                      speeds, gap, stop_distance, exit_distance)
+from vehicle_store import VehicleStore
+
+# Neighbour offset (row, column) reached by leaving a junction in each direction
+directionSteps = {0: (0, 1), 1: (1, 0), 2: (0, -1), 3: (-1, 0)}
+
+def green_wave_offsets(count, link_seconds, cycle, steps_per_second=10, direction_number=0, speed=None):
+    """Signal offsets (seconds) that give a green wave along a line of `count` junctions.
+
+    Each junction lags the previous one by the time a car takes from one stop
+    line to the next: the rest of the junction plus the link.
+    """
+    speed = speed or speeds['car']
+    crossing = exit_distance(directionNumbers[direction_number]) / speed / steps_per_second
+    return [int(round(i * (crossing + link_seconds))) % cycle for i in range(count)]
+
+class RoadNetwork:
+    """A grid of junctions joined by road links, driven by one event queue.
+
+    Every vehicle in the network lives in one VehicleStore, keyed by global
+    approach (junction * 4 + direction), so each step moves all of them in a
+    single vectorized update. Each junction's signals run in an
+    IntersectionSimulation used as a controller. Vehicles enter at boundary
+    approaches as Poisson arrivals and cross a junction. They are then handed
+    to the neighbouring junction in the same direction after the link's
+    travel time, or leave at the network edge. Arrivals and handoffs are
+    events in one priority queue. Controllers only tick while their junction
+    has vehicles; an idle junction catches its signals up in one jump when
+    its next vehicle arrives, and when the network is empty time jumps to
+    the next event. Idle junctions therefore cost nothing per step.
+    """
+
+    def __init__(self, rows, cols, link_seconds=10, arrival_rate=0.2, seed=None, steps_per_second=10,
+                 offsets=None, vehicle_mix=None, junction_options=None):
+        self.rows = rows
+        self.cols = cols
+        self.steps_per_second = steps_per_second
+        self.link_steps = int(link_seconds * steps_per_second)
+        self.arrival_rate = arrival_rate
+        self.random = random.Random(seed)
+        self.vehicle_mix = dict(vehicle_mix or {'car': 0.6, 'bus': 0.1, 'truck': 0.1, 'bike': 0.2})
+        self.type_numbers = {name: number for number, name in vehicleTypes.items()}
+
+        junctions = rows * cols
+        approaches = junctions * noOfSignals
+        options = dict(junction_options or {})
+        self.controllers = [
+            IntersectionSimulation(steps_per_second=steps_per_second, arrival_rates={d: 0 for d in range(noOfSignals)},
+                                   signal_offset=offsets[index] if offsets is not None else 0, **options)
+            for index in range(junctions)
+        ]
+        self.store = VehicleStore(noOfLanes)
+        self.stop_distances = np.tile([stop_distance(directionNumbers[d]) for d in range(noOfSignals)], junctions).astype(np.float64)
+        self.exit_distances = np.tile([exit_distance(directionNumbers[d]) for d in range(noOfSignals)], junctions).astype(np.float64)
+        self.green = np.zeros(approaches, dtype=bool)
+        self.tails = {}
+        self.vehicles_at = np.zeros(junctions, dtype=np.int64)
+
+        # Per-approach counters
+        self.arrived = np.zeros(approaches, dtype=np.int64)
+        self.crossed = np.zeros(approaches, dtype=np.int64)
+        self.wait_steps = np.zeros(approaches, dtype=np.int64)
+        self.queue_sum = np.zeros(approaches, dtype=np.int64)
+        self.max_queue = np.zeros(approaches, dtype=np.int64)
+
+        self.events = []
+        self.sequence = 0
+        self.active = set()
+        self.time_step = 0
+        self.stats = {'entered': 0, 'handoffs': 0, 'left': 0, 'steps_simulated': 0, 'events': 0}
+        for index in range(junctions):
+            for d in range(noOfSignals):
+                if self.neighbour(index, d, upstream=True) is None and arrival_rate > 0:
+                    self._schedule_arrival(index, d, 0)
+
+    @classmethod
+    def corridor(cls, count, link_seconds=10, green_wave=True, **kwargs):
+        """A line of junctions, west to east, optionally with green-wave offsets for eastbound traffic."""
+        offsets = None
+        if green_wave:
+            steps_per_second = kwargs.get('steps_per_second', 10)
+            probe = IntersectionSimulation(steps_per_second=steps_per_second, **kwargs.get('junction_options', {}))
+            offsets = green_wave_offsets(count, link_seconds, probe.cycle_length(), steps_per_second)
+        return cls(1, count, link_seconds=link_seconds, offsets=offsets, **kwargs)
+
+    def neighbour(self, index, direction_number, upstream=False):
+        # Junction reached by leaving `index` in a direction (or feeding it, with upstream=True)
+        row, col = divmod(index, self.cols)
+        d_row, d_col = directionSteps[direction_number]
+        if upstream:
+            d_row, d_col = -d_row, -d_col
+        row, col = row + d_row, col + d_col
+        if 0 <= row < self.rows and 0 <= col < self.cols:
+            return row * self.cols + col
+        return None
+
+    # Events
+
+    def _push(self, step, kind, index, payload):
+        heapq.heappush(self.events, (step, self.sequence, kind, index, payload))
+        self.sequence += 1
+
+    def _schedule_arrival(self, index, direction_number, after):
+        # Exponential inter-arrival times, rounded to whole steps
+        delay = self.random.expovariate(self.arrival_rate) * self.steps_per_second
+        self._push(after + max(1, int(delay)), 'arrival', index, direction_number)
+
+    def _apply(self, kind, index, payload):
+        self.stats['events'] += 1
+        if kind == 'arrival':
+            vehicle_type = self.random.choices(list(self.vehicle_mix), list(self.vehicle_mix.values()))[0]
+            self._add_vehicle(index, payload, vehicle_type, self.random.randrange(noOfLanes))
+            self.stats['entered'] += 1
+            self._schedule_arrival(index, payload, self.time_step)
+        else:
+            direction_number, lane, vehicle_type = payload
+            self._add_vehicle(index, direction_number, vehicle_type, lane)
+
+    def _add_vehicle(self, index, direction_number, vehicle_type, lane):
+        self._wake(index)
+        approach = index * noOfSignals + direction_number
+        # Queue behind the lane's last vehicle, upstream of the edge if the lane is full
+        distance = 0.0
+        last = self.tails.get((approach, lane))
+        if last is not None:
+            try:
+                row = self.store.index_of(last)
+                rear = self.store.distance[row] - self.store.length[row]
+                if rear < gap:
+                    distance = rear - gap
+            except KeyError:
+                pass
+        self.tails[(approach, lane)] = self.store.add(approach, lane, self.type_numbers[vehicle_type],
+                                                      vehicleLengths[vehicle_type], speeds[vehicle_type], distance,
+                                                      self.time_step)
+        self.arrived[approach] += 1
+        self.vehicles_at[index] += 1
+
+    def _wake(self, index):
+        if index in self.active:
+            return
+        controller = self.controllers[index]
+        controller.advance_idle(self.time_step - controller.step_count)
+        self._update_green(index)
+        self.active.add(index)
+
+    def _update_green(self, index):
+        controller = self.controllers[index]
+        start = index * noOfSignals
+        self.green[start:start + noOfSignals] = [controller.is_green(d) for d in range(noOfSignals)]
+
+    # Stepping
+
+    def run(self, duration):
+        """Advance `duration` simulated seconds and return metrics()."""
+        end = self.time_step + int(duration * self.steps_per_second)
+        while self.time_step < end:
+            while self.events and self.events[0][0] <= self.time_step:
+                _, _, kind, index, payload = heapq.heappop(self.events)
+                self._apply(kind, index, payload)
+            if self.store.count == 0:
+                # Nothing moving: idle junctions catch up when woken, so jump to the next event
+                self.active.clear()
+                if not self.events or self.events[0][0] >= end:
+                    break
+                self.time_step = self.events[0][0]
+                continue
+            self._step()
+        self.time_step = end
+        for controller in self.controllers:
+            controller.advance_idle(end - controller.step_count)
+        return self.metrics()
+
+    def _step(self):
+        queues, crossings, waits = self.store.step(self.stop_distances, self.exit_distances, self.green, gap)
+        self.crossed += crossings
+        self.wait_steps += waits
+        self.stats['steps_simulated'] += 1
+
+        if self.store.exited is not None:
+            approaches, lanes, types = self.store.exited
+            np.subtract.at(self.vehicles_at, approaches // noOfSignals, 1)
+            for approach, lane, vehicle_type in zip(approaches.tolist(), lanes.tolist(), types.tolist()):
+                index, direction_number = divmod(approach, noOfSignals)
+                target = self.neighbour(index, direction_number)
+                if target is None:
+                    self.stats['left'] += 1
+                    continue
+                self.stats['handoffs'] += 1
+                self._push(self.time_step + 1 + self.link_steps, 'handoff', target,
+                           (direction_number, lane, vehicleTypes[vehicle_type]))
+
+        self.time_step += 1
+        if self.time_step % self.steps_per_second == 0:
+            self.queue_sum += queues
+            np.maximum(self.max_queue, queues, out=self.max_queue)
+            # Only junctions with vehicles tick; empty ones go back to sleep
+            for index in list(self.active):
+                if self.vehicles_at[index] == 0:
+                    self.active.discard(index)
+                    continue
+                controller = self.controllers[index]
+                controller.advance_idle(self.time_step - controller.step_count)
+                self._update_green(index)
+
+    # Metrics
+
+    def junction_metrics(self, index):
+        seconds = max(self.time_step / self.steps_per_second, 1)
+        approaches = {}
+        for d in range(noOfSignals):
+            a = index * noOfSignals + d
+            approaches[directionNumbers[d]] = {
+                'arrived': int(self.arrived[a]),
+                'throughput': int(self.crossed[a]),
+                'average_wait': self.wait_steps[a] / self.steps_per_second / self.crossed[a] if self.crossed[a] else 0.0,
+                'average_queue': self.queue_sum[a] / seconds,
+                'max_queue': int(self.max_queue[a])
+            }
+        return approaches
+
+    def metrics(self):
+        crossed = int(self.crossed.sum())
+        return dict(self.stats, **{
+            'time': self.time_step / self.steps_per_second,
+            'junctions': len(self.controllers),
+            'crossings': crossed,
+            'average_wait': float(self.wait_steps.sum() / self.steps_per_second / crossed) if crossed else 0.0,
+            'in_network': self.store.count,
+            'per_junction': [self.junction_metrics(i) for i in range(len(self.controllers))]
+        })
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Multi-intersection network simulation')
+    parser.add_argument('--rows', type=int, default=1)
+    parser.add_argument('--cols', type=int, default=10)
+    parser.add_argument('--duration', type=int, default=600, help='Simulated seconds')
+    parser.add_argument('--link-seconds', type=float, default=10)
+    parser.add_argument('--arrival-rate', type=float, default=0.2, help='Vehicles per second per boundary approach')
+    parser.add_argument('--green-wave', action='store_true', help='Offset signals for eastbound progression')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    kwargs = {'arrival_rate': args.arrival_rate, 'seed': args.seed}
+    if args.rows == 1:
+        network = RoadNetwork.corridor(args.cols, args.link_seconds, green_wave=args.green_wave, **kwargs)
+    else:
+        network = RoadNetwork(args.rows, args.cols, args.link_seconds, **kwargs)
+    metrics = network.run(args.duration)
+    metrics.pop('per_junction')
+    print(json.dumps(metrics, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+import os
+import csv
+import json
+import random
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from sim_core import IntersectionSimulation, defaultGreen, defaultRed, defaultYellow, noOfSignals
+from timing import AdaptiveTiming, DEFAULT_WEIGHTS
+
+# Plan parameters: green (every approach) or green_<n>, yellow, red, and with adaptive=True
+# the AdaptiveTiming min_time, max_time, base_time and weight_<type>
+INTEGER_PARAMS = {'green', 'yellow', 'red', 'min_time', 'max_time', 'base_time'} | {f'green_{d}' for d in range(noOfSignals)}
+
+def _simulation_args(plan):
+    green_times = dict(defaultGreen)
+    if plan.get('green') is not None:
+        green_times = {d: int(plan['green']) for d in range(noOfSignals)}
+    for d in range(noOfSignals):
+        if plan.get(f'green_{d}') is not None:
+            green_times[d] = int(plan[f'green_{d}'])
+
+    timing_policy = None
+    if plan.get('adaptive'):
+        weights = {v: float(plan.get(f'weight_{v}', w)) for v, w in DEFAULT_WEIGHTS.items()}
+        timing_policy = AdaptiveTiming(weights, plan.get('min_time', 20), plan.get('max_time', 60), plan.get('base_time', 30))
+    return {
+        'green_times': green_times,
+        'yellow': int(plan.get('yellow', defaultYellow)),
+        'red': int(plan.get('red', defaultRed)),
+        'timing_policy': timing_policy
+    }
+
+def run_scenario(plan, seed, duration=300, scenario=None):
+    """Run one seeded scenario under one timing plan and return a flat result row."""
+    sim = IntersectionSimulation(seed=seed, **_simulation_args(plan), **(scenario or {}))
+    metrics = sim.run(duration)
+    row = {'plan': json.dumps(plan, sort_keys=True), 'seed': seed}
+    row.update({k: v for k, v in plan.items()})
+    row.update({k: metrics[k] for k in ('throughput', 'average_wait', 'average_queue')})
+    for direction, approach in metrics['approaches'].items():
+        for key in ('throughput', 'average_wait', 'average_queue', 'max_queue'):
+            row[f'{direction}_{key}'] = approach[key]
+    return row
+
+def _run(args):
+    return run_scenario(*args)
+
+def evaluate(plans, seeds, duration=300, scenario=None, workers=None):
+    """Run every plan on every seed in a process pool; rows come back in plan, seed order.
+
+    All plans see the same seeds, i.e. the same arrivals, so differences
+    between plans are not sampling noise.
+    """
+    jobs = [(plan, seed, duration, scenario) for plan in plans for seed in seeds]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        return [_run(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_run, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+
+def score(rows, objective='average_wait'):
+    # Mean objective over seeds; lower is better (throughput is negated)
+    values = [row[objective] for row in rows]
+    mean = sum(values) / len(values)
+    return -mean if objective == 'throughput' else mean
+
+def summarize(rows, objective='average_wait'):
+    """Per-plan means over seeds, best plan first."""
+    by_plan = {}
+    for row in rows:
+        by_plan.setdefault(row['plan'], []).append(row)
+    summary = []
+    for plan, plan_rows in by_plan.items():
+        entry = {'plan': json.loads(plan), 'seeds': len(plan_rows), 'score': score(plan_rows, objective)}
+        for key in ('throughput', 'average_wait', 'average_queue'):
+            entry[key] = sum(r[key] for r in plan_rows) / len(plan_rows)
+        summary.append(entry)
+    summary.sort(key=lambda e: e['score'])
+    return summary
+
+def grid_plans(space):
+    # space: {param: [values]}
+    names = list(space)
+    return [dict(zip(names, values)) for values in itertools.product(*(space[n] for n in names))]
+
+def random_plans(space, trials, seed=None):
+    # space: {param: [choices] or {'low': .., 'high': ..}}
+    rng = random.Random(seed)
+    plans = []
+    for _ in range(trials):
+        plan = {}
+        for name, values in space.items():
+            if isinstance(values, dict):
+                low, high = values['low'], values['high']
+                plan[name] = rng.randint(low, high) if name in INTEGER_PARAMS else rng.uniform(low, high)
+            else:
+                plan[name] = rng.choice(values)
+        plans.append(plan)
+    return plans
+
+def bayes_search(space, trials, seeds, duration=300, scenario=None, workers=None, objective='average_wait', seed=None):
+    """Sequential model-based search with Optuna's TPE sampler (optional dependency).
+
+    Trials are asked for in batches of `workers` so each batch runs in parallel.
+    """
+    import optuna
+    optuna.logging.set_verbosity(optuna.logging.WARNING)
+    study = optuna.create_study(direction='minimize', sampler=optuna.samplers.TPESampler(seed=seed))
+    workers = workers or os.cpu_count() or 1
+    rows = []
+    while len(study.trials) < trials:
+        batch = [study.ask() for _ in range(min(workers, trials - len(study.trials)))]
+        plans = []
+        for trial in batch:
+            plan = {}
+            for name, values in space.items():
+                if isinstance(values, dict):
+                    suggest = trial.suggest_int if name in INTEGER_PARAMS else trial.suggest_float
+                    plan[name] = suggest(name, values['low'], values['high'])
+                else:
+                    plan[name] = trial.suggest_categorical(name, values)
+            plans.append(plan)
+        batch_rows = evaluate(plans, seeds, duration, scenario, workers)
+        rows.extend(batch_rows)
+        per_plan = len(seeds)
+        for i, trial in enumerate(batch):
+            study.tell(trial, score(batch_rows[i * per_plan:(i + 1) * per_plan], objective))
+    return rows
+
+def search(space, mode='grid', trials=50, seeds=range(10), duration=300, scenario=None, workers=None,
+           objective='average_wait', seed=None):
+    """Evaluate timing plans from `space` and return (best plan summary, all rows)."""
+    seeds = list(seeds)
+    if mode == 'grid':
+        rows = evaluate(grid_plans(space), seeds, duration, scenario, workers)
+    elif mode == 'random':
+        rows = evaluate(random_plans(space, trials, seed), seeds, duration, scenario, workers)
+    elif mode == 'bayes':
+        rows = bayes_search(space, trials, seeds, duration, scenario, workers, objective, seed)
+    else:
+        raise ValueError(f'Unknown search mode: {mode}')
+    return summarize(rows, objective)[0], rows
+
+def write_table(rows, path):
+    """Write result rows as CSV, or Parquet when the path ends in .parquet (needs pyarrow)."""
+    columns = []
+    for row in rows:
+        columns.extend(k for k in row if k not in columns)
+    if path.endswith('.parquet'):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        pq.write_table(pa.Table.from_pylist(rows), path)
+        return
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Monte Carlo evaluation and search of signal timing plans')
+    parser.add_argument('space', help='JSON search space (or a path to one), e.g. {"green": [10, 20, 30]}')
+    parser.add_argument('--mode', choices=('grid', 'random', 'bayes'), default='grid')
+    parser.add_argument('--trials', type=int, default=50, help='Plans tried in random/bayes mode')
+    parser.add_argument('--seeds', type=int, default=10, help='Scenarios per plan')
+    parser.add_argument('--duration', type=int, default=300, help='Simulated seconds per scenario')
+    parser.add_argument('--arrival-rate', type=float, default=None, help='Vehicles per second per approach')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--objective', choices=('average_wait', 'average_queue', 'throughput'), default='average_wait')
+    parser.add_argument('--seed', type=int, default=None, help='Seed for the search itself')
+    parser.add_argument('--out', default='timing_results.csv', help='.csv or .parquet results table')
+    args = parser.parse_args(argv)
+
+    if os.path.exists(args.space):
+        with open(args.space, encoding='utf-8') as f:
+            space = json.load(f)
+    else:
+        space = json.loads(args.space)
+    scenario = None
+    if args.arrival_rate is not None:
+        scenario = {'arrival_rates': {d: args.arrival_rate for d in range(noOfSignals)}}
+
+    best, rows = search(space, args.mode, args.trials, range(args.seeds), args.duration, scenario, args.workers,
+                        args.objective, args.seed)
+    write_table(rows, args.out)
+    print(json.dumps({'best': best, 'rows': len(rows), 'table': args.out}, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,354 @@
+import random
+import numpy as np
+from vehicle_store import VehicleStore
+
+# Signal timers (seconds)
+defaultGreen = {0: 10, 1: 10, 2: 10, 3: 10}
+defaultRed = 150
+defaultYellow = 5
+
+noOfSignals = 4
+noOfLanes = 3
+
+# Distance travelled per simulation step (px)
+speeds = {'car': 2.25, 'bus': 1.8, 'truck': 1.8, 'bike': 2.5}
+vehicleTypes = {0: 'car', 1: 'bus', 2: 'truck', 3: 'bike'}
+typeNumbers = {name: number for number, name in vehicleTypes.items()}
+directionNumbers = {0: 'right', 1: 'down', 2: 'left', 3: 'up'}
+
+# Vehicle length along the direction of travel (px)
+vehicleLengths = {'car': 40, 'bus': 70, 'truck': 65, 'bike': 22}
+
+# Layout of the 1400x800 junction: spawn coordinates per lane and stop lines
+width = 1400
+height = 800
+x = {'right': [0, 0, 0], 'down': [755, 727, 697], 'left': [1400, 1400, 1400], 'up': [602, 627, 657]}
+y = {'right': [348, 370, 398], 'down': [0, 0, 0], 'left': [498, 466, 436], 'up': [800, 800, 800]}
+stopLines = {'right': 590, 'down': 330, 'left': 800, 'up': 535}
+
+# Gap between vehicles
+gap = 15    # px
+
+# Per direction: axis ('x' or 'y') and sign of travel
+directionAxes = {'right': ('x', 1), 'down': ('y', 1), 'left': ('x', -1), 'up': ('y', -1)}
+
+def stop_distance(direction):
+    # Distance from the spawn edge to the stop line, measured along the direction of travel
+    axis, sign = directionAxes[direction]
+    start = x[direction][0] if axis == 'x' else y[direction][0]
+    return (stopLines[direction] - start) * sign
+
+def exit_distance(direction):
+    # Distance after which a vehicle has left the screen
+    return width if directionAxes[direction][0] == 'x' else height
+
+class Signal:
+    def __init__(self, red, yellow, green):
+        self.red = red
+        self.yellow = yellow
+        self.green = green
+        self.signalText = ""
+
+class Vehicle:
+    """View of one vehicle row in a VehicleStore, with the attributes of the old Vehicle object.
+
+    `distance` is how far its front has travelled from the spawn edge.
+    """
+    __slots__ = ('store', 'id')
+
+    def __init__(self, store, vehicle_id):
+        self.store = store
+        self.id = vehicle_id
+
+    @property
+    def _row(self):
+        return self.store.index_of(self.id)
+
+    @property
+    def direction_number(self):
+        return int(self.store.direction[self._row])
+
+    @property
+    def direction(self):
+        return directionNumbers[self.direction_number]
+
+    @property
+    def vehicle_type(self):
+        return vehicleTypes[int(self.store.vehicle_type[self._row])]
+
+    @property
+    def path_number(self):
+        return int(self.store.lane[self._row])
+
+    @property
+    def length(self):
+        return float(self.store.length[self._row])
+
+    @property
+    def speed(self):
+        return float(self.store.speed[self._row])
+
+    @property
+    def distance(self):
+        return float(self.store.distance[self._row])
+
+    @distance.setter
+    def distance(self, value):
+        self.store.distance[self._row] = value
+
+    @property
+    def crossed(self):
+        return int(self.store.crossed[self._row])
+
+    @property
+    def wait_steps(self):
+        return int(self.store.wait_steps[self._row])
+
+    @property
+    def x(self):
+        axis, sign = directionAxes[self.direction]
+        start = x[self.direction][self.path_number]
+        if axis != 'x':
+            return start
+        # x is the left edge, as in the pygame layout
+        return start + self.distance - self.length if sign > 0 else start - self.distance
+
+    @property
+    def y(self):
+        axis, sign = directionAxes[self.direction]
+        start = y[self.direction][self.path_number]
+        if axis != 'y':
+            return start
+        return start + self.distance - self.length if sign > 0 else start - self.distance
+
+class IntersectionSimulation:
+    """Headless, deterministic simulation of the 4-way junction.
+
+    Time advances in fixed steps of 1 / steps_per_second simulated seconds,
+    independent of wall-clock time, so a run takes as long as the CPU needs.
+    Vehicles arrive per approach at `arrival_rates` vehicles per second from
+    a random.Random seeded with `seed`, so equal seeds give equal runs.
+    Signal timers tick once per simulated second. `timing_policy(sim, direction)`,
+    if given, returns the green time of each approach as it turns green.
+    Observers (e.g. a renderer) are called as observer(sim) after every step.
+    `signal_offset` delays this junction's cycle by that many seconds, for
+    coordinating neighbouring junctions.
+    Vehicle state lives in a VehicleStore and moves in one vectorized update
+    per step. Vehicles arriving at a full lane queue upstream of the screen
+    edge (counted as blocked), so dense scenarios keep their whole demand.
+    """
+
+    def __init__(self, seed=None, green_times=None, yellow=defaultYellow, red=defaultRed, steps_per_second=10,
+                 arrival_rates=None, vehicle_mix=None, timing_policy=None, signal_offset=0):
+        self.random = random.Random(seed)
+        self.green_times = dict(green_times or defaultGreen)
+        self.yellow = yellow
+        self.red = red
+        self.steps_per_second = steps_per_second
+        self.arrival_rates = dict(arrival_rates or {i: 0.25 for i in range(noOfSignals)})
+        self.vehicle_mix = dict(vehicle_mix or {'car': 0.6, 'bus': 0.1, 'truck': 0.1, 'bike': 0.2})
+        self.timing_policy = timing_policy
+        self.observers = []
+
+        self.step_count = 0
+        self.current_time = 0
+        self.store = VehicleStore(noOfLanes)
+        self.crossed_counts = [0] * noOfSignals
+        self.stop_distances = np.array([stop_distance(directionNumbers[d]) for d in range(noOfSignals)], dtype=np.float64)
+        self.exit_distances = np.array([exit_distance(directionNumbers[d]) for d in range(noOfSignals)], dtype=np.float64)
+        self.signals = [Signal(self.red, self.yellow, self.green_times[i]) for i in range(noOfSignals)]
+        self.currentGreen = 0
+        self.nextGreen = 1
+        self.currentYellow = 0
+        self.stats = {d: {'arrived': 0, 'blocked': 0, 'crossed': 0, 'wait_steps': 0, 'queue_sum': 0,
+                          'max_queue': 0, 'green_seconds': 0}
+                      for d in range(noOfSignals)}
+        self._start_cycle()
+        # Start part-way through the cycle so this junction lags by signal_offset seconds
+        for _ in range(-int(signal_offset) % self.cycle_length()):
+            self._tick_signals()
+
+    def cycle_length(self):
+        # Seconds for all approaches to get one green and yellow under the fixed green times
+        return sum(self.green_times[d] + self.yellow for d in range(noOfSignals))
+
+    def add_observer(self, observer):
+        self.observers.append(observer)
+
+    @property
+    def vehicles(self):
+        # {direction: {lane: [Vehicle, front first], 'crossed': n}} as in the original simulator
+        lanes = {directionNumbers[d]: {**{lane: [] for lane in range(noOfLanes)}, 'crossed': self.crossed_counts[d]}
+                 for d in range(noOfSignals)}
+        store = self.store
+        for row in range(store.count):
+            direction = directionNumbers[int(store.direction[row])]
+            lanes[direction][int(store.lane[row])].append(Vehicle(store, int(store.id[row])))
+        return lanes
+
+    def add_vehicle(self, direction_number, vehicle_type, path_number):
+        # Queues behind the last vehicle in the lane (upstream of the screen edge if it is full)
+        rear = self.store.tail_rears(noOfSignals * noOfLanes)[direction_number * noOfLanes + path_number]
+        self.stats[direction_number]['arrived'] += 1
+        return Vehicle(self.store, self._add(direction_number, vehicle_type, path_number, rear))
+
+    def _add(self, direction_number, vehicle_type, path_number, rear):
+        distance = 0.0
+        if rear < gap:
+            self.stats[direction_number]['blocked'] += 1
+            distance = rear - gap
+        return self.store.add(direction_number, path_number, typeNumbers[vehicle_type], vehicleLengths[vehicle_type],
+                              speeds[vehicle_type], distance, self.step_count)
+
+    # Stepping
+
+    def run(self, duration):
+        """Advance `duration` simulated seconds and return metrics()."""
+        for _ in range(int(duration * self.steps_per_second)):
+            self.step()
+        return self.metrics()
+
+    def step(self):
+        self._spawn()
+        queues = self._move_vehicles()
+        self.step_count += 1
+        if self.step_count % self.steps_per_second == 0:
+            self.current_time += 1
+            for d in range(noOfSignals):
+                stats = self.stats[d]
+                stats['queue_sum'] += queues[d]
+                stats['max_queue'] = max(stats['max_queue'], queues[d])
+            self.stats[self.currentGreen]['green_seconds'] += 1
+            self._tick_signals()
+        for observer in self.observers:
+            observer(self)
+
+    def advance_idle(self, steps):
+        """Skip `steps` steps with no vehicles present: only signal timers advance."""
+        if self.store.count:
+            raise ValueError('advance_idle needs an empty junction')
+        target = self.step_count + int(steps)
+        # Jump from one whole second to the next instead of stepping
+        while True:
+            next_second = (self.step_count // self.steps_per_second + 1) * self.steps_per_second
+            if next_second > target:
+                self.step_count = target
+                return
+            self.step_count = next_second
+            self.current_time += 1
+            self.stats[self.currentGreen]['green_seconds'] += 1
+            self._tick_signals()
+
+    def is_green(self, direction_number):
+        return direction_number == self.currentGreen and self.currentYellow == 0
+
+    def _spawn(self):
+        types = list(self.vehicle_mix)
+        weights = list(self.vehicle_mix.values())
+        rears = None
+        for d in range(noOfSignals):
+            if self.arrival_rates[d] <= 0 or self.random.random() >= self.arrival_rates[d] / self.steps_per_second:
+                continue
+            vehicle_type = self.random.choices(types, weights)[0]
+            lane = self.random.randrange(noOfLanes)
+            self.stats[d]['arrived'] += 1
+            if rears is None:
+                rears = self.store.tail_rears(noOfSignals * noOfLanes)
+            key = d * noOfLanes + lane
+            row = self.store.index_of(self._add(d, vehicle_type, lane, rears[key]))
+            rears[key] = self.store.distance[row] - self.store.length[row]
+
+    def _move_vehicles(self):
+        # Moves every vehicle one step; returns the number stopped before the line per approach
+        green = np.array([self.is_green(d) for d in range(noOfSignals)])
+        queues, crossings, waits = self.store.step(self.stop_distances, self.exit_distances, green, gap)
+        for d in range(noOfSignals):
+            if crossings[d]:
+                self.crossed_counts[d] += int(crossings[d])
+                self.stats[d]['crossed'] += int(crossings[d])
+                self.stats[d]['wait_steps'] += int(waits[d])
+        return [int(q) for q in queues]
+
+    # Signals
+
+    def _start_cycle(self):
+        signal = self.signals[self.currentGreen]
+        signal.green = self._green_time(self.currentGreen)
+        signal.yellow = 0
+        signal.signalText = signal.green
+        # The next approach waits for the rest of this green plus yellow
+        self.signals[self.nextGreen].red = signal.green + self.yellow
+        self.signals[self.nextGreen].signalText = self.signals[self.nextGreen].red
+
+    def _green_time(self, direction_number):
+        if self.timing_policy is not None:
+            return int(self.timing_policy(self, direction_number))
+        return self.green_times[direction_number]
+
+    def _tick_signals(self):
+        for i, signal in enumerate(self.signals):
+            if i != self.currentGreen and signal.red > 0:
+                signal.red -= 1
+                signal.signalText = signal.red
+
+        current = self.signals[self.currentGreen]
+        if self.currentYellow == 0:
+            if current.green > 0:
+                current.green -= 1
+            if current.green == 0:
+                self.currentYellow = 1
+                current.yellow = self.yellow
+            current.signalText = current.yellow if self.currentYellow else current.green
+            return
+
+        current.yellow -= 1
+        current.signalText = current.yellow
+        if current.yellow > 0:
+            return
+        current.red = self.red
+        current.yellow = 0
+        current.green = 0
+        current.signalText = current.red
+        self.currentGreen = self.nextGreen
+        self.nextGreen = (self.currentGreen + 1) % noOfSignals
+        self.currentYellow = 0
+        self._start_cycle()
+
+    # Metrics
+
+    def approach_counts(self, direction_number):
+        # Vehicles per type waiting to cross on one approach, as the detector would count them
+        counts = self.approach_count_matrix()[direction_number]
+        return {vehicleTypes[i]: int(counts[i]) for i in range(len(vehicleTypes))}
+
+    def approach_count_matrix(self):
+        # (approaches, vehicle types) counts of vehicles waiting to cross, types in vehicleTypes order
+        store = self.store
+        n = store.count
+        waiting = ~store.crossed[:n]
+        types = len(vehicleTypes)
+        flat = store.direction[:n][waiting].astype(np.int64) * types + store.vehicle_type[:n][waiting]
+        return np.bincount(flat, minlength=noOfSignals * types).reshape(noOfSignals, types)
+
+    def metrics(self):
+        seconds = max(self.current_time, 1)
+        approaches = {}
+        for d in range(noOfSignals):
+            stats = self.stats[d]
+            approaches[directionNumbers[d]] = {
+                'arrived': stats['arrived'],
+                'blocked': stats['blocked'],
+                'throughput': stats['crossed'],
+                'average_wait': stats['wait_steps'] / self.steps_per_second / stats['crossed'] if stats['crossed'] else 0.0,
+                'average_queue': stats['queue_sum'] / seconds,
+                'max_queue': stats['max_queue'],
+                'green_seconds': stats['green_seconds']
+            }
+        crossed = sum(s['crossed'] for s in self.stats.values())
+        return {
+            'time': self.current_time,
+            'throughput': crossed,
+            'average_wait': sum(s['wait_steps'] for s in self.stats.values()) / self.steps_per_second / crossed if crossed else 0.0,
+            'average_queue': sum(a['average_queue'] for a in approaches.values()),
+            'approaches': approaches
+        }
@@ -1,15 +1,9 @@
-import pygame
 import sys
-import os
-import random
-import time
-import threading
-from vehicle_detection import VehicleDetection
-
-# Initialize Pygame
-pygame.init()
+import json
+import argparse
+from sim_core import IntersectionSimulation, noOfSignals, directionNumbers, stopLines, width, height
+
 simulation_time = 300
-current_time = 0
 
 # Colors
 black = (0, 0, 0)
@@ -18,163 +12,93 @@ red = (255, 0, 0)
 yellow = (255, 255, 0)
 green = (0, 255, 0)
 blue = (0, 0, 255)
+grey = (128, 128, 128)
 
-# Window Dimensions
-width = 1400
-height = 800
-screen = pygame.display.set_mode((width, height))
-pygame.display.set_caption("Traffic Signal Timer")
-
-# Signal Timers
-defaultGreen = {0: 10, 1: 10, 2: 10, 3: 10}
-defaultRed = 150
-defaultYellow = 5
-
-signals = []
-noOfSignals = 4
-currentGreen = 0   # Indicates which signal is green
-nextGreen = (currentGreen + 1) % noOfSignals
-currentYellow = 0   # Indicates whether yellow signal is on or off 
-
-speeds = {'car': 2.25, 'bus': 1.8, 'truck': 1.8, 'bike': 2.5}  
-vehicles = {'right': {0:[], 1:[], 2:[], 'crossed':0}, 'down': {0:[], 1:[], 2:[], 'crossed':0}, 
-            'left': {0:[], 1:[], 2:[], 'crossed':0}, 'up': {0:[], 1:[], 2:[], 'crossed':0}}
-vehicleTypes = {0:'car', 1:'bus', 2:'truck', 3:'bike'}
-directionNumbers = {0:'right', 1:'down', 2:'left', 3:'up'}
+vehicleColors = {'car': blue, 'bus': (255, 128, 0), 'truck': (128, 0, 128), 'bike': black}
+vehicleWidths = {'car': 20, 'bus': 25, 'truck': 25, 'bike': 10}
 
 # Coordinates of signal image, timer, and vehicle count
 signalCoods = [(530, 230), (810, 230), (810, 570), (530, 570)]
 signalTimerCoods = [(530, 210), (810, 210), (810, 550), (530, 550)]
 vehicleCountCoods = [(480, 210), (880, 210), (880, 550), (480, 550)]
-vehicleCountTexts = ["0", "0", "0", "0"]
-
-# Gap between vehicles
-gap = 15    # px
-
-# Initialize signals
-class Signal:
-    def __init__(self, red, yellow, green):
-        self.red = red
-        self.yellow = yellow
-        self.green = green
-        self.signalText = ""
-        
-# Initialize signal objects
-for i in range(noOfSignals):
-    signals.append(Signal(defaultRed, defaultYellow, defaultGreen[i]))
-    signals[i].signalText = "30"
-    
-class Vehicle:
-    def __init__(self, direction_number, vehicle_type, path_number):
-        self.x = None
-        self.y = None
-        self.direction_number = direction_number
-        self.vehicle_type = vehicle_type
-        self.path_number = path_number
-        self.crossed = 0
-        vehicles[directionNumbers[direction_number]][path_number].append(self)
-        self.index = len(vehicles[directionNumbers[direction_number]][path_number]) - 1
-        
-def initialize():
-    ts1 = threading.Thread(target=updateValues, args=())
-    ts1.daemon = True
-    ts1.start()
-    repeat()
-
-def repeat():
-    global currentGreen, currentYellow, nextGreen
-    while simulation_time > current_time:
-        updateSignalAndVehicles()
-        time.sleep(1)
-        
-def updateValues():
-    global current_time
-    while simulation_time > current_time:
-        time.sleep(1)
-        current_time += 1
-        
-def updateSignalAndVehicles():
-    global currentGreen, currentYellow, nextGreen
-    if currentYellow == 0:
-        if (signals[currentGreen].green > 0):
-            signals[currentGreen].green -= 1
-            for i in range(noOfSignals):  
-                if i == currentGreen:
-                    if signals[i].yellow == 0:
-                        signals[i].signalText = signals[i].green
-                else:
-                    if signals[i].red > 0:
-                        signals[i].red -= 1
-                    if signals[i].red == 0:
-                        currentYellow = 1
-                        signals[i].yellow = defaultYellow
-                        signals[i].signalText = signals[i].yellow
-            updateVehicles()
-        else:
-            currentYellow = 1
-            for i in range(noOfSignals):
-                if i == currentGreen:
-                    signals[i].yellow = defaultYellow
-                    signals[i].signalText = signals[i].yellow
-    else:
-        if(signals[currentGreen].yellow > 0):
-            signals[currentGreen].yellow -= 1
-            signals[currentGreen].signalText = signals[i].yellow
-            updateVehicles()
-        else:
-            signals[currentGreen].red = defaultRed
-            signals[currentGreen].yellow = 0
-            signals[currentGreen].green = 0
-            signals[currentGreen].signalText = signals[currentGreen].red
-            currentGreen = nextGreen
-            nextGreen = (currentGreen + 1) % noOfSignals
-            signals[nextGreen].red = defaultRed
-            signals[nextGreen].yellow = 0
-            signals[nextGreen].green = defaultGreen[nextGreen]
-            signals[nextGreen].signalText = signals[nextGreen].green
-            currentYellow = 0
-            
-def updateVehicles():
-    for direction in vehicles:
-        for lane in vehicles[direction]:
-            if lane == 'crossed':
-                continue
-            for vehicle in vehicles[direction][lane]:
-                if vehicle.crossed == 0:
-                    if direction == 'right':
-                        if vehicle.x + vehicle.image.get_rect().width > stopLines[direction]:
-                            vehicle.crossed = 1
-                        else:
-                            vehicle.x += speeds[vehicle.vehicle_type]
-                    elif direction == 'down':
-                        if vehicle.y + vehicle.image.get_rect().height > stopLines[direction]:
-                            vehicle.crossed = 1
-                        else:
-                            vehicle.y += speeds[vehicle.vehicle_type]
-                    elif direction == 'left':
-                        if vehicle.x < stopLines[direction]:
-                            vehicle.crossed = 1
-                        else:
-                            vehicle.x -= speeds[vehicle.vehicle_type]
-                    elif direction == 'up':
-                        if vehicle.y < stopLines[direction]:
-                            vehicle.crossed = 1
-                        else:
-                            vehicle.y -= speeds[vehicle.vehicle_type]
-                            
-def main():
-    global current_time
-    initialize()
-    while True:
+
+class PygameRenderer:
+    """Draws an IntersectionSimulation after each step; add it with sim.add_observer.
+
+    pygame is only imported, and the window only opened, when a renderer is
+    created, so the simulation core runs headless without it. Frames are
+    paced to the simulation's steps_per_second, i.e. real time.
+    """
+
+    def __init__(self, steps_per_second=10):
+        import pygame
+        self.pygame = pygame
+        pygame.init()
+        self.screen = pygame.display.set_mode((width, height))
+        pygame.display.set_caption("Traffic Signal Timer")
+        self.font = pygame.font.Font(None, 30)
+        self.clock = pygame.time.Clock()
+        self.steps_per_second = steps_per_second
+
+    def __call__(self, sim):
+        pygame = self.pygame
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 sys.exit()
 
-        screen.fill(white)
-        for i in range(0, noOfSignals):  
-            drawSignal(i)
-            displaySignalTimer(i)
+        self.screen.fill(white)
+        drawStopLines(self.screen, pygame)
+        for direction in sim.vehicles.values():
+            for lane in range(len(direction) - 1):
+                for vehicle in direction[lane]:
+                    drawVehicle(self.screen, pygame, vehicle)
+        for i in range(0, noOfSignals):
+            drawSignal(self.screen, pygame, sim, i)
+            displaySignalTimer(self.screen, self.font, sim, i)
+            displayVehicleCount(self.screen, self.font, sim, i)
         pygame.display.update()
+        self.clock.tick(self.steps_per_second)
+
+def drawStopLines(screen, pygame):
+    pygame.draw.line(screen, grey, (stopLines['right'], 330), (stopLines['right'], 430), 2)
+    pygame.draw.line(screen, grey, (690, stopLines['down']), (790, stopLines['down']), 2)
+    pygame.draw.line(screen, grey, (stopLines['left'], 420), (stopLines['left'], 520), 2)
+    pygame.draw.line(screen, grey, (590, stopLines['up']), (690, stopLines['up']), 2)
+
+def drawVehicle(screen, pygame, vehicle):
+    length, breadth = vehicle.length, vehicleWidths[vehicle.vehicle_type]
+    size = (length, breadth) if vehicle.direction in ('right', 'left') else (breadth, length)
+    pygame.draw.rect(screen, vehicleColors[vehicle.vehicle_type], pygame.Rect((vehicle.x, vehicle.y), size))
+
+def drawSignal(screen, pygame, sim, i):
+    if i == sim.currentGreen:
+        color = yellow if sim.currentYellow else green
+    else:
+        color = red
+    pygame.draw.circle(screen, black, signalCoods[i], 16)
+    pygame.draw.circle(screen, color, signalCoods[i], 12)
+
+def displaySignalTimer(screen, font, sim, i):
+    text = font.render(str(sim.signals[i].signalText), True, white, black)
+    screen.blit(text, signalTimerCoods[i])
+
+def displayVehicleCount(screen, font, sim, i):
+    count = sim.vehicles[directionNumbers[i]]['crossed']
+    text = font.render(str(count), True, black, white)
+    screen.blit(text, vehicleCountCoods[i])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Traffic signal simulation')
+    parser.add_argument('--duration', type=int, default=simulation_time, help='Simulated seconds')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--headless', action='store_true', help='Run as fast as possible and print metrics')
+    args = parser.parse_args(argv)
+
+    sim = IntersectionSimulation(seed=args.seed)
+    if not args.headless:
+        sim.add_observer(PygameRenderer(sim.steps_per_second))
+    metrics = sim.run(args.duration)
+    print(json.dumps(metrics, indent=2))
 
 if __name__ == '__main__':
     main()
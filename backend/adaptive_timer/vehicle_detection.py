@@ -1,49 +1,91 @@
-import cv2
+"""Vehicle counting for the signal timer, on the detector interface shared with the video analysis API.
+
+Import it as a package module with backend/ on the import path (the Flask app's
+working directory), e.g. `from adaptive_timer.vehicle_detection import VehicleDetection`.
+"""
+import os
 import numpy as np
-from darkflow.net.build import TFNet
-import json
-import base64
+from detectors import get_detector
+from .timing import VEHICLE_TYPES, DEFAULT_WEIGHTS, LABEL_TYPES, weight_array, count_array, green_times, apply_green_times
+
+MODEL_DIR = os.path.dirname(os.path.abspath(__file__))
 
 class VehicleDetection:
-    def __init__(self):
-        self.options = {
-            'model': 'cfg/yolo.cfg',
-            'load': 'bin/yolov2.weights',
-            'threshold': 0.3,
-            'gpu': 1.0
-        }
-        self.tfnet = TFNet(self.options)
+    def __init__(self, batch_size=16, weights=None, min_time=20, max_time=60, base_time=30, backend='opencv',
+                 model=None, **detector_options):
+        # Defaults to the YOLOv2 Darknet files on OpenCV DNN (CPU); any detectors backend works
+        if backend == 'opencv' and model is None:
+            model = os.path.join(MODEL_DIR, 'bin', 'yolov2.weights')
+            detector_options.setdefault('config', os.path.join(MODEL_DIR, 'cfg', 'yolo.cfg'))
+        detector_options.setdefault('conf', 0.3)
+        detector_options.setdefault('imgsz', 608 if backend == 'opencv' else 640)
+        self.detector = get_detector(backend, model, **detector_options)
+        self.batch_size = batch_size
+        # Timing parameters; min/max/base may also be arrays, e.g. one value per intersection
+        self.weights = weight_array(weights or DEFAULT_WEIGHTS)
+        self.min_time = min_time
+        self.max_time = max_time
+        self.base_time = base_time
         
     def detect_vehicles(self, image):
-        results = self.tfnet.return_predict(image)
-        vehicles = {'car': 0, 'bus': 0, 'truck': 0, 'bike': 0}
-        
-        for result in results:
-            label = result['label']
-            if label in vehicles:
-                vehicles[label] += 1
-                
-        return vehicles
+        counts = self.detect_batch([image])[0]
+        return {vehicle_type: int(counts[i]) for i, vehicle_type in enumerate(VEHICLE_TYPES)}
         
     def process_frame(self, frame):
         vehicles = self.detect_vehicles(frame)
         return vehicles
         
+    def detect_batch(self, frames):
+        """Count vehicles in many frames with one detector call per batch_size frames.
+
+        Returns an (n, len(VEHICLE_TYPES)) array of counts. Detector labels are
+        mapped with LABEL_TYPES, so motorcycles and bicycles count as 'bike'.
+        """
+        counts = np.zeros((len(frames), len(VEHICLE_TYPES)), dtype=np.int64)
+        for start in range(0, len(frames), self.batch_size):
+            detections = self.detector.predict(frames[start:start + self.batch_size])
+            # Model class id -> VEHICLE_TYPES column (-1 for everything else)
+            names = self.detector.names
+            lookup = np.full(max(names) + 1 if names else 0, -1, dtype=np.int64)
+            for model_id, label in names.items():
+                if label in LABEL_TYPES:
+                    lookup[model_id] = VEHICLE_TYPES.index(LABEL_TYPES[label])
+            for offset, boxes in enumerate(detections):
+                columns = lookup[boxes[:, 5].astype(np.int64)]
+                counts[start + offset] = np.bincount(columns[columns >= 0], minlength=len(VEHICLE_TYPES))
+        return counts
+
+    def detect_intersections(self, frames):
+        """Counts and green times for every approach of many intersections at once.
+
+        `frames` is a list per intersection of one frame per approach. All frames
+        go through the detector as one batch, and every green time comes from one
+        vectorized green_times call. Returns (counts, greens) shaped
+        (intersections, approaches, types) and (intersections, approaches).
+        """
+        approaches = max(len(feeds) for feeds in frames)
+        flat = [frame for feeds in frames for frame in feeds]
+        detected = self.detect_batch(flat)
+        counts = np.zeros((len(frames), approaches, len(VEHICLE_TYPES)), dtype=np.int64)
+        position = 0
+        for i, feeds in enumerate(frames):
+            counts[i, :len(feeds)] = detected[position:position + len(feeds)]
+            position += len(feeds)
+        return counts, self.green_times(counts)
+
+    def green_times(self, counts):
+        return green_times(counts, self.weights, self.min_time, self.max_time, self.base_time)
+
+    def control_signals(self, signals, frames):
+        """Closed loop: detect on every approach and write the green times into Signal objects.
+
+        `signals` is a list per intersection of its Signal objects (e.g. the
+        signals of a simulation), in the same approach order as `frames`.
+        """
+        counts, greens = self.detect_intersections(frames)
+        for intersection_signals, intersection_greens in zip(signals, greens):
+            apply_green_times(intersection_signals, intersection_greens[:len(intersection_signals)])
+        return counts, greens
+
     def adjust_signal_timing(self, vehicles):
-        total_vehicles = sum(vehicles.values())
-        if total_vehicles == 0:
-            return 30  # default time
-            
-        # Weight different vehicle types
-        weights = {'car': 1, 'bus': 2.5, 'truck': 2.5, 'bike': 0.5}
-        weighted_count = sum(vehicles[v] * weights[v] for v in vehicles)
-        
-        # Calculate green time based on weighted vehicle count
-        min_time = 20
-        max_time = 60
-        base_time = 30
-        
-        green_time = base_time + (weighted_count - total_vehicles) * 5
-        green_time = max(min_time, min(max_time, green_time))
-        
-        return int(green_time)
+        return int(self.green_times(count_array(vehicles)))
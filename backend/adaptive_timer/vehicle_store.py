@@ -0,0 +1,154 @@
+import numpy as np
+
+class VehicleStore:
+    """Structure-of-arrays state for every vehicle in a simulation.
+
+    One row per vehicle, in arrival order; rows are compacted as vehicles
+    leave, so ids stay sorted and a row is found by binary search. Each step
+    moves all vehicles with a handful of array operations: vehicles are
+    grouped by lane (a stable sort keeps them front to back), and the gap to
+    the vehicle ahead is enforced with a segmented cumulative minimum, which
+    gives the same positions as updating the lane front to back in a loop.
+    """
+
+    def __init__(self, lanes_per_direction, capacity=256):
+        self.lanes_per_direction = lanes_per_direction
+        self.count = 0
+        self.next_id = 0
+        self.id = np.zeros(capacity, dtype=np.int64)
+        self.direction = np.zeros(capacity, dtype=np.int32)
+        self.lane = np.zeros(capacity, dtype=np.int8)
+        self.vehicle_type = np.zeros(capacity, dtype=np.int8)
+        self.length = np.zeros(capacity, dtype=np.float64)
+        self.speed = np.zeros(capacity, dtype=np.float64)
+        self.distance = np.zeros(capacity, dtype=np.float64)
+        self.crossed = np.zeros(capacity, dtype=bool)
+        self.wait_steps = np.zeros(capacity, dtype=np.int32)
+        self.spawned_at = np.zeros(capacity, dtype=np.int64)
+        # (direction, lane, vehicle_type) arrays of vehicles that left in the last step, or None
+        self.exited = None
+
+    _columns = ('id', 'direction', 'lane', 'vehicle_type', 'length', 'speed', 'distance', 'crossed',
+                'wait_steps', 'spawned_at')
+
+    def add(self, direction, lane, vehicle_type, length, speed, distance, spawned_at):
+        row = self.count
+        if row == len(self.id):
+            for name in self._columns:
+                setattr(self, name, _resized(getattr(self, name), row * 2))
+        self.id[row] = self.next_id
+        self.direction[row] = direction
+        self.lane[row] = lane
+        self.vehicle_type[row] = vehicle_type
+        self.length[row] = length
+        self.speed[row] = speed
+        self.distance[row] = distance
+        self.crossed[row] = False
+        self.wait_steps[row] = 0
+        self.spawned_at[row] = spawned_at
+        self.count += 1
+        self.next_id += 1
+        return self.next_id - 1
+
+    def index_of(self, vehicle_id):
+        row = int(np.searchsorted(self.id[:self.count], vehicle_id))
+        if row == self.count or self.id[row] != vehicle_id:
+            raise KeyError(vehicle_id)
+        return row
+
+    def lane_keys(self):
+        n = self.count
+        return self.direction[:n].astype(np.int64) * self.lanes_per_direction + self.lane[:n]
+
+    def tail_rears(self, lanes):
+        # Rear position of the last vehicle in every lane (inf for empty lanes)
+        rears = np.full(lanes, np.inf)
+        n = self.count
+        np.minimum.at(rears, self.lane_keys(), self.distance[:n] - self.length[:n])
+        return rears
+
+    def step(self, stop, exit_at, green, gap):
+        """Move every vehicle one step.
+
+        `stop`, `exit_at` and `green` are per-direction arrays. Returns per-direction
+        arrays of (vehicles stopped before the line, vehicles that crossed this
+        step, total wait steps of those vehicles).
+        """
+        directions = len(stop)
+        n = self.count
+        self.exited = None
+        if n == 0:
+            empty = np.zeros(directions, dtype=np.int64)
+            return empty, empty, empty
+        order = np.argsort(self.lane_keys(), kind='stable')
+        keys = self.lane_keys()[order]
+        direction = self.direction[:n][order]
+        distance = self.distance[:n][order]
+        length = self.length[:n][order]
+        crossed = self.crossed[:n][order]
+        stop_at = stop[direction]
+
+        desired = distance + self.speed[:n][order]
+        held = ~crossed & ~green[direction]
+        desired = np.where(held, np.minimum(desired, np.maximum(distance, stop_at)), desired)
+
+        # new_i = min(desired_i, new_(i-1) - length_(i-1) - gap) along each lane, i.e. a
+        # cumulative minimum of desired + offset, with each lane shifted so lanes don't mix
+        spacing = length + gap
+        starts = np.r_[True, keys[1:] != keys[:-1]]
+        group = np.cumsum(starts) - 1
+        ahead = np.cumsum(spacing) - spacing
+        offset = ahead - ahead[np.nonzero(starts)[0]][group]
+        shift = (np.abs(desired).max() + offset.max() + 1.0) * 2 * group
+        new = np.minimum.accumulate(desired + offset - shift) + shift - offset
+
+        moved = new > distance + 1e-6
+        new = np.where(moved, new, distance)
+        stopped = ~moved & ~crossed
+        newly_crossed = ~crossed & (new > stop_at)
+
+        rows = order
+        self.distance[rows] = new
+        self.wait_steps[rows[stopped]] += 1
+        self.crossed[rows[newly_crossed]] = True
+
+        queues = np.bincount(direction[stopped], minlength=directions)
+        crossings = np.bincount(direction[newly_crossed], minlength=directions)
+        waits = np.bincount(direction[newly_crossed], weights=self.wait_steps[rows[newly_crossed]],
+                            minlength=directions).astype(np.int64)
+
+        gone = new - length > exit_at[direction]
+        if gone.any():
+            rows_gone = rows[gone]
+            self.exited = (self.direction[rows_gone].copy(), self.lane[rows_gone].copy(),
+                           self.vehicle_type[rows_gone].copy())
+            keep = np.ones(n, dtype=bool)
+            keep[rows_gone] = False
+            self._compact(keep)
+        return queues, crossings, waits
+
+    def _compact(self, keep):
+        n = self.count
+        kept = int(keep.sum())
+        for name in self._columns:
+            array = getattr(self, name)
+            array[:kept] = array[:n][keep]
+        self.count = kept
+
+    def rows(self, direction=None, lane=None):
+        # Row indices front to back, optionally for one direction / lane
+        n = self.count
+        mask = np.ones(n, dtype=bool)
+        if direction is not None:
+            mask &= self.direction[:n] == direction
+        if lane is not None:
+            mask &= self.lane[:n] == lane
+        return np.nonzero(mask)[0]
+
+    def __len__(self):
+        return self.count
+
+def _resized(array, size):
+    grown = np.zeros((size,) + array.shape[1:], dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
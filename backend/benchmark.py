@@ -0,0 +1,392 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import multiprocessing
+from datetime import datetime
+import cv2
+import numpy as np
+from detectors import Detector
+
+SIM_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'adaptive_timer')
+
+# Rendered vehicle colours (BGR); the synthetic detector finds vehicles by these
+VEHICLE_COLOURS = {'car': (0, 0, 255), 'truck': (255, 0, 0), 'bus': (0, 255, 255), 'motorcycle': (0, 255, 0)}
+VEHICLE_SIZES = {'car': (60, 30), 'truck': (110, 40), 'bus': (130, 42), 'motorcycle': (28, 14)}
+
+def latency_summary(samples):
+    # Seconds -> count, mean and tail latencies in milliseconds
+    values = np.asarray(samples, dtype=np.float64) * 1000
+    if not len(values):
+        return {'count': 0}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'count': len(values), 'mean_ms': float(values.mean()), 'p50_ms': float(p50), 'p95_ms': float(p95),
+            'p99_ms': float(p99), 'max_ms': float(values.max())}
+
+def peak_rss_mb():
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def timed(function, stages, name):
+    # Wrap a callable so its wall time accumulates into stages[name]
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            stages[name] = stages.get(name, 0.0) + time.perf_counter() - started
+    return wrapper
+
+# Synthetic inputs
+
+def plate_text(rng):
+    letters = 'ABCDEFGHJKLMNPRSTUVWXYZ'
+    return (''.join(rng.choice(list(letters), 2)) + f'{rng.integers(1, 100):02d}' +
+            ''.join(rng.choice(list(letters), 2)) + f'{rng.integers(0, 10000):04d}')
+
+def render_plate_image(text, rng, width=800, height=600):
+    """A car rear with a white, black-bordered number plate reading `text`."""
+    image = np.full((height, width, 3), rng.integers(40, 120), dtype=np.uint8)
+    image += rng.integers(0, 20, image.shape, dtype=np.uint8)
+    body = tuple(int(c) for c in rng.integers(30, 220, 3))
+    cv2.rectangle(image, (width // 8, height // 4), (width * 7 // 8, height * 7 // 8), body, -1)
+
+    plate_w, plate_h = int(width * rng.uniform(0.32, 0.42)), int(height * rng.uniform(0.09, 0.12))
+    x = width // 2 - plate_w // 2 + int(rng.integers(-40, 40))
+    y = height * 3 // 5 + int(rng.integers(-30, 30))
+    cv2.rectangle(image, (x, y), (x + plate_w, y + plate_h), (255, 255, 255), -1)
+    cv2.rectangle(image, (x, y), (x + plate_w, y + plate_h), (0, 0, 0), 3)
+    scale = plate_h / 40
+    (text_w, text_h), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, scale, 2)
+    cv2.putText(image, text, (x + (plate_w - text_w) // 2, y + (plate_h + text_h) // 2), cv2.FONT_HERSHEY_SIMPLEX,
+                scale, (0, 0, 0), 2, cv2.LINE_AA)
+    return image
+
+def render_plates(directory, count, seed=0):
+    # Writes `count` plate images as JPEGs and returns (path, text) pairs
+    rng = np.random.default_rng(seed)
+    plates = []
+    for i in range(count):
+        text = plate_text(rng)
+        path = os.path.join(directory, f'plate_{i:04d}.jpg')
+        cv2.imwrite(path, render_plate_image(text, rng))
+        plates.append((path, text))
+    return plates
+
+def render_traffic_video(path, frames=300, width=640, height=360, fps=25, vehicles=12, seed=0):
+    """Write an MJPG video of coloured vehicles driving along a four-lane road."""
+    rng = np.random.default_rng(seed)
+    road = np.full((height, width, 3), 90, dtype=np.uint8)
+    lanes = 4
+    lane_h = height // lanes
+    for lane in range(1, lanes):
+        for x in range(0, width, 40):
+            cv2.line(road, (x, lane * lane_h), (x + 20, lane * lane_h), (255, 255, 255), 2)
+
+    names = list(VEHICLE_COLOURS)
+    cars = [{
+        'type': names[rng.choice(len(names), p=[0.6, 0.15, 0.1, 0.15])],
+        'lane': int(rng.integers(lanes)),
+        'x': float(rng.uniform(-width, width)),
+        'speed': float(rng.uniform(2, 8))
+    } for _ in range(vehicles)]
+
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, (width, height))
+    try:
+        for _ in range(frames):
+            frame = road.copy()
+            for car in cars:
+                w, h = VEHICLE_SIZES[car['type']]
+                # Even lanes drive east, odd lanes west; vehicles wrap around at the edges
+                car['x'] += car['speed'] if car['lane'] % 2 == 0 else -car['speed']
+                if car['x'] > width:
+                    car['x'] = -w
+                elif car['x'] < -w:
+                    car['x'] = width
+                y = car['lane'] * lane_h + (lane_h - h) // 2
+                cv2.rectangle(frame, (int(car['x']), y), (int(car['x']) + w, y + h), VEHICLE_COLOURS[car['type']], -1)
+            writer.write(frame)
+    finally:
+        writer.release()
+    return path
+
+# Stub models
+
+class SyntheticDetector(Detector):
+    """Vehicle detector stand-in for rendered videos: finds vehicles by colour.
+
+    `latency_ms` per frame emulates model cost, so pipeline overlap can be
+    measured without downloading or running a real model.
+    """
+    backend = 'synthetic'
+
+    def __init__(self, latency_ms=0.0, **kwargs):
+        super().__init__('synthetic', **kwargs)
+        self.latency = latency_ms / 1000
+
+    def _load(self):
+        self.model = VEHICLE_COLOURS
+        self.names = dict(enumerate(VEHICLE_COLOURS))
+
+    def _predict(self, frames, imgsz):
+        detections = []
+        for frame in frames:
+            boxes = []
+            for class_id, colour in enumerate(VEHICLE_COLOURS.values()):
+                # Tolerate JPEG colour noise around the rendered colour
+                lower = np.array([0 if c < 128 else 170 for c in colour], dtype=np.uint8)
+                upper = np.array([90 if c < 128 else 255 for c in colour], dtype=np.uint8)
+                count, _, stats, _ = cv2.connectedComponentsWithStats(cv2.inRange(frame, lower, upper))
+                for x, y, w, h, area in stats[1:count]:
+                    if area >= 100:
+                        boxes.append([x, y, x + w, y + h, 0.9, class_id])
+            detections.append(np.array(boxes, dtype=np.float32).reshape(-1, 6))
+        if self.latency:
+            time.sleep(self.latency * len(frames))
+        return detections
+
+class StubReader:
+    """EasyOCR reader stand-in: reads `text` from any crop after `latency_ms`."""
+
+    def __init__(self, text='MH12AB1234', confidence=0.9, latency_ms=0.0):
+        self.text = text
+        self.confidence = confidence
+        self.latency = latency_ms / 1000
+
+    def _read(self, image):
+        if self.latency:
+            time.sleep(self.latency)
+        h, w = image.shape[:2]
+        return [([[0, 0], [w, 0], [w, h], [0, h]], self.text, self.confidence)]
+
+    def readtext(self, image):
+        return self._read(image)
+
+    def readtext_batched(self, images, **kwargs):
+        return [self._read(image) for image in images]
+
+# Benchmarks; each returns one result entry
+
+def bench_video(options, workdir):
+    from frame_sampler import FrameSampler
+    from result_store import ResultStore
+    from yolo_processor import YOLOProcessor
+
+    class RecordingStore(ResultStore):
+        # Timestamps every progress update, i.e. every processed batch
+        def set_progress(self, task_id, progress, results):
+            batch_times.append(time.perf_counter())
+            super().set_progress(task_id, progress, results)
+
+    render_started = time.perf_counter()
+    path = render_traffic_video(os.path.join(workdir, 'traffic.avi'), frames=options['video_frames'],
+                                seed=options['seed'])
+    render_seconds = time.perf_counter() - render_started
+
+    detector = SyntheticDetector(latency_ms=options['inference_ms'])
+    processor = YOLOProcessor(batch_size=options['batch_size'], result_store=RecordingStore(), detector=detector)
+    stages = {}
+    latencies = []
+    frames = 0
+    elapsed = 0.0
+    for run in range(options['repeats']):
+        batch_times = []
+        started = time.perf_counter()
+        results = processor.process_video(path, f'bench-{run}', sampler=FrameSampler(stride=options['stride']))
+        elapsed += time.perf_counter() - started
+        latencies.extend(np.diff([started] + batch_times))
+        frames += results['performance']['frames_analyzed']
+        for stage, seconds in results['performance']['stage_seconds'].items():
+            stages[stage] = stages.get(stage, 0.0) + seconds
+
+    return {
+        'throughput': frames / elapsed if elapsed else 0.0,
+        'unit': 'frames/s',
+        'items': frames,
+        'elapsed': elapsed,
+        'latency': latency_summary(latencies),
+        'latency_of': f"batch of {options['batch_size']} frames",
+        'stages': stages,
+        'setup_seconds': render_seconds
+    }
+
+def bench_anpr(options, workdir):
+    from anpr_processor import ANPRProcessor
+
+    plates = render_plates(workdir, options['plates'], options['seed'])
+    processor = ANPRProcessor(reader=StubReader(latency_ms=options['ocr_ms']))
+    stages = {}
+    for name in ('preprocess_image', 'find_plate_candidates', 'extract_plate_text', 'check_registration_status'):
+        setattr(processor, name, timed(getattr(processor, name), stages, name))
+
+    latencies = []
+    failures = 0
+    for run in range(options['repeats']):
+        # Every pass does the full work; the OCR cache would otherwise answer repeats
+        processor.ocr_cache.clear()
+        processor.registration_cache.clear()
+        for path, _ in plates:
+            started = time.perf_counter()
+            result = json.loads(processor.process_image(path))
+            latencies.append(time.perf_counter() - started)
+            failures += 'error' in result
+    elapsed = float(sum(latencies))
+    # imread, JSON encoding and logging are whatever the named stages do not cover
+    stages['other'] = elapsed - sum(stages.values())
+
+    return {
+        'throughput': len(latencies) / elapsed if elapsed else 0.0,
+        'unit': 'images/s',
+        'items': len(latencies),
+        'elapsed': elapsed,
+        'latency': latency_summary(latencies),
+        'latency_of': 'process_image call',
+        'stages': stages,
+        'failures': failures
+    }
+
+def bench_simulation(options, workdir):
+    if SIM_DIR not in sys.path:
+        sys.path.insert(0, SIM_DIR)
+    from sim_core import IntersectionSimulation
+
+    sim = IntersectionSimulation(seed=options['seed'])
+    # Fill the approaches before measuring
+    sim.run(60)
+    stages = {}
+    for name in ('_spawn', '_move_vehicles', '_tick_signals'):
+        setattr(sim, name, timed(getattr(sim, name), stages, name))
+
+    latencies = np.zeros(options['sim_steps'])
+    for i in range(options['sim_steps']):
+        started = time.perf_counter()
+        sim.step()
+        latencies[i] = time.perf_counter() - started
+    elapsed = float(latencies.sum())
+    return {
+        'throughput': len(latencies) / elapsed if elapsed else 0.0,
+        'unit': 'steps/s',
+        'items': len(latencies),
+        'elapsed': elapsed,
+        'latency': latency_summary(latencies),
+        'latency_of': 'IntersectionSimulation.step',
+        'stages': stages,
+        'vehicles': sim.store.count
+    }
+
+BENCHMARKS = {'video': bench_video, 'anpr': bench_anpr, 'simulation': bench_simulation}
+
+def run_benchmark(name, options):
+    """Run one benchmark in the current process and add its peak RSS."""
+    workdir = tempfile.mkdtemp(prefix=f'bench_{name}_')
+    try:
+        result = BENCHMARKS[name](options, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+def run_isolated(name, options):
+    # A fresh process per benchmark keeps peak RSS and warm caches from leaking between them
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        return pool.apply(run_benchmark, (name, options))
+
+def environment():
+    info = {
+        'timestamp': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__
+    }
+    try:
+        info['commit'] = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                        cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        info['commit'] = None
+    return info
+
+def compare(baseline, current, tolerance=0.1):
+    """Per-benchmark changes against a baseline report; a regression is throughput down or p95 up by > tolerance."""
+    rows = []
+    for name, result in current['benchmarks'].items():
+        base = baseline.get('benchmarks', {}).get(name)
+        if base is None:
+            continue
+        throughput = result['throughput'] / base['throughput'] - 1 if base['throughput'] else 0.0
+        p95, base_p95 = result['latency'].get('p95_ms'), base['latency'].get('p95_ms')
+        latency = p95 / base_p95 - 1 if p95 is not None and base_p95 else 0.0
+        rows.append({
+            'benchmark': name,
+            'throughput_change': throughput,
+            'p95_change': latency,
+            'peak_rss_change_mb': result['peak_rss_mb'] - base['peak_rss_mb'],
+            'regression': throughput < -tolerance or latency > tolerance
+        })
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks for the video, ANPR and simulation hot paths on synthetic inputs')
+    parser.add_argument('benchmarks', nargs='*', help=f"Any of {', '.join(sorted(BENCHMARKS))} (default: all)")
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--video-frames', type=int, default=300)
+    parser.add_argument('--stride', type=int, default=1, help='Analyze every Nth video frame')
+    parser.add_argument('--batch-size', type=int, default=4)
+    parser.add_argument('--inference-ms', type=float, default=0.0, help='Emulated detector cost per frame')
+    parser.add_argument('--plates', type=int, default=100)
+    parser.add_argument('--ocr-ms', type=float, default=0.0, help='Emulated OCR cost per crop')
+    parser.add_argument('--sim-steps', type=int, default=5000)
+    parser.add_argument('--in-process', action='store_true', help='Run in this process instead of one per benchmark')
+    parser.add_argument('--out', default='benchmark_results.json')
+    parser.add_argument('--baseline', help='Earlier results JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='Relative change counted as a regression')
+    args = parser.parse_args(argv)
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    options = {
+        'repeats': args.repeats,
+        'seed': args.seed,
+        'video_frames': args.video_frames,
+        'stride': args.stride,
+        'batch_size': args.batch_size,
+        'inference_ms': args.inference_ms,
+        'plates': args.plates,
+        'ocr_ms': args.ocr_ms,
+        'sim_steps': args.sim_steps
+    }
+    report = {'environment': environment(), 'options': options, 'benchmarks': {}}
+    for name in args.benchmarks or sorted(BENCHMARKS):
+        run = run_benchmark if args.in_process else run_isolated
+        result = run(name, options)
+        report['benchmarks'][name] = result
+        latency = result['latency']
+        print(f"{name:<11} {result['throughput']:10.1f} {result['unit']:<9} p50 {latency.get('p50_ms', 0):8.2f} ms  "
+              f"p95 {latency.get('p95_ms', 0):8.2f} ms  p99 {latency.get('p99_ms', 0):8.2f} ms  "
+              f"peak RSS {result['peak_rss_mb']:.0f} MB")
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            report['comparison'] = compare(json.load(f), report, args.tolerance)
+        for row in report['comparison']:
+            flag = 'REGRESSION' if row['regression'] else 'ok'
+            print(f"{row['benchmark']:<11} throughput {row['throughput_change']:+.1%}  p95 {row['p95_change']:+.1%}  {flag}")
+            exit_code = exit_code or int(row['regression'])
+
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    return exit_code
+
+if __name__ == '__main__':
+    sys.exit(main())
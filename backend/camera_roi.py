@@ -0,0 +1,149 @@
+import cv2
+import json
+import os
+import numpy as np
+
+def polygon_area(points):
+    # Shoelace formula
+    x, y = points[:, 0], points[:, 1]
+    return float(abs(np.dot(x, np.roll(y, 1)) - np.dot(y, np.roll(x, 1))) / 2)
+
+def points_in_polygon(points, polygon):
+    """Even-odd ray casting for (n, 2) points against one polygon, vectorized over points and edges."""
+    if len(points) == 0:
+        return np.zeros(0, dtype=bool)
+    x, y = points[:, 0:1], points[:, 1:2]
+    x1, y1 = polygon[:, 0], polygon[:, 1]
+    x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+    straddles = (y1 > y) != (y2 > y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        crossing_x = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+    return (straddles & (x < crossing_x)).sum(axis=1) % 2 == 1
+
+def _polygon(value, label):
+    try:
+        points = np.asarray(value, dtype=np.float64)
+    except (TypeError, ValueError):
+        raise ValueError(f'{label} must be a list of at least three [x, y] points')
+    if points.ndim != 2 or points.shape[1] != 2 or len(points) < 3:
+        raise ValueError(f'{label} must be a list of at least three [x, y] points')
+    return points
+
+class CameraROI:
+    """Region of interest and lane polygons for one camera, in full-frame pixels.
+
+    Frames are cropped to the bounding box of the ROI polygon (or of all lanes
+    when no ROI is given) and pixels outside the ROI polygon are blacked out,
+    so inference only sees the road. `imgsz` optionally sets the model input
+    size for the smaller crop. Detections are mapped back to frame coordinates
+    and assigned to the lane containing their bottom-centre point, where the
+    vehicle meets the road.
+
+    Config shape: {"roi": [[x, y], ...], "lanes": {"name": [[x, y], ...]}, "imgsz": 480}
+    """
+
+    def __init__(self, roi=None, lanes=None, imgsz=None):
+        lanes = lanes or {}
+        if not isinstance(lanes, dict):
+            raise ValueError('lanes must be an object of lane name -> polygon')
+        if roi is None and not lanes:
+            raise ValueError('Camera config needs an roi polygon or lanes')
+        self.roi = _polygon(roi, 'roi') if roi is not None else None
+        self.lane_names = list(lanes)
+        self.lane_polygons = [_polygon(points, f'lane {name}') for name, points in lanes.items()]
+        self.lane_areas = [polygon_area(p) for p in self.lane_polygons]
+        if any(area <= 0 for area in self.lane_areas):
+            raise ValueError('Lane polygons must enclose an area')
+        if imgsz and (not isinstance(imgsz, (int, float, str)) or int(imgsz) <= 0):
+            raise ValueError('imgsz must be a positive integer')
+        self.imgsz = int(imgsz) if imgsz else None
+
+        outline = self.roi if self.roi is not None else np.vstack(self.lane_polygons)
+        x0, y0 = np.floor(outline.min(axis=0)).astype(int)
+        x1, y1 = np.ceil(outline.max(axis=0)).astype(int)
+        self.x0, self.y0 = max(0, int(x0)), max(0, int(y0))
+        self.x1, self.y1 = int(x1), int(y1)
+        self.area = polygon_area(self.roi) if self.roi is not None else float((self.x1 - self.x0) * (self.y1 - self.y0))
+        self._mask = None
+
+    @classmethod
+    def from_config(cls, config):
+        if not isinstance(config, dict):
+            raise ValueError('Camera config must be an object')
+        return cls(config.get('roi'), config.get('lanes'), config.get('imgsz'))
+
+    @classmethod
+    def from_options(cls, options, config_path=None):
+        """ROI from a camera_id in the camera config file or an inline roi JSON field; None if neither."""
+        if options.get('roi'):
+            return cls.from_config(json.loads(options['roi']))
+        camera_id = options.get('camera_id')
+        if not camera_id:
+            return None
+        config_path = config_path or os.environ.get('CAMERA_CONFIG', 'cameras.json')
+        if not os.path.exists(config_path):
+            raise ValueError(f'No camera config found at {config_path}')
+        with open(config_path, encoding='utf-8') as f:
+            cameras = json.load(f)
+        if camera_id not in cameras:
+            raise ValueError(f'Unknown camera: {camera_id}')
+        return cls.from_config(cameras[camera_id])
+
+    def crop(self, frame):
+        """Return the ROI crop of a frame, with pixels outside the ROI polygon zeroed."""
+        height, width = frame.shape[:2]
+        crop = frame[self.y0:min(self.y1, height), self.x0:min(self.x1, width)]
+        if self.roi is None:
+            return crop
+        if self._mask is None or self._mask.shape != crop.shape[:2]:
+            # Built once per crop size, then applied with a single multiply
+            mask = np.zeros(crop.shape[:2], dtype=np.uint8)
+            shifted = np.round(self.roi - (self.x0, self.y0)).astype(np.int32)
+            cv2.fillPoly(mask, [shifted], 1)
+            self._mask = mask if crop.ndim == 2 else mask[:, :, None]
+        return crop * self._mask
+
+    def to_frame(self, boxes):
+        # Shift (n, 4+) crop-space boxes back to full-frame coordinates
+        if len(boxes) and (self.x0 or self.y0):
+            boxes = boxes.copy()
+            boxes[:, [0, 2]] += self.x0
+            boxes[:, [1, 3]] += self.y0
+        return boxes
+
+    def assign_lanes(self, boxes):
+        # Lane index per box by its bottom-centre point, -1 outside every lane
+        lane_ids = np.full(len(boxes), -1, dtype=np.int16)
+        if not self.lane_polygons or len(boxes) == 0:
+            return lane_ids
+        anchors = np.column_stack([(boxes[:, 0] + boxes[:, 2]) / 2, boxes[:, 3]])
+        for index, polygon in enumerate(self.lane_polygons):
+            inside = (lane_ids < 0) & points_in_polygon(anchors, polygon)
+            lane_ids[inside] = index
+        return lane_ids
+
+    def lanes(self):
+        return list(zip(self.lane_names, self.lane_areas))
+
+    def config(self):
+        # Config shape (see the class docstring) rebuilt from the parsed polygons
+        return {
+            'roi': self.roi.tolist() if self.roi is not None else None,
+            'lanes': {name: polygon.tolist() for name, polygon in zip(self.lane_names, self.lane_polygons)},
+            'imgsz': self.imgsz
+        }
+
+    def describe(self):
+        return {
+            'enabled': True,
+            'crop': [self.x0, self.y0, self.x1, self.y1],
+            'area': self.area,
+            'imgsz': self.imgsz,
+            'lanes': {name: area for name, area in self.lanes()}
+        }
+
+    def __getstate__(self):
+        # The mask is rebuilt on first use in segment workers
+        state = dict(self.__dict__)
+        state['_mask'] = None
+        return state
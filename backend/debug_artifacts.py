@@ -0,0 +1,92 @@
+import cv2
+import os
+import queue
+import threading
+import logging
+import itertools
+
+logger = logging.getLogger(__name__)
+
+class DebugArtifactSink:
+    """Writes debug images off the request path.
+
+    Disabled by default. When enabled, 1 in `sample_every` requests is sampled
+    and its images are JPEG-encoded and written by a background thread as
+    <directory>/<request_id>_<name>.jpg. If the queue is full, artifacts are
+    dropped instead of blocking the caller.
+    """
+
+    def __init__(self, enabled=False, sample_every=1, directory=None, max_queue=64):
+        self.enabled = enabled
+        self.sample_every = max(1, int(sample_every))
+        self.directory = directory or os.path.join(os.path.dirname(__file__), 'debug')
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.counter = itertools.count()
+        self.dropped = 0
+        self.written = 0
+        self.writer = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            enabled=os.environ.get('ANPR_DEBUG_ARTIFACTS', '0') == '1',
+            sample_every=int(os.environ.get('ANPR_DEBUG_SAMPLE_EVERY', '1')),
+            directory=os.environ.get('ANPR_DEBUG_DIR') or None,
+            max_queue=int(os.environ.get('ANPR_DEBUG_QUEUE_SIZE', '64'))
+        )
+
+    def sample(self, request_id):
+        # Returns the id to save artifacts under, or None if this request is not sampled
+        if not self.enabled:
+            return None
+        if next(self.counter) % self.sample_every != 0:
+            return None
+        # Ids end up in file names, so keep only safe characters
+        return ''.join(c for c in str(request_id) if c.isalnum() or c in '-_') or 'request'
+
+    def save(self, request_id, name, image):
+        if request_id is None or image is None:
+            return
+        self._ensure_writer()
+        try:
+            self.queue.put_nowait((request_id, name, image))
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+
+    def _ensure_writer(self):
+        with self.lock:
+            if self.writer is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self.writer = threading.Thread(target=self._write_loop, name='debug-artifacts', daemon=True)
+                self.writer.start()
+
+    def _write_loop(self):
+        while True:
+            request_id, name, image = self.queue.get()
+            try:
+                path = os.path.join(self.directory, f"{request_id}_{name}.jpg")
+                cv2.imwrite(path, image)
+                with self.lock:
+                    self.written += 1
+                logger.debug(f"Saved debug artifact to {path}")
+            except Exception as e:
+                logger.error(f"Error writing debug artifact: {str(e)}")
+            finally:
+                self.queue.task_done()
+
+    def flush(self):
+        # Block until every queued artifact has been written
+        if self.writer is not None:
+            self.queue.join()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'enabled': self.enabled,
+                'sample_every': self.sample_every,
+                'queued': self.queue.qsize(),
+                'written': self.written,
+                'dropped': self.dropped
+            }
@@ -0,0 +1,415 @@
+import numpy as np
+
+class DetectionStore:
+    """Columnar storage for per-frame vehicle detections.
+
+    Two tables of contiguous NumPy arrays grow by doubling:
+      frames:     frame_number, box_count (kept vehicle boxes, used for density),
+                  frame_area, reused (motion-gated frame)
+      detections: frame_index (row in frames), class_id (index into
+                  class_names), confidence, bbox (x1, y1, x2, y2),
+                  track_id (VehicleTracker id, -1 until tracked),
+                  lane_id (index into lane_names, -1 outside every lane)
+    With lanes (name, area) configured, per-lane densities are kept against
+    each lane's area instead of the whole frame. Frame and lane densities
+    both count the kept detections only (vehicle classes above min_confidence).
+    JSON records in the old frame_by_frame / traffic_density shape are built
+    on demand, one page at a time.
+    """
+
+    def __init__(self, class_names, fps, min_confidence=0.5, capacity=1024, lanes=None):
+        self.class_names = list(class_names)
+        self.fps = fps
+        self.min_confidence = min_confidence
+        self.frame_count = 0
+        self.detection_count = 0
+        self.frame_number = np.zeros(capacity, dtype=np.int64)
+        self.box_count = np.zeros(capacity, dtype=np.int32)
+        self.frame_area = np.zeros(capacity, dtype=np.float64)
+        self.reused = np.zeros(capacity, dtype=bool)
+        self.frame_index = np.zeros(capacity, dtype=np.int32)
+        self.class_id = np.zeros(capacity, dtype=np.int16)
+        self.confidence = np.zeros(capacity, dtype=np.float32)
+        self.bbox = np.zeros((capacity, 4), dtype=np.float32)
+        self.track_id = np.full(capacity, -1, dtype=np.int32)
+        self.lane_id = np.full(capacity, -1, dtype=np.int16)
+        self.lane_names = [name for name, _ in lanes or []]
+        self.lane_area = np.array([area for _, area in lanes or []], dtype=np.float64)
+        self._lookup_names = None
+        self._lookup = None
+        # Running density aggregates. Boxes are summed per frame area, so the mean
+        # is exact and independent of the order frames (or segments) arrive in.
+        self.box_sum_by_area = {}
+        self.density_peak = 0.0
+        self.lane_box_sum = np.zeros(len(self.lane_names), dtype=np.int64)
+        self.lane_peak = np.zeros(len(self.lane_names))
+
+    # Growth
+
+    def _grow_frames(self, needed):
+        if needed <= len(self.frame_number):
+            return
+        size = max(needed, len(self.frame_number) * 2)
+        for name in ('frame_number', 'box_count', 'frame_area', 'reused'):
+            setattr(self, name, _resized(getattr(self, name), size))
+
+    def _grow_detections(self, needed):
+        if needed <= len(self.frame_index):
+            return
+        size = max(needed, len(self.frame_index) * 2)
+        for name in ('frame_index', 'class_id', 'confidence', 'bbox', 'track_id', 'lane_id'):
+            setattr(self, name, _resized(getattr(self, name), size))
+
+    def _class_lookup(self, names):
+        # Model class id -> index in class_names (or -1); built once per names mapping
+        if names is not self._lookup_names:
+            size = max(names) + 1 if names else 0
+            lookup = np.full(size, -1, dtype=np.int16)
+            for model_id, name in names.items():
+                if name in self.class_names:
+                    lookup[model_id] = self.class_names.index(name)
+            self._lookup_names, self._lookup = names, lookup
+        return self._lookup
+
+    def _observe_density(self, box_count, frame_area):
+        frame_area = float(frame_area)
+        self.box_sum_by_area[frame_area] = self.box_sum_by_area.get(frame_area, 0) + int(box_count)
+        self.density_peak = max(self.density_peak, box_count / frame_area)
+
+    def _observe_lanes(self, lane_ids):
+        if not len(self.lane_names):
+            return
+        counts = np.bincount(lane_ids[lane_ids >= 0], minlength=len(self.lane_names))
+        self.lane_box_sum += counts
+        np.maximum(self.lane_peak, counts / self.lane_area, out=self.lane_peak)
+
+    # Appending
+
+    def add_frame(self, frame_number, frame_shape, boxes, names, area=None, lane_ids=None):
+        """Append one analyzed frame.
+
+        `boxes` is the (n, 6+) array from result.boxes.data (x1, y1, x2, y2, ..., conf, cls),
+        transferred from the device once per frame. `area` overrides the frame area
+        (ROI area) and `lane_ids` gives each box's lane. Returns per-class counts as an array.
+        """
+        if len(boxes):
+            classes = self._class_lookup(names)[boxes[:, -1].astype(np.int64)]
+            confidences = boxes[:, -2]
+            keep = (classes >= 0) & (confidences > self.min_confidence)
+        else:
+            classes = np.zeros(0, dtype=np.int16)
+            keep = np.zeros(0, dtype=bool)
+        kept = int(keep.sum())
+
+        # Rows are written before frame_count is raised, so readers never see a frame without its detections
+        row = self.frame_count
+        self._grow_frames(row + 1)
+        self.frame_number[row] = frame_number
+        self.box_count[row] = kept
+        self.frame_area[row] = area if area is not None else frame_shape[0] * frame_shape[1]
+        self.reused[row] = False
+        if kept:
+            start = self.detection_count
+            self._grow_detections(start + kept)
+            self.frame_index[start:start + kept] = row
+            self.class_id[start:start + kept] = classes[keep]
+            self.confidence[start:start + kept] = boxes[keep, -2]
+            self.bbox[start:start + kept] = boxes[keep, :4]
+            self.track_id[start:start + kept] = -1
+            self.lane_id[start:start + kept] = lane_ids[keep] if lane_ids is not None else -1
+            self.detection_count += kept
+        self.frame_count += 1
+        self._observe_density(kept, self.frame_area[row])
+        self._observe_lanes(lane_ids[keep] if lane_ids is not None else np.zeros(0, dtype=np.int16))
+        return np.bincount(classes[keep], minlength=len(self.class_names))
+
+    def add_reused_frame(self, frame_number):
+        """Append a frame that repeats the previous frame's detections (motion-gated)."""
+        if self.frame_count == 0:
+            row = self.frame_count
+            self._grow_frames(row + 1)
+            self.frame_number[row] = frame_number
+            self.box_count[row] = 0
+            self.frame_area[row] = 1.0
+            self.reused[row] = True
+            self.frame_count += 1
+            self._observe_density(0, 1.0)
+            self._observe_lanes(np.zeros(0, dtype=np.int16))
+            return np.zeros(len(self.class_names), dtype=np.int64)
+
+        previous = self.frame_count - 1
+        row = self.frame_count
+        self._grow_frames(row + 1)
+        self.frame_number[row] = frame_number
+        self.box_count[row] = self.box_count[previous]
+        self.frame_area[row] = self.frame_area[previous]
+        self.reused[row] = True
+
+        start, end = self._detection_range(previous)
+        count = end - start
+        if count:
+            dest = self.detection_count
+            self._grow_detections(dest + count)
+            self.frame_index[dest:dest + count] = row
+            self.class_id[dest:dest + count] = self.class_id[start:end]
+            self.confidence[dest:dest + count] = self.confidence[start:end]
+            self.bbox[dest:dest + count] = self.bbox[start:end]
+            self.track_id[dest:dest + count] = self.track_id[start:end]
+            self.lane_id[dest:dest + count] = self.lane_id[start:end]
+            self.detection_count += count
+        self.frame_count += 1
+        self._observe_density(self.box_count[row], self.frame_area[row])
+        self._observe_lanes(self.lane_id[start:end])
+        return np.bincount(self.class_id[start:end], minlength=len(self.class_names))
+
+    def extend(self, other):
+        """Append another store's frames after this store's (segment merge).
+
+        Track ids are not copied; the merged store is tracked afterwards.
+        """
+        frames, detections = other.frame_count, other.detection_count
+        base = self.frame_count
+        self._grow_frames(base + frames)
+        for name in ('frame_number', 'box_count', 'frame_area', 'reused'):
+            getattr(self, name)[base:base + frames] = getattr(other, name)[:frames]
+
+        start = self.detection_count
+        self._grow_detections(start + detections)
+        self.frame_index[start:start + detections] = other.frame_index[:detections] + base
+        for name in ('class_id', 'confidence', 'bbox', 'lane_id'):
+            getattr(self, name)[start:start + detections] = getattr(other, name)[:detections]
+        self.track_id[start:start + detections] = -1
+        self.detection_count += detections
+        self.frame_count += frames
+
+        for area, boxes in other.box_sum_by_area.items():
+            self.box_sum_by_area[area] = self.box_sum_by_area.get(area, 0) + boxes
+        self.density_peak = max(self.density_peak, other.density_peak)
+        self.lane_box_sum += other.lane_box_sum
+        np.maximum(self.lane_peak, other.lane_peak, out=self.lane_peak)
+
+    # Vectorized aggregates
+
+    def densities(self):
+        n = self.frame_count
+        return self.box_count[:n] / self.frame_area[:n]
+
+    def average_density(self):
+        # O(distinct frame sizes), maintained as frames are added
+        if not self.frame_count:
+            return 0.0
+        return sum(boxes / area for area, boxes in self.box_sum_by_area.items()) / self.frame_count
+
+    def lane_summary(self):
+        # Per-lane density against the lane's own area
+        frames = max(self.frame_count, 1)
+        return {
+            name: {
+                'area': float(self.lane_area[i]),
+                'detections': int(self.lane_box_sum[i]),
+                'average_density': float(self.lane_box_sum[i] / (frames * self.lane_area[i])),
+                'peak_density': float(self.lane_peak[i])
+            }
+            for i, name in enumerate(self.lane_names)
+        }
+
+    def vehicle_counts(self, mask=None):
+        # Detections per class, optionally only those selected by a filter() mask
+        classes = self.class_id[:self.detection_count]
+        counts = np.bincount(classes if mask is None else classes[mask], minlength=len(self.class_names))
+        return {name: int(counts[i]) for i, name in enumerate(self.class_names)}
+
+    def frame_counts(self, mask=None):
+        # (frames, classes) matrix of per-frame counts, optionally only masked detections
+        n, d = self.frame_count, self.detection_count
+        flat = self.frame_index[:d].astype(np.int64) * len(self.class_names) + self.class_id[:d]
+        if mask is not None:
+            flat = flat[mask]
+        counts = np.bincount(flat, minlength=n * len(self.class_names))
+        return counts.reshape(n, len(self.class_names))
+
+    def unique_counts(self):
+        # Distinct tracked vehicles per class
+        d = self.detection_count
+        tracked = self.track_id[:d] >= 0
+        pairs = np.unique(np.column_stack([self.class_id[:d][tracked], self.track_id[:d][tracked]]), axis=0)
+        counts = np.bincount(pairs[:, 0], minlength=len(self.class_names)) if len(pairs) else np.zeros(len(self.class_names), dtype=np.int64)
+        return {name: int(counts[i]) for i, name in enumerate(self.class_names)}
+
+    def filter(self, min_confidence=None, class_names=None):
+        """Boolean mask over detections matching a confidence floor and/or classes."""
+        d = self.detection_count
+        mask = np.ones(d, dtype=bool)
+        if min_confidence is not None:
+            mask &= self.confidence[:d] >= min_confidence
+        if class_names is not None:
+            wanted = [self.class_names.index(c) for c in class_names if c in self.class_names]
+            mask &= np.isin(self.class_id[:d], wanted)
+        return mask
+
+    def _detection_range(self, row):
+        # Detections are appended in frame order, so each frame's rows are contiguous
+        indices = self.frame_index[:self.detection_count]
+        return int(np.searchsorted(indices, row, 'left')), int(np.searchsorted(indices, row, 'right'))
+
+    # JSON export
+
+    def frame_records(self, offset=0, limit=None):
+        end = self.frame_count if limit is None else min(self.frame_count, offset + limit)
+        if offset >= end:
+            return []
+        start_det, _ = self._detection_range(offset)
+        _, end_det = self._detection_range(end - 1)
+        classes = len(self.class_names)
+        flat = (self.frame_index[start_det:end_det].astype(np.int64) - offset) * classes + self.class_id[start_det:end_det]
+        counts = np.bincount(flat, minlength=(end - offset) * classes).reshape(end - offset, classes)
+
+        records = []
+        for row in range(offset, end):
+            frame_number = int(self.frame_number[row])
+            records.append({
+                'frame_number': frame_number,
+                'timestamp': frame_number / self.fps if self.fps else 0,
+                'counts': {name: int(counts[row - offset, i]) for i, name in enumerate(self.class_names)},
+                'detections': []
+            })
+            if self.reused[row]:
+                records[-1]['reused'] = True
+        for i in range(start_det, end_det):
+            records[self.frame_index[i] - offset]['detections'].append({
+                'class': self.class_names[self.class_id[i]],
+                'confidence': float(self.confidence[i]),
+                'bbox': [float(v) for v in self.bbox[i]],
+                'track_id': int(self.track_id[i])
+            })
+            if self.lane_names and self.lane_id[i] >= 0:
+                records[self.frame_index[i] - offset]['detections'][-1]['lane'] = self.lane_names[self.lane_id[i]]
+        return records
+
+    def density_records(self, offset=0, limit=None):
+        end = self.frame_count if limit is None else min(self.frame_count, offset + limit)
+        densities = self.densities()
+        records = [
+            {
+                'frame': int(self.frame_number[row]),
+                'density': float(densities[row]),
+                'time': int(self.frame_number[row]) / self.fps if self.fps else 0
+            }
+            for row in range(offset, end)
+        ]
+        if self.lane_names and offset < end:
+            lane_densities = self._lane_counts(offset, end) / self.lane_area
+            for row, record in enumerate(records):
+                record['lanes'] = {name: float(lane_densities[row, i]) for i, name in enumerate(self.lane_names)}
+        return records
+
+    def _lane_counts(self, offset, end):
+        # (frames, lanes) counts for frame rows [offset, end)
+        start_det, _ = self._detection_range(offset)
+        _, end_det = self._detection_range(end - 1)
+        lanes = len(self.lane_names)
+        lane_ids = self.lane_id[start_det:end_det]
+        inside = lane_ids >= 0
+        flat = (self.frame_index[start_det:end_det][inside].astype(np.int64) - offset) * lanes + lane_ids[inside]
+        return np.bincount(flat, minlength=(end - offset) * lanes).reshape(end - offset, lanes)
+
+    # Persistence
+
+    def to_npz(self, path):
+        n, d = self.frame_count, self.detection_count
+        np.savez_compressed(
+            path,
+            class_names=np.array(self.class_names),
+            fps=np.array(self.fps or 0.0),
+            min_confidence=np.array(self.min_confidence),
+            frame_number=self.frame_number[:n],
+            box_count=self.box_count[:n],
+            frame_area=self.frame_area[:n],
+            reused=self.reused[:n],
+            frame_index=self.frame_index[:d],
+            class_id=self.class_id[:d],
+            confidence=self.confidence[:d],
+            bbox=self.bbox[:d],
+            track_id=self.track_id[:d],
+            lane_names=np.array(self.lane_names, dtype=str),
+            lane_area=self.lane_area,
+            lane_id=self.lane_id[:d]
+        )
+
+    @classmethod
+    def from_npz(cls, path):
+        with np.load(path) as data:
+            store = cls([str(c) for c in data['class_names']], float(data['fps']),
+                        float(data['min_confidence']), capacity=1)
+            for name in ('frame_number', 'box_count', 'frame_area', 'reused',
+                         'frame_index', 'class_id', 'confidence', 'bbox'):
+                setattr(store, name, data[name])
+            # Stores written before tracking existed have no track ids
+            store.track_id = data['track_id'] if 'track_id' in data.files else np.full(len(store.frame_index), -1, dtype=np.int32)
+            if 'lane_id' in data.files:
+                store.lane_names = [str(n) for n in data['lane_names']]
+                store.lane_area = data['lane_area']
+                store.lane_id = data['lane_id']
+            else:
+                store.lane_id = np.full(len(store.frame_index), -1, dtype=np.int16)
+        store.frame_count = len(store.frame_number)
+        store.detection_count = len(store.frame_index)
+        for area in np.unique(store.frame_area):
+            store.box_sum_by_area[float(area)] = int(store.box_count[store.frame_area == area].sum())
+        densities = store.densities()
+        store.density_peak = float(densities.max()) if len(densities) else 0.0
+        store.lane_box_sum = np.bincount(store.lane_id[store.lane_id >= 0], minlength=len(store.lane_names)).astype(np.int64)
+        if store.lane_names and store.frame_count:
+            store.lane_peak = (store._lane_counts(0, store.frame_count) / store.lane_area).max(axis=0)
+        else:
+            store.lane_peak = np.zeros(len(store.lane_names))
+        return store
+
+    def to_arrow(self, path):
+        """Write the flat detection table for analytics: Parquet for *.parquet paths, Feather otherwise.
+
+        pyarrow is optional and only imported here.
+        """
+        import pyarrow as pa
+        d = self.detection_count
+        lane_id = self.lane_id[:d]
+        table = pa.table({
+            'frame_number': self.frame_number[self.frame_index[:d]],
+            'class': pa.DictionaryArray.from_arrays(self.class_id[:d].astype(np.int32), self.class_names),
+            'confidence': self.confidence[:d],
+            'x1': self.bbox[:d, 0],
+            'y1': self.bbox[:d, 1],
+            'x2': self.bbox[:d, 2],
+            'y2': self.bbox[:d, 3],
+            'track_id': self.track_id[:d],
+            # Detections outside every lane are null
+            'lane': pa.DictionaryArray.from_arrays(np.maximum(lane_id, 0).astype(np.int32), self.lane_names or [''],
+                                                   mask=lane_id < 0)
+        })
+        if path.endswith('.parquet'):
+            import pyarrow.parquet as pq
+            pq.write_table(table, path)
+        else:
+            import pyarrow.feather as feather
+            feather.write_feather(table, path)
+        return table
+
+    def __getstate__(self):
+        # Pickle (segment workers -> parent) only the filled part of each buffer
+        state = dict(self.__dict__)
+        n, d = self.frame_count, self.detection_count
+        for name in ('frame_number', 'box_count', 'frame_area', 'reused'):
+            state[name] = state[name][:n].copy()
+        for name in ('frame_index', 'class_id', 'confidence', 'bbox', 'track_id', 'lane_id'):
+            state[name] = state[name][:d].copy()
+        state['_lookup_names'] = None
+        state['_lookup'] = None
+        return state
+
+    def __len__(self):
+        return self.frame_count
+
+def _resized(array, size):
+    grown = np.zeros((size,) + array.shape[1:], dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
@@ -0,0 +1,280 @@
+import os
+import ast
+import time
+import logging
+import threading
+import numpy as np
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+COCO_NAMES = [
+    'person', 'bicycle', 'car', 'motorcycle', 'airplane', 'bus', 'train', 'truck', 'boat', 'traffic light',
+    'fire hydrant', 'stop sign', 'parking meter', 'bench', 'bird', 'cat', 'dog', 'horse', 'sheep', 'cow',
+    'elephant', 'bear', 'zebra', 'giraffe', 'backpack', 'umbrella', 'handbag', 'tie', 'suitcase', 'frisbee',
+    'skis', 'snowboard', 'sports ball', 'kite', 'baseball bat', 'baseball glove', 'skateboard', 'surfboard',
+    'tennis racket', 'bottle', 'wine glass', 'cup', 'fork', 'knife', 'spoon', 'bowl', 'banana', 'apple',
+    'sandwich', 'orange', 'broccoli', 'carrot', 'hot dog', 'pizza', 'donut', 'cake', 'chair', 'couch',
+    'potted plant', 'bed', 'dining table', 'toilet', 'tv', 'laptop', 'mouse', 'remote', 'keyboard', 'cell phone',
+    'microwave', 'oven', 'toaster', 'sink', 'refrigerator', 'book', 'clock', 'vase', 'scissors', 'teddy bear',
+    'hair drier', 'toothbrush'
+]
+
+# Label spellings used by different model families -> one canonical name
+LABEL_ALIASES = {
+    'motorbike': 'motorcycle',
+    'bike': 'motorcycle',
+    'aeroplane': 'airplane',
+    'sofa': 'couch',
+    'tvmonitor': 'tv',
+    'diningtable': 'dining table',
+    'pottedplant': 'potted plant'
+}
+
+def canonical_label(name):
+    return LABEL_ALIASES.get(name, name)
+
+def canonical_names(names):
+    # {class id: model label} (or a list of labels) -> {class id: canonical label}
+    if not isinstance(names, dict):
+        names = dict(enumerate(names))
+    return {int(i): canonical_label(str(name)) for i, name in names.items()}
+
+def letterbox(frame, size):
+    """Resize keeping the aspect ratio and pad to size x size; returns (image, scale, (pad_x, pad_y))."""
+    import cv2
+    height, width = frame.shape[:2]
+    scale = min(size / height, size / width)
+    resized_w, resized_h = int(round(width * scale)), int(round(height * scale))
+    resized = cv2.resize(frame, (resized_w, resized_h), interpolation=cv2.INTER_LINEAR)
+    pad_x, pad_y = (size - resized_w) // 2, (size - resized_h) // 2
+    image = np.full((size, size, 3), 114, dtype=np.uint8)
+    image[pad_y:pad_y + resized_h, pad_x:pad_x + resized_w] = resized
+    return image, scale, (pad_x, pad_y)
+
+def _to_blob(frames, size):
+    # BGR frames -> (n, 3, size, size) float32 RGB batch plus the letterbox transforms
+    images, transforms = [], []
+    for frame in frames:
+        image, scale, pad = letterbox(frame, size)
+        images.append(image[:, :, ::-1])
+        transforms.append((scale, pad))
+    blob = np.ascontiguousarray(np.stack(images).transpose(0, 3, 1, 2), dtype=np.float32) / 255.0
+    return blob, transforms
+
+def _nms(boxes, scores, classes, iou):
+    # Class-aware NMS: offset each class's boxes so they never overlap another class's
+    import cv2
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=np.int64)
+    offsets = classes[:, None] * (boxes.max() + 1)
+    shifted = boxes + offsets
+    xywh = np.column_stack([shifted[:, 0], shifted[:, 1], shifted[:, 2] - shifted[:, 0], shifted[:, 3] - shifted[:, 1]])
+    keep = cv2.dnn.NMSBoxes(xywh.tolist(), scores.tolist(), 0.0, iou)
+    return np.array(keep, dtype=np.int64).reshape(-1)
+
+def decode_yolov8(output, transform, conf, iou):
+    """(4 + classes, anchors) YOLOv8 head output -> (n, 6) x1, y1, x2, y2, conf, cls in frame pixels."""
+    predictions = output.T
+    scores = predictions[:, 4:]
+    classes = scores.argmax(axis=1)
+    confidences = scores[np.arange(len(scores)), classes]
+    keep = confidences > conf
+    predictions, classes, confidences = predictions[keep], classes[keep], confidences[keep]
+
+    scale, (pad_x, pad_y) = transform
+    cx, cy, w, h = predictions[:, 0], predictions[:, 1], predictions[:, 2], predictions[:, 3]
+    boxes = np.column_stack([cx - w / 2 - pad_x, cy - h / 2 - pad_y, cx + w / 2 - pad_x, cy + h / 2 - pad_y]) / scale
+    keep = _nms(boxes, confidences, classes, iou)
+    return np.column_stack([boxes[keep], confidences[keep], classes[keep]]).astype(np.float32)
+
+class Detector:
+    """Common interface of all detector backends.
+
+    predict(frames) returns one (n, 6) float32 array per frame of x1, y1, x2, y2,
+    confidence, class id, in frame pixels; `names` maps class ids to canonical
+    labels (see LABEL_ALIASES). The model is loaded on first use. Backends
+    that are not `thread_safe` serialize predict calls on a lock, so
+    get_detector gives each thread its own instance of them.
+    """
+    backend = None
+    thread_safe = False
+
+    def __init__(self, model, imgsz=640, conf=0.25, iou=0.45, warmup=False):
+        self.model_path = model
+        self.imgsz = imgsz
+        self.conf = conf
+        self.iou = iou
+        self.warmup_on_load = warmup
+        self.names = {}
+        self.model = None
+        self.load_seconds = None
+        self.lock = threading.Lock()
+
+    def ensure_loaded(self):
+        if self.model is not None:
+            return
+        with self.lock:
+            if self.model is not None:
+                return
+            started = time.perf_counter()
+            self._load()
+            self.load_seconds = time.perf_counter() - started
+            metrics.set('model_load_seconds', self.load_seconds, backend=self.backend, model=self.model_path)
+            logger.info(f"Loaded {self.backend} detector {self.model_path} in {self.load_seconds:.2f}s")
+            if self.warmup_on_load:
+                started = time.perf_counter()
+                self._predict([np.zeros((self.imgsz, self.imgsz, 3), dtype=np.uint8)], self.imgsz)
+                metrics.set('model_warmup_seconds', time.perf_counter() - started, backend=self.backend,
+                            model=self.model_path)
+
+    def warmup(self):
+        self.ensure_loaded()
+        with self.lock:
+            self._predict([np.zeros((self.imgsz, self.imgsz, 3), dtype=np.uint8)], self.imgsz)
+
+    def predict(self, frames, imgsz=None):
+        self.ensure_loaded()
+        if self.thread_safe:
+            return self._predict(list(frames), imgsz or self.imgsz)
+        with self.lock:
+            return self._predict(list(frames), imgsz or self.imgsz)
+
+    def _load(self):
+        raise NotImplementedError
+
+    def _predict(self, frames, imgsz):
+        raise NotImplementedError
+
+class UltralyticsDetector(Detector):
+    """Ultralytics YOLO; `device` (e.g. 'cpu', '0') defaults to ultralytics' own choice."""
+    backend = 'ultralytics'
+
+    def __init__(self, model, device=None, **kwargs):
+        super().__init__(model, **kwargs)
+        self.device = device
+
+    def _load(self):
+        from ultralytics import YOLO
+        self.model = YOLO(self.model_path)
+        self.names = canonical_names(self.model.names)
+
+    def _predict(self, frames, imgsz):
+        options = {'device': self.device} if self.device is not None else {}
+        results = self.model(frames, imgsz=imgsz, conf=self.conf, iou=self.iou, verbose=False, **options)
+        return [result.boxes.data.cpu().numpy().astype(np.float32) for result in results]
+
+class OnnxDetector(Detector):
+    """YOLOv8 ONNX export on ONNX Runtime's CPU provider. The input size is fixed by the export.
+
+    InferenceSession.run is thread-safe, so one session serves every thread.
+    """
+    backend = 'onnx'
+    thread_safe = True
+
+    def _load(self):
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.model = onnxruntime.InferenceSession(self.model_path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.model.get_inputs()[0].name
+        shape = self.model.get_inputs()[0].shape
+        if isinstance(shape[2], int):
+            self.imgsz = shape[2]
+        # Ultralytics exports record their class names in the model metadata
+        metadata = self.model.get_modelmeta().custom_metadata_map
+        self.names = canonical_names(ast.literal_eval(metadata['names']) if 'names' in metadata else COCO_NAMES)
+        self.dynamic_batch = not isinstance(shape[0], int)
+
+    def _predict(self, frames, imgsz):
+        blob, transforms = _to_blob(frames, self.imgsz)
+        if self.dynamic_batch:
+            outputs = self.model.run(None, {self.input_name: blob})[0]
+        else:
+            outputs = np.concatenate([self.model.run(None, {self.input_name: blob[i:i + 1]})[0] for i in range(len(blob))])
+        return [decode_yolov8(output, transform, self.conf, self.iou) for output, transform in zip(outputs, transforms)]
+
+class OpenCVDetector(Detector):
+    """OpenCV DNN on the CPU: a YOLOv8 ONNX export, or Darknet cfg + weights (e.g. the YOLOv2 files)."""
+    backend = 'opencv'
+
+    def __init__(self, model, config=None, names=None, **kwargs):
+        super().__init__(model, **kwargs)
+        self.config = config
+        self.label_file = names
+
+    def _load(self):
+        import cv2
+        if self.config:
+            self.model = cv2.dnn.readNetFromDarknet(self.config, self.model_path)
+        else:
+            self.model = cv2.dnn.readNet(self.model_path)
+        self.model.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self.model.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        labels = COCO_NAMES
+        if self.label_file:
+            with open(self.label_file, encoding='utf-8') as f:
+                labels = [line.strip() for line in f if line.strip()]
+        self.names = canonical_names(labels)
+
+    def _predict(self, frames, imgsz):
+        import cv2
+        if not self.config:
+            blob, transforms = _to_blob(frames, imgsz)
+            self.model.setInput(blob)
+            outputs = self.model.forward()
+            return [decode_yolov8(output, transform, self.conf, self.iou) for output, transform in zip(outputs, transforms)]
+
+        # Darknet region output: rows of normalized cx, cy, w, h, objectness, class scores.
+        # Region layers flatten the batch, so Darknet models run one frame at a time.
+        detections = []
+        for frame in frames:
+            height, width = frame.shape[:2]
+            self.model.setInput(cv2.dnn.blobFromImage(frame, 1 / 255.0, (imgsz, imgsz), swapRB=True, crop=False))
+            rows = np.concatenate(self.model.forward(self.model.getUnconnectedOutLayersNames()))
+            scores = rows[:, 5:]
+            classes = scores.argmax(axis=1)
+            confidences = scores[np.arange(len(scores)), classes]
+            keep = confidences > self.conf
+            rows, classes, confidences = rows[keep], classes[keep], confidences[keep]
+            cx, cy, w, h = rows[:, 0] * width, rows[:, 1] * height, rows[:, 2] * width, rows[:, 3] * height
+            boxes = np.column_stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2])
+            kept = _nms(boxes, confidences, classes, self.iou)
+            detections.append(np.column_stack([boxes[kept], confidences[kept], classes[kept]]).astype(np.float32))
+        return detections
+
+BACKENDS = {
+    'ultralytics': (UltralyticsDetector, 'yolov8n.pt'),
+    'onnx': (OnnxDetector, 'yolov8n.onnx'),
+    'opencv': (OpenCVDetector, 'yolov8n.onnx')
+}
+
+# One detector per backend/model/options, per thread unless the backend is thread-safe; loaded on first use
+_detectors = {}
+_detectors_lock = threading.Lock()
+
+def resolve_detector(backend=None, model=None):
+    """(backend, model) that get_detector would use, from the arguments or DETECTOR_BACKEND / DETECTOR_MODEL."""
+    backend = backend or os.environ.get('DETECTOR_BACKEND', 'ultralytics')
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown detector backend: {backend}')
+    return backend, model or os.environ.get('DETECTOR_MODEL', BACKENDS[backend][1])
+
+def get_detector(backend=None, model=None, **options):
+    """Lazily loaded detector. Defaults come from DETECTOR_BACKEND, DETECTOR_MODEL, DETECTOR_WARMUP
+    and, for ultralytics, DETECTOR_DEVICE."""
+    backend, model = resolve_detector(backend, model)
+    cls = BACKENDS[backend][0]
+    options.setdefault('warmup', os.environ.get('DETECTOR_WARMUP', '0') in ('1', 'true', 'True'))
+    if backend == 'ultralytics' and os.environ.get('DETECTOR_DEVICE'):
+        options.setdefault('device', os.environ['DETECTOR_DEVICE'])
+    key = (backend, model, tuple(sorted(options.items())))
+    if not cls.thread_safe:
+        # Concurrent jobs (one scheduler worker thread each) then run inference in parallel
+        key += (threading.get_ident(),)
+    with _detectors_lock:
+        detector = _detectors.get(key)
+        if detector is None:
+            detector = cls(model, **options)
+            _detectors[key] = detector
+        return detector
@@ -0,0 +1,110 @@
+import cv2
+import math
+
+class FrameSampler:
+    """Chooses which video frames to decode for analysis.
+
+    Exactly one of `stride` (every Nth frame), `target_fps` (analysis frames per
+    second of video) or `interval` (seconds of video between samples) sets the
+    spacing. Sample positions are absolute frame indices (round(k * step)), so
+    any sub-range of a video samples the same frames as a full pass.
+    Skipped frames are only grabbed, never decoded into an image, and gaps of at
+    least `seek_threshold` frames are skipped with a seek instead.
+    """
+
+    def __init__(self, stride=None, target_fps=None, interval=None, seek_threshold=300):
+        if sum(v is not None for v in (stride, target_fps, interval)) > 1:
+            raise ValueError('Use only one of stride, target_fps or interval')
+        if stride is None and target_fps is None and interval is None:
+            stride = 1
+        self.stride = stride
+        self.target_fps = target_fps
+        self.interval = interval
+        self.seek_threshold = seek_threshold
+
+    @classmethod
+    def from_options(cls, options):
+        # Build from request parameters, e.g. {'sample_fps': '2'}; falls back to every 5th frame
+        if options.get('sample_fps'):
+            return cls(target_fps=float(options['sample_fps']))
+        if options.get('sample_interval'):
+            return cls(interval=float(options['sample_interval']))
+        return cls(stride=int(options.get('sample_stride') or 5))
+
+    @property
+    def mode(self):
+        if self.target_fps is not None:
+            return 'target_fps'
+        if self.interval is not None:
+            return 'interval'
+        return 'stride'
+
+    def step(self, fps):
+        # Frames between samples; never below one frame
+        if self.target_fps is not None:
+            step = (fps or self.target_fps) / self.target_fps
+        elif self.interval is not None:
+            step = (fps or 1) * self.interval
+        else:
+            step = self.stride
+        return max(1.0, float(step))
+
+    def sample_index(self, k, fps):
+        return int(round(k * self.step(fps)))
+
+    def first_sample(self, start_frame, fps):
+        # Smallest k whose sample position is at or after start_frame
+        k = max(0, int(math.floor(start_frame / self.step(fps))) - 1)
+        while self.sample_index(k, fps) < start_frame:
+            k += 1
+        return k
+
+    def sample_count(self, total_frames, fps, start_frame=0):
+        k = self.first_sample(start_frame, fps)
+        count = 0
+        while self.sample_index(k, fps) < total_frames:
+            count += 1
+            k += 1
+        return count
+
+    def describe(self, fps, frames_sampled=None):
+        step = self.step(fps)
+        description = {
+            'mode': self.mode,
+            'step_frames': step,
+            'effective_fps': (fps / step) if fps else None
+        }
+        if frames_sampled is not None:
+            description['frames_sampled'] = frames_sampled
+        return description
+
+    def frames(self, cap, fps, start_frame=0, end_frame=None, stop=None):
+        """Yield (frame_number, frame) for sampled frames in [start_frame, end_frame)."""
+        if start_frame:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+        position = start_frame
+        k = self.first_sample(start_frame, fps)
+        next_sample = self.sample_index(k, fps)
+
+        while end_frame is None or next_sample < end_frame:
+            if stop is not None and stop.is_set():
+                return
+
+            gap = next_sample - position
+            if self.seek_threshold and gap >= self.seek_threshold:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, next_sample)
+                position = next_sample
+            while position < next_sample:
+                if not cap.grab():
+                    return
+                position += 1
+
+            if not cap.grab():
+                return
+            ret, frame = cap.retrieve()
+            if not ret:
+                return
+            yield position, frame
+            position += 1
+            k += 1
+            next_sample = self.sample_index(k, fps)
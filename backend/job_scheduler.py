@@ -0,0 +1,188 @@
+import threading
+import time
+import logging
+from collections import deque
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class JobCancelled(Exception):
+    pass
+
+class QueueFull(Exception):
+    pass
+
+class SchedulerClosed(Exception):
+    pass
+
+class Job:
+    def __init__(self, task_id, target, args, kwargs, lane):
+        self.task_id = task_id
+        self.target = target
+        self.args = args
+        self.kwargs = kwargs
+        self.lane = lane
+        self.status = 'queued'
+        self.error = None
+        self.cancel_event = threading.Event()
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def summary(self):
+        return {
+            'task_id': self.task_id,
+            'status': self.status,
+            'lane': self.lane,
+            'error': self.error,
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+
+class JobScheduler:
+    """Fixed pool of worker threads fed from a bounded, prioritised job queue.
+
+    Each worker owns the processor returned by `processor_factory` (created on
+    its first job, on the worker's thread), so concurrent jobs never share
+    pipeline state or a detector that serializes inference. Lanes are served in
+    the order given, e.g. live incident footage before batch archives. Jobs
+    run as target(processor, *args, cancel=<Event>, **kwargs); `on_finish(job)`
+    is called once a job's final status is set.
+    """
+
+    def __init__(self, processor_factory, workers=2, max_queue=20, lanes=('live', 'batch'), max_history=1000,
+                 on_finish=None):
+        self.processor_factory = processor_factory
+        self.on_finish = on_finish
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_history = max_history
+        self.lanes = tuple(lanes)
+        self.pending = {lane: deque() for lane in self.lanes}
+        self.jobs = {}
+        self.running = 0
+        self.closed = False
+        self.condition = threading.Condition()
+        self.threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._worker_loop, name=f'video-worker-{i}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, task_id, target, args=(), kwargs=None, lane=None):
+        lane = lane or self.lanes[-1]
+        if lane not in self.pending:
+            raise ValueError(f'Unknown lane: {lane}')
+        with self.condition:
+            if self.closed:
+                raise SchedulerClosed('Scheduler is shutting down')
+            if self.queued_count() >= self.max_queue:
+                raise QueueFull('Job queue is full')
+            job = Job(task_id, target, args, kwargs or {}, lane)
+            self.jobs[task_id] = job
+            self.pending[lane].append(job)
+            self.condition.notify()
+            return job
+
+    def queued_count(self):
+        return sum(len(q) for q in self.pending.values())
+
+    def queue_position(self, task_id):
+        # 1-based position among queued jobs across all lanes, or None if not queued
+        with self.condition:
+            position = 0
+            for lane in self.lanes:
+                for job in self.pending[lane]:
+                    position += 1
+                    if job.task_id == task_id:
+                        return position
+        return None
+
+    def get(self, task_id):
+        return self.jobs.get(task_id)
+
+    def cancel(self, task_id):
+        with self.condition:
+            job = self.jobs.get(task_id)
+            if job is None or job.status in ('done', 'failed', 'cancelled'):
+                return False
+            job.cancel_event.set()
+            dequeued = job.status == 'queued'
+            if dequeued:
+                self.pending[job.lane].remove(job)
+                job.status = 'cancelled'
+                job.finished_at = time.time()
+        if dequeued:
+            self._finished(job)
+        return True
+
+    def _finished(self, job):
+        if self.on_finish is not None:
+            self.on_finish(job)
+
+    def stats(self):
+        with self.condition:
+            return {
+                'workers': self.workers,
+                'running': self.running,
+                'queued': {lane: len(q) for lane, q in self.pending.items()},
+                'max_queue': self.max_queue
+            }
+
+    def shutdown(self, wait=True):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if wait:
+            for thread in self.threads:
+                thread.join()
+
+    def _next_job(self):
+        with self.condition:
+            while True:
+                for lane in self.lanes:
+                    if self.pending[lane]:
+                        job = self.pending[lane].popleft()
+                        job.status = 'running'
+                        job.started_at = time.time()
+                        self.running += 1
+                        return job
+                if self.closed:
+                    return None
+                self.condition.wait()
+
+    def _worker_loop(self):
+        processor = None
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            try:
+                if processor is None:
+                    processor = self.processor_factory()
+                job.target(processor, *job.args, cancel=job.cancel_event, **job.kwargs)
+                status = 'done'
+            except JobCancelled:
+                status = 'cancelled'
+            except Exception as e:
+                logger.error(f"Video job {job.task_id} failed: {str(e)}")
+                job.error = str(e)
+                status = 'failed'
+            with self.condition:
+                job.status = status
+                job.finished_at = time.time()
+                self.running -= 1
+                self._prune()
+            metrics.inc('video_jobs_total', status=status, lane=job.lane)
+            metrics.observe('video_job_seconds', job.finished_at - job.started_at, lane=job.lane)
+            self._finished(job)
+
+    def _prune(self):
+        # Forget the oldest finished jobs once the history limit is reached
+        if len(self.jobs) <= self.max_history:
+            return
+        finished = [j for j in self.jobs.values() if j.status in ('done', 'failed', 'cancelled')]
+        finished.sort(key=lambda j: j.finished_at)
+        for job in finished[:len(self.jobs) - self.max_history]:
+            del self.jobs[job.task_id]
@@ -0,0 +1,317 @@
+import os
+import sys
+import json
+import time
+import bisect
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the stage latency histogram buckets
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in labels.values())
+    return '{' + ','.join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + '}'
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Metrics:
+    """Process-wide counters, gauges and histograms in the Prometheus text format.
+
+    An update is one lock and one dict lookup, cheap enough for per-frame
+    calls. Values that already live elsewhere (queue lengths, cache stats)
+    are read at scrape time through callbacks instead of being copied on
+    every change.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+        self.kinds = {}
+        self.help = {}
+        self.callbacks = []
+
+    def describe(self, name, kind, text):
+        self.kinds[name] = kind
+        self.help[name] = text
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(labels.items()))
+        with self.lock:
+            self.kinds.setdefault(name, 'counter')
+            self.values[key] = self.values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.kinds.setdefault(name, 'gauge')
+            self.values[(name, tuple(labels.items()))] = value
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS, **labels):
+        key = (name, tuple(labels.items()))
+        with self.lock:
+            histogram = self.values.get(key)
+            if histogram is None:
+                self.kinds.setdefault(name, 'histogram')
+                histogram = self.values[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def remove(self, name, **labels):
+        # Drop one labelled series, e.g. a per-task gauge once the task is done
+        with self.lock:
+            self.values.pop((name, tuple(labels.items())), None)
+
+    def register(self, callback):
+        # callback() -> iterable of (name, value, labels) gauges, read on every scrape
+        self.callbacks.append(callback)
+
+    def render(self, extra_labels=None):
+        """All metrics as Prometheus text exposition, one family per metric name."""
+        extra = dict(extra_labels or {})
+        with self.lock:
+            samples = [(name, dict(labels), value if not isinstance(value, Histogram) else
+                        (list(value.counts), value.sum, value.count, value.buckets))
+                       for (name, labels), value in self.values.items()]
+        for callback in self.callbacks:
+            for name, value, labels in callback():
+                self.kinds.setdefault(name, 'gauge')
+                samples.append((name, dict(labels), value))
+
+        families = {}
+        for name, labels, value in samples:
+            families.setdefault(name, []).append((dict(labels, **extra), value))
+        lines = []
+        for name in sorted(families):
+            kind = self.kinds.get(name, 'gauge')
+            if name in self.help:
+                lines.append(f'# HELP {name} {self.help[name]}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in families[name]:
+                if kind != 'histogram':
+                    lines.append(f'{name}{_label_text(labels)} {value}')
+                    continue
+                counts, total, count, buckets = value
+                cumulative = 0
+                for bound, bucket_count in zip(list(buckets) + ['+Inf'], counts):
+                    cumulative += bucket_count
+                    lines.append(f'{name}_bucket{_label_text(dict(labels, le=bound))} {cumulative}')
+                lines.append(f'{name}_sum{_label_text(labels)} {total}')
+                lines.append(f'{name}_count{_label_text(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def export_periodically(self, path, interval=10):
+        """Rewrite `path` with this process's metrics every `interval` seconds (see merge_exposition)."""
+        def loop():
+            while True:
+                text = self.render({'pid': os.getpid()})
+                temporary = f'{path}.tmp'
+                with open(temporary, 'w', encoding='utf-8') as f:
+                    f.write(text)
+                os.replace(temporary, path)
+                time.sleep(interval)
+        threading.Thread(target=loop, daemon=True).start()
+
+def merge_exposition(texts):
+    # Combine exposition texts from several processes so every family appears once
+    headers, samples, order = {}, {}, []
+    for text in texts:
+        family = None
+        for line in text.splitlines():
+            if line.startswith('# HELP ') or line.startswith('# TYPE '):
+                family = line.split()[2]
+                if family not in headers:
+                    headers[family], samples[family] = [], []
+                    order.append(family)
+                if line not in headers[family]:
+                    headers[family].append(line)
+            elif line and family is not None:
+                samples[family].append(line)
+    return ''.join('\n'.join(headers[f] + samples[f]) + '\n' for f in order)
+
+class Trace:
+    """Spans of one task, dumped in the Chrome trace event format (chrome://tracing, Perfetto)."""
+
+    def __init__(self, task_id, max_events=100000):
+        self.task_id = task_id
+        self.max_events = max_events
+        self.origin = time.perf_counter()
+        self.started_at = time.time()
+        self.events = []
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def span(self, name, started, duration, **args):
+        event = {'name': name, 'ph': 'X', 'ts': (started - self.origin) * 1e6, 'dur': duration * 1e6,
+                 'pid': os.getpid(), 'tid': threading.get_ident()}
+        if args:
+            event['args'] = args
+        with self.lock:
+            if len(self.events) < self.max_events:
+                self.events.append(event)
+            else:
+                self.dropped += 1
+
+    def to_dict(self):
+        with self.lock:
+            return {'traceEvents': list(self.events), 'otherData': {
+                'task_id': self.task_id, 'started_at': self.started_at, 'dropped_events': self.dropped}}
+
+class Tracer:
+    """Optional per-task traces. A trace is bound to the threads working on its task,
+    and every record_stage call on those threads adds a span to it."""
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.traces = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def start(self, task_id):
+        trace = Trace(task_id)
+        with self.lock:
+            self.traces[task_id] = trace
+        return trace
+
+    def get(self, task_id):
+        with self.lock:
+            return self.traces.get(task_id)
+
+    def current(self):
+        return getattr(self.local, 'trace', None)
+
+    @contextmanager
+    def bind(self, trace):
+        previous = self.current()
+        self.local.trace = trace
+        try:
+            yield trace
+        finally:
+            self.local.trace = previous
+
+    def wrap(self, function):
+        # Bind the calling thread's trace inside `function`, e.g. a thread target
+        trace = self.current()
+        def wrapper(*args, **kwargs):
+            with self.bind(trace):
+                return function(*args, **kwargs)
+        return wrapper
+
+    def finish(self, task_id):
+        """Stop tracing a task and write its trace to `directory`; returns the path (or None)."""
+        with self.lock:
+            trace = self.traces.pop(task_id, None)
+        if trace is None or not self.directory:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'{task_id}.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(trace.to_dict(), f)
+        return path
+
+    def load(self, task_id):
+        # Running trace so far, or the dumped one
+        trace = self.get(task_id)
+        if trace is not None:
+            return trace.to_dict()
+        path = os.path.join(self.directory, f'{task_id}.json') if self.directory else None
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        return None
+
+class SamplingProfiler:
+    """Samples every thread's Python stack `hz` times a second.
+
+    Counts are kept per collapsed stack ("outer;inner;leaf count" lines), the
+    input format of flamegraph.pl and speedscope. Sampling runs on its own
+    thread and only while started, so it costs nothing when unused.
+    """
+
+    def __init__(self, hz=100):
+        self.hz = hz
+        self.counts = Counter()
+        self.samples = 0
+        self.running = threading.Event()
+        self.thread = None
+        # Serializes start/stop so two concurrent /profile calls cannot both start a sampler
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.running.is_set():
+                return False
+            self.counts.clear()
+            self.samples = 0
+            self.running.set()
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+            return True
+
+    def stop(self):
+        with self.lock:
+            self.running.clear()
+            if self.thread is not None:
+                self.thread.join()
+                self.thread = None
+            return self.collapsed()
+
+    def _run(self):
+        own = threading.get_ident()
+        interval = 1.0 / self.hz
+        while self.running.is_set():
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                    frame = frame.f_back
+                self.counts[';'.join(reversed(stack))] += 1
+            self.samples += 1
+            time.sleep(interval)
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.counts.most_common())
+
+    def profile(self, seconds):
+        """Sample for `seconds` and return the collapsed stacks; None if already profiling."""
+        if not self.start():
+            return None
+        time.sleep(seconds)
+        return self.stop()
+
+# Shared by every module in the process
+metrics = Metrics()
+tracer = Tracer(os.environ.get('METRICS_TRACE_DIR', 'traces'))
+profiler = SamplingProfiler(int(os.environ.get('METRICS_PROFILE_HZ', '100')))
+
+for _pipeline in ('video', 'anpr'):
+    metrics.describe(f'{_pipeline}_stage_seconds', 'histogram', f'Time spent per {_pipeline} pipeline stage call')
+metrics.describe('model_load_seconds', 'gauge', 'Time taken to load each model')
+
+def record_stage(pipeline, stage, started, **args):
+    """Observe the time since `started` (a perf_counter value) as one stage call and return it.
+
+    The call is also added as a span to the trace bound to this thread, if any.
+    """
+    elapsed = time.perf_counter() - started
+    metrics.observe(f'{pipeline}_stage_seconds', elapsed, stage=stage)
+    trace = tracer.current()
+    if trace is not None:
+        trace.span(stage, started, elapsed, **args)
+    return elapsed
@@ -0,0 +1,103 @@
+import cv2
+import numpy as np
+import threading
+
+class MotionGate:
+    """Decides per sampled frame whether YOLO needs to run.
+
+    Each frame is downscaled to `width` pixels, greyscaled and blurred, then
+    compared with the last frame that was actually inferred. Pixels that
+    changed by more than `pixel_threshold` are grouped into connected regions,
+    and the largest region's share of the frame is the motion score, so one
+    small moving vehicle counts while scattered noise does not add up.
+    Frames are inferred when the score reaches `motion_threshold`, while the
+    scene is busy (a recent inference saw `busy_vehicle_count` or more
+    vehicles), or after `max_skip` skipped frames. Otherwise the last
+    detections are reused. Busy scenes therefore run at the full sampler rate
+    and quiet ones at 1 / (max_skip + 1) of it.
+    """
+
+    # 0.0005 of a 160x90 signature is about 7 pixels, i.e. a car a few dozen pixels
+    # long in a 1080p frame
+    def __init__(self, pixel_threshold=25, motion_threshold=0.0005, max_skip=10,
+                 busy_vehicle_count=3, busy_hold=5, width=160):
+        self.pixel_threshold = pixel_threshold
+        self.motion_threshold = motion_threshold
+        self.max_skip = max_skip
+        self.busy_vehicle_count = busy_vehicle_count
+        self.busy_hold = busy_hold
+        self.width = width
+        self.lock = threading.Lock()
+        self.reset()
+
+    @classmethod
+    def from_options(cls, options):
+        # None unless adaptive sampling was requested, e.g. {'adaptive': '1', 'motion_threshold': '0.02'}
+        if options.get('adaptive') not in ('1', 'true', 'True', True):
+            return None
+        kwargs = {}
+        for name, cast in (('pixel_threshold', int), ('motion_threshold', float), ('max_skip', int),
+                           ('busy_vehicle_count', int), ('busy_hold', int)):
+            if options.get(name) not in (None, ''):
+                kwargs[name] = cast(options[name])
+        return cls(**kwargs)
+
+    def reset(self):
+        with self.lock:
+            self.reference = None
+            self.skipped_in_row = 0
+            self.busy_left = 0
+            self.frames_checked = 0
+            self.frames_skipped = 0
+
+    def _signature(self, frame):
+        height, width = frame.shape[:2]
+        scale = self.width / float(width)
+        small = cv2.resize(frame, (self.width, max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+        return cv2.GaussianBlur(gray, (5, 5), 0)
+
+    def _motion_score(self, signature):
+        changed = (cv2.absdiff(signature, self.reference) > self.pixel_threshold).astype(np.uint8)
+        regions, _, region_stats, _ = cv2.connectedComponentsWithStats(changed, connectivity=8)
+        if regions <= 1:
+            return 0.0
+        # Label 0 is the unchanged background
+        return region_stats[1:, cv2.CC_STAT_AREA].max() / float(changed.size)
+
+    def should_infer(self, frame):
+        signature = self._signature(frame)
+        with self.lock:
+            self.frames_checked += 1
+            if self.reference is None or self.busy_left > 0 or self.skipped_in_row >= self.max_skip:
+                infer = True
+            else:
+                infer = self._motion_score(signature) >= self.motion_threshold
+
+            if infer:
+                self.reference = signature
+                self.skipped_in_row = 0
+                self.busy_left = max(0, self.busy_left - 1)
+            else:
+                self.skipped_in_row += 1
+                self.frames_skipped += 1
+            return infer
+
+    def observe(self, vehicle_count):
+        # Called with the vehicle count of each inferred frame
+        if vehicle_count >= self.busy_vehicle_count:
+            with self.lock:
+                self.busy_left = self.busy_hold
+
+    def stats(self):
+        with self.lock:
+            return {
+                'enabled': True,
+                'pixel_threshold': self.pixel_threshold,
+                'motion_threshold': self.motion_threshold,
+                'max_skip': self.max_skip,
+                'busy_vehicle_count': self.busy_vehicle_count,
+                'frames_checked': self.frames_checked,
+                'frames_skipped': self.frames_skipped,
+                'skipped_fraction': self.frames_skipped / self.frames_checked if self.frames_checked else 0
+            }
@@ -0,0 +1,82 @@
+from collections import defaultdict
+
+def box_iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    iw = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    ih = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = iw * ih
+    union = aw * ah + bw * bh - inter
+    return inter / union if union else 0.0
+
+class PlateTrack:
+    __slots__ = ('track_id', 'box', 'first_frame', 'last_frame', 'last_ocr_frame', 'ocr_attempts', 'readings')
+
+    def __init__(self, track_id, box, frame_number):
+        self.track_id = track_id
+        self.box = box
+        self.first_frame = frame_number
+        self.last_frame = frame_number
+        self.last_ocr_frame = None
+        self.ocr_attempts = 0
+        self.readings = []
+
+def fuse_readings(readings):
+    # Confidence-weighted vote over the OCR readings of one track
+    votes = defaultdict(float)
+    for text, confidence in readings:
+        votes[text] += confidence
+    text = max(votes, key=votes.get)
+    confidences = [c for t, c in readings if t == text]
+    return text, sum(confidences) / len(confidences), dict(votes)
+
+class PlateTracker:
+    """Greedy IoU association of plate boxes across frames."""
+
+    def __init__(self, iou_threshold=0.3, max_missed=10):
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.tracks = []
+        self.next_id = 1
+
+    def update(self, frame_number, boxes):
+        """Match this frame's boxes to live tracks.
+
+        Returns (matched, finished): matched is a list of (track, box_index) for
+        every box, new tracks included; finished lists tracks not seen for more
+        than max_missed frames, which are dropped from the tracker.
+        """
+        pairs = []
+        for t, track in enumerate(self.tracks):
+            for b, box in enumerate(boxes):
+                iou = box_iou(track.box, box)
+                if iou >= self.iou_threshold:
+                    pairs.append((iou, t, b))
+        pairs.sort(reverse=True)
+
+        used_tracks, used_boxes, matched = set(), set(), []
+        for _, t, b in pairs:
+            if t in used_tracks or b in used_boxes:
+                continue
+            used_tracks.add(t)
+            used_boxes.add(b)
+            track = self.tracks[t]
+            track.box = boxes[b]
+            track.last_frame = frame_number
+            matched.append((track, b))
+
+        for b, box in enumerate(boxes):
+            if b not in used_boxes:
+                track = PlateTrack(self.next_id, box, frame_number)
+                self.next_id += 1
+                self.tracks.append(track)
+                matched.append((track, b))
+
+        finished = [t for t in self.tracks if frame_number - t.last_frame > self.max_missed]
+        if finished:
+            self.tracks = [t for t in self.tracks if frame_number - t.last_frame <= self.max_missed]
+        return matched, finished
+
+    def flush(self):
+        finished, self.tracks = self.tracks, []
+        return finished
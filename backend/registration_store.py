@@ -0,0 +1,145 @@
+import json
+import os
+import sys
+import sqlite3
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Demo record returned for every plate when no registration file is configured
+DEFAULT_RECORD = {
+    'valid_until': '2025-06-30',
+    'vehicle_type': 'Sedan',
+    'owner_name': 'John Doe',
+    'tax_status': 'Paid',
+    'violations': [
+        {
+            'type': 'Speed Violation',
+            'date': '2024-01-10',
+            'location': 'MG Road',
+            'status': 'Pending',
+            'fine': 1000,
+            'details': 'Exceeded speed limit by 20km/h'
+        }
+    ]
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS registrations (
+    plate_number TEXT PRIMARY KEY,
+    vehicle_type TEXT,
+    owner_name TEXT,
+    tax_status TEXT,
+    valid_until TEXT,
+    violations TEXT
+)
+"""
+
+def normalize_plate(plate_number):
+    return ''.join(c for c in str(plate_number) if c.isalnum()).upper()
+
+class RegistrationRecord:
+    __slots__ = ('vehicle_type', 'owner_name', 'tax_status', 'valid_until', 'violations', 'due_amount')
+
+    def __init__(self, data):
+        # Parse and total once at load time instead of on every lookup
+        self.vehicle_type = data.get('vehicle_type')
+        self.owner_name = data.get('owner_name')
+        self.tax_status = data.get('tax_status')
+        self.valid_until = datetime.strptime(data['valid_until'], '%Y-%m-%d') if data.get('valid_until') else None
+        self.violations = data.get('violations') or []
+        self.due_amount = sum(v.get('fine', 0) for v in self.violations)
+
+    def is_valid(self, now=None):
+        return self.valid_until is not None and self.valid_until > (now or datetime.now())
+
+class RegistrationStore:
+    """In-memory hash index of registrations, bulk loaded from a JSON or SQLite file.
+
+    lookup() returns None for plates that are not in the store, or
+    `default_record` if one is given.
+    """
+
+    def __init__(self, path=None, default_record=None):
+        self.path = path
+        self.records = {}
+        self.default = RegistrationRecord(default_record) if default_record else None
+        if path:
+            self.load(path)
+
+    @classmethod
+    def from_env(cls):
+        # Without a registration file, keep the original demo behavior of one mock record for every plate
+        path = os.environ.get('ANPR_REGISTRATION_DB') or None
+        return cls(path, default_record=None if path else DEFAULT_RECORD)
+
+    def load(self, path):
+        if not os.path.exists(path):
+            logger.warning(f"Registration store {path} not found, no registrations loaded")
+            return
+        if path.endswith('.json'):
+            with open(path, encoding='utf-8') as f:
+                rows = json.load(f)
+        else:
+            rows = load_sqlite(path)
+
+        records = {}
+        for row in rows:
+            records[normalize_plate(row['plate_number'])] = RegistrationRecord(row)
+        self.records = records
+        logger.info(f"Loaded {len(records)} registrations from {path}")
+
+    def lookup(self, plate_number):
+        record = self.records.get(normalize_plate(plate_number))
+        return record if record is not None else self.default
+
+    def __len__(self):
+        return len(self.records)
+
+def load_sqlite(path):
+    conn = sqlite3.connect(path)
+    try:
+        conn.row_factory = sqlite3.Row
+        rows = conn.execute('SELECT * FROM registrations').fetchall()
+    finally:
+        conn.close()
+    result = []
+    for row in rows:
+        data = dict(row)
+        data['violations'] = json.loads(data['violations']) if data['violations'] else []
+        result.append(data)
+    return result
+
+def bulk_import_sqlite(path, rows):
+    """Insert or replace registration rows (dicts as in the JSON format) in a SQLite file."""
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute(SCHEMA)
+        conn.executemany(
+            'INSERT OR REPLACE INTO registrations VALUES (?, ?, ?, ?, ?, ?)',
+            (
+                (
+                    normalize_plate(row['plate_number']),
+                    row.get('vehicle_type'),
+                    row.get('owner_name'),
+                    row.get('tax_status'),
+                    row.get('valid_until'),
+                    json.dumps(row.get('violations') or [])
+                )
+                for row in rows
+            )
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    # Convert a JSON registration file to SQLite: python registration_store.py registrations.json registrations.db
+    if len(sys.argv) != 3:
+        print('Usage: registration_store.py <registrations.json> <registrations.db>')
+        sys.exit(1)
+    with open(sys.argv[1], encoding='utf-8') as f:
+        rows = json.load(f)
+    bulk_import_sqlite(sys.argv[2], rows)
+    print(f'Imported {len(rows)} registrations into {sys.argv[2]}')
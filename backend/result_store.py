@@ -0,0 +1,217 @@
+import json
+import os
+import shutil
+import threading
+import time
+from ttl_cache import TTLCache
+from detection_store import DetectionStore
+from metrics import record_stage
+
+# Per-frame lists that are paged from the DetectionStore instead of returned with every poll
+PAGED_KEYS = {
+    'frame_by_frame': DetectionStore.frame_records,
+    'traffic_density': DetectionStore.density_records
+}
+
+def summarize(results):
+    if results is None:
+        return None
+    summary = {k: v for k, v in results.items() if k != 'detections'}
+    if 'vehicle_counts' in summary:
+        summary['vehicle_counts'] = dict(summary['vehicle_counts'])
+    store = results.get('detections')
+    frames = len(store) if store is not None else 0
+    for key in PAGED_KEYS:
+        summary[f'{key}_count'] = frames
+    summary['detection_count'] = store.detection_count if store is not None else 0
+    if store is not None:
+        # Running values while a task is in progress, final values once done
+        summary['average_density'] = store.average_density()
+        summary['peak_density'] = float(store.density_peak)
+        summary['lanes'] = store.lane_summary()
+    return summary
+
+class ResultStore:
+    """Progress and results for video analysis tasks.
+
+    Running tasks are held in memory by reference. Completed tasks are written
+    to `directory` (summary.json plus the DetectionStore as detections.npz), so
+    they survive restarts; only their summaries stay in an LRU/TTL cache, and
+    stores reloaded for paging are kept in a small cache of their own.
+    Without a directory, completed results stay in the LRU/TTL cache in full.
+    On disk, only the newest `max_stored` tasks are kept, and with `retention`
+    (seconds) older ones are deleted too.
+
+    Running tasks publish a shallow copy of their results dict, so readers
+    never iterate a dict the worker is still adding keys to.
+    """
+
+    def __init__(self, directory=None, max_entries=256, ttl=3600, max_stored=1000, retention=None, on_evict=None):
+        self.directory = directory
+        self.max_stored = max_stored
+        self.retention = retention
+        # Called with the task ids whose stored results _prune_stored deleted
+        self.on_evict = on_evict
+        self.running = {}
+        self.completed = TTLCache(max_size=max_entries, ttl=ttl)
+        self.loaded_stores = TTLCache(max_size=8, ttl=300)
+        self.lock = threading.Lock()
+        # Notified on every change so streams can wait instead of polling
+        self.updated = threading.Condition(self.lock)
+        self.version = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            directory=os.environ.get('VIDEO_RESULTS_DIR', 'results'),
+            max_entries=int(os.environ.get('VIDEO_RESULTS_CACHE_SIZE', '256')),
+            ttl=int(os.environ.get('VIDEO_RESULTS_CACHE_TTL', '3600')),
+            max_stored=int(os.environ.get('VIDEO_RESULTS_MAX_STORED', '1000')),
+            retention=int(os.environ.get('VIDEO_RESULTS_RETENTION', '0')) or None
+        )
+
+    def set_progress(self, task_id, progress, results):
+        results = dict(results)
+        with self.lock:
+            self.running[task_id] = {'progress': progress, 'current_results': results}
+            self._notify()
+
+    def _notify(self):
+        self.version += 1
+        self.updated.notify_all()
+
+    def notify(self):
+        # Wake waiting streams for a change made elsewhere, e.g. a job's final status
+        with self.lock:
+            self._notify()
+
+    def wait_for_update(self, since_version, timeout=None):
+        # Returns the current version once it differs from since_version (or on timeout)
+        with self.lock:
+            self.updated.wait_for(lambda: self.version != since_version, timeout)
+            return self.version
+
+    def is_running(self, task_id):
+        with self.lock:
+            return task_id in self.running
+
+    def complete(self, task_id, results):
+        if self.directory:
+            self._write(task_id, results)
+            self.completed.set(task_id, {'progress': 100, 'summary': summarize(results)})
+            self._prune_stored()
+        else:
+            self.completed.set(task_id, {'progress': 100, 'current_results': results})
+        with self.lock:
+            self.running.pop(task_id, None)
+            self._notify()
+
+    def discard(self, task_id):
+        with self.lock:
+            self.running.pop(task_id, None)
+            self._notify()
+
+    def progress(self, task_id):
+        """Progress plus result summary, without the per-frame lists."""
+        with self.lock:
+            entry = self.running.get(task_id)
+        if entry is not None:
+            return {'progress': entry['progress'], 'current_results': summarize(entry['current_results'])}
+
+        entry = self._completed_entry(task_id)
+        if entry is None:
+            return {'progress': 0, 'current_results': None}
+        if 'summary' in entry:
+            return {'progress': 100, 'current_results': entry['summary']}
+        return {'progress': 100, 'current_results': summarize(entry['current_results'])}
+
+    def page(self, task_id, key, offset=0, limit=100):
+        """Return up to `limit` items of a paged list starting at `offset`, or None if unknown."""
+        if key not in PAGED_KEYS:
+            raise ValueError(f'Unknown result list: {key}')
+        with self.lock:
+            entry = self.running.get(task_id)
+        if entry is None:
+            entry = self._completed_entry(task_id)
+        if entry is None:
+            return None
+
+        if 'summary' not in entry:
+            store = (entry['current_results'] or {}).get('detections')
+        else:
+            store = self.detections(task_id)
+        if store is None:
+            return []
+        return PAGED_KEYS[key](store, offset, limit)
+
+    def detections(self, task_id):
+        # DetectionStore of a running or completed task, reloaded from disk if needed
+        with self.lock:
+            entry = self.running.get(task_id)
+        if entry is None:
+            entry = self.completed.get(task_id)
+        if entry is not None and 'current_results' in entry:
+            return (entry['current_results'] or {}).get('detections')
+        store = self.loaded_stores.get(task_id)
+        if store is None:
+            path = self.export_path(task_id)
+            if path is None:
+                return None
+            store = DetectionStore.from_npz(path)
+            self.loaded_stores.set(task_id, store)
+        return store
+
+    def export_path(self, task_id):
+        if not self.directory:
+            return None
+        path = self._path(task_id, 'detections.npz')
+        return path if os.path.exists(path) else None
+
+    def _completed_entry(self, task_id):
+        entry = self.completed.get(task_id)
+        if entry is not None or not self.directory:
+            return entry
+        # Not cached (evicted or from before a restart): reload the summary from disk
+        path = self._path(task_id, 'summary.json')
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding='utf-8') as f:
+            entry = {'progress': 100, 'summary': json.load(f)}
+        self.completed.set(task_id, entry)
+        return entry
+
+    def _prune_stored(self):
+        # Delete the oldest completed tasks beyond max_stored or older than retention
+        stored = []
+        for name in os.listdir(self.directory):
+            summary_path = os.path.join(self.directory, name, 'summary.json')
+            if os.path.exists(summary_path):
+                stored.append((os.path.getmtime(summary_path), name))
+        stored.sort(reverse=True)
+        cutoff = time.time() - self.retention if self.retention else None
+        evicted = []
+        for index, (modified, task_id) in enumerate(stored):
+            if (self.max_stored and index >= self.max_stored) or (cutoff is not None and modified < cutoff):
+                shutil.rmtree(os.path.join(self.directory, task_id), ignore_errors=True)
+                self.completed.pop(task_id)
+                self.loaded_stores.pop(task_id)
+                evicted.append(task_id)
+        if evicted and self.on_evict is not None:
+            self.on_evict(evicted)
+
+    def _path(self, task_id, name):
+        return os.path.join(self.directory, os.path.basename(task_id), name)
+
+    def _write(self, task_id, results):
+        started = time.perf_counter()
+        task_dir = os.path.dirname(self._path(task_id, 'summary.json'))
+        os.makedirs(task_dir, exist_ok=True)
+        results['detections'].to_npz(os.path.join(task_dir, 'detections.npz'))
+        # Summary last, so its presence marks a complete write
+        tmp_path = os.path.join(task_dir, 'summary.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(summarize(results), f)
+        os.replace(tmp_path, os.path.join(task_dir, 'summary.json'))
+        record_stage('video', 'serialization', started)
@@ -0,0 +1,27 @@
+from anpr_processor import ANPRProcessor
+
+class StubReader:
+    def readtext(self, image):
+        return []
+
+def test_process_images_falls_back_to_next_candidate(monkeypatch):
+    processor = ANPRProcessor(reader=StubReader())
+    # Crops are stand-in strings; only 'b2' reads, and 'c1' has no second candidate
+    candidates = {'a.jpg': ['a1'], 'b.jpg': ['b1', 'b2', 'b3'], 'c.jpg': ['c1']}
+    readable = {'a1': 'ABC123', 'b2': 'XYZ789'}
+    batches = []
+
+    def extract_plate_texts(plates):
+        batches.append(list(plates))
+        return [(readable[p], 0.9) if p in readable else (None, 0) for p in plates]
+
+    monkeypatch.setattr(processor, 'locate_plate', lambda path: (candidates[path], None))
+    monkeypatch.setattr(processor, 'extract_plate_texts', extract_plate_texts)
+    *results, stats = processor.process_images(list(candidates), max_workers=1)
+
+    assert batches == [['a1', 'b1', 'c1'], ['b2']]
+    by_image = {r['image']: r['result'] for r in results}
+    assert by_image['a.jpg']['plate_number'] == 'ABC123'
+    assert by_image['b.jpg']['plate_number'] == 'XYZ789'
+    assert by_image['c.jpg'] == {'error': 'Could not read license plate text'}
+    assert stats['stats']['ocr_crops'] == 4
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from detection_store import DetectionStore
+
+NAMES = {0: 'car', 1: 'truck', 5: 'person'}
+
+def make_store():
+    store = DetectionStore(['car', 'truck'], fps=25, lanes=[('left', 100.0)])
+    store.add_frame(0, (10, 10), np.array([[0, 0, 1, 1, 0.9, 0], [2, 2, 4, 4, 0.6, 1], [0, 0, 1, 1, 0.9, 5]],
+                                          dtype=np.float32), NAMES, lane_ids=np.array([0, -1, 0], dtype=np.int16))
+    store.add_frame(4, (10, 10), np.array([[0, 0, 1, 1, 0.8, 0]], dtype=np.float32), NAMES,
+                    lane_ids=np.array([0], dtype=np.int16))
+    store.track_id[:3] = [7, 8, 7]
+    return store
+
+def test_counts_and_filter():
+    store = make_store()
+    assert store.vehicle_counts() == {'car': 2, 'truck': 1}
+    assert store.frame_counts().tolist() == [[1, 1], [1, 0]]
+    assert store.unique_counts() == {'car': 1, 'truck': 1}
+
+    mask = store.filter(min_confidence=0.7, class_names=['car'])
+    assert mask.tolist() == [True, False, True]
+    assert store.vehicle_counts(mask) == {'car': 2, 'truck': 0}
+    assert store.frame_counts(store.filter(class_names=['truck'])).tolist() == [[0, 1], [0, 0]]
+
+@pytest.mark.parametrize('suffix', ['parquet', 'feather'])
+def test_to_arrow_round_trip(tmp_path, suffix):
+    pa = pytest.importorskip('pyarrow')
+    store = make_store()
+    path = str(tmp_path / f'detections.{suffix}')
+    store.to_arrow(path)
+
+    if suffix == 'parquet':
+        import pyarrow.parquet as pq
+        table = pq.read_table(path)
+    else:
+        import pyarrow.feather as feather
+        table = feather.read_table(path)
+    assert isinstance(table, pa.Table)
+    rows = table.to_pylist()
+    assert [r['frame_number'] for r in rows] == [0, 0, 4]
+    assert [r['class'] for r in rows] == ['car', 'truck', 'car']
+    assert [r['lane'] for r in rows] == ['left', None, 'left']
+    assert [r['track_id'] for r in rows] == [7, 8, 7]
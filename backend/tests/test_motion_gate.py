@@ -0,0 +1,26 @@
+import numpy as np
+from motion_gate import MotionGate
+
+def frame_with_box(x, y=500, size=(24, 16), noise=None):
+    frame = np.full((720, 1280, 3), 60, dtype=np.uint8)
+    frame[y:y + size[1], x:x + size[0]] = 220
+    if noise is not None:
+        frame[noise] = 255
+    return frame
+
+def test_small_moving_vehicle_is_inferred():
+    gate = MotionGate()
+    assert gate.should_infer(frame_with_box(100))
+    # Box moves, but covers only ~0.04% of the frame
+    assert gate.should_infer(frame_with_box(130))
+    assert gate.should_infer(frame_with_box(160))
+
+def test_static_and_scattered_noise_is_skipped():
+    gate = MotionGate()
+    rng = np.random.default_rng(0)
+    assert gate.should_infer(frame_with_box(100))
+    assert not gate.should_infer(frame_with_box(100))
+    # Isolated hot pixels form no region worth inferring for
+    noise = (rng.integers(0, 720, 400), rng.integers(0, 1280, 400))
+    assert not gate.should_infer(frame_with_box(100, noise=noise))
+    assert gate.stats()['frames_skipped'] == 2
@@ -0,0 +1,26 @@
+from upload_store import JobIndex
+
+def read_lines(path):
+    return path.read_text(encoding='utf-8').splitlines()
+
+def test_job_index_compacts_on_load(tmp_path):
+    path = tmp_path / 'job_index.jsonl'
+    index = JobIndex(str(path))
+    index.set('a', 'task-1')
+    index.set('a', 'task-2')
+    index.set('b', 'task-3')
+    assert len(read_lines(path)) == 3
+
+    reloaded = JobIndex(str(path))
+    assert reloaded.get('a') == 'task-2'
+    assert len(read_lines(path)) == 2
+
+def test_job_index_discard_rewrites_file(tmp_path):
+    path = tmp_path / 'job_index.jsonl'
+    index = JobIndex(str(path))
+    index.set('a', 'task-1')
+    index.set('b', 'task-2')
+    index.discard(['task-1', 'unknown'])
+    assert index.get('a') is None
+    assert JobIndex(str(path)).tasks == {'b': 'task-2'}
+    assert len(read_lines(path)) == 1
@@ -0,0 +1,15 @@
+from adaptive_timer.timing import DEFAULT_WEIGHTS, green_time
+from adaptive_timer.vehicle_detection import VehicleDetection
+
+VEHICLES = {'car': 4, 'truck': 3, 'motorcycle': 2}
+
+def test_adjust_signal_timing_defaults():
+    assert VehicleDetection().adjust_signal_timing(VEHICLES) == green_time(VEHICLES)
+
+def test_adjust_signal_timing_uses_instance_config():
+    weights = dict(DEFAULT_WEIGHTS, truck=DEFAULT_WEIGHTS['truck'] + 2)
+    default = green_time(VEHICLES)
+    assert VehicleDetection(weights=weights).adjust_signal_timing(VEHICLES) == green_time(VEHICLES, weights)
+    assert VehicleDetection(weights=weights).adjust_signal_timing(VEHICLES) != default
+    assert VehicleDetection(min_time=default + 5, max_time=90).adjust_signal_timing(VEHICLES) == default + 5
+    assert VehicleDetection(base_time=10).adjust_signal_timing(VEHICLES) != default
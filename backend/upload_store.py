@@ -0,0 +1,291 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+import cv2
+
+class UploadError(Exception):
+    pass
+
+class OffsetMismatch(UploadError):
+    def __init__(self, expected):
+        super().__init__(f'Expected offset {expected}')
+        self.expected = expected
+
+class Upload:
+    """One file arriving in chunks, hashed (SHA-256) as it is written to disk.
+
+    Chunks are appended in order; a chunk starting before the current offset
+    (a client resending after a dropped connection) has its already-received
+    bytes skipped, and one starting after it is refused with the offset to
+    resume from. Readers can wait for more data with wait().
+    """
+
+    def __init__(self, upload_id, filename, path, size=None, options=None):
+        self.upload_id = upload_id
+        self.filename = filename
+        self.path = path
+        self.size = size
+        self.options = options or {}
+        self.received = 0
+        self.complete = False
+        self.content_hash = None
+        self.task_id = None
+        self.updated_at = time.time()
+        self._sha256 = hashlib.sha256()
+        self._write_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.updated = threading.Condition(self.lock)
+
+    def write(self, offset, stream, chunk_size=1 << 20):
+        """Append the bytes of `stream` (file-like) starting at `offset`; returns the new offset."""
+        if not self._write_lock.acquire(blocking=False):
+            raise UploadError('Another chunk is being written')
+        try:
+            if self.complete:
+                raise UploadError('Upload already complete')
+            if offset > self.received:
+                raise OffsetMismatch(self.received)
+            skip = self.received - offset
+            with open(self.path, 'ab') as f:
+                while True:
+                    data = stream.read(chunk_size)
+                    if not data:
+                        break
+                    if skip:
+                        data, skip = data[skip:], max(0, skip - len(data))
+                        if not data:
+                            continue
+                    if self.size is not None and self.received + len(data) > self.size:
+                        raise UploadError(f'Upload exceeds its declared size of {self.size} bytes')
+                    f.write(data)
+                    # Flush so analysis of the prefix sees every byte counted in `received`
+                    f.flush()
+                    self._sha256.update(data)
+                    with self.updated:
+                        self.received += len(data)
+                        self.updated_at = time.time()
+                        self.updated.notify_all()
+            return self.received
+        finally:
+            self._write_lock.release()
+
+    def finish(self):
+        """Mark the upload complete and return its content hash."""
+        with self._write_lock:
+            if not self.complete:
+                if self.size is not None and self.received != self.size:
+                    raise UploadError(f'Received {self.received} of {self.size} bytes')
+                with self.updated:
+                    self.content_hash = self._sha256.hexdigest()
+                    self.complete = True
+                    self.updated_at = time.time()
+                    self.updated.notify_all()
+            return self.content_hash
+
+    def wait(self, received, timeout=None):
+        # Block until more than `received` bytes have arrived or the upload completes
+        with self.updated:
+            self.updated.wait_for(lambda: self.received != received or self.complete, timeout)
+            return self.received
+
+    def capture(self, cancel=None):
+        return GrowingCapture(self, cancel)
+
+    def summary(self):
+        return {
+            'upload_id': self.upload_id,
+            'filename': self.filename,
+            'offset': self.received,
+            'size': self.size,
+            'complete': self.complete,
+            'content_hash': self.content_hash,
+            'task_id': self.task_id
+        }
+
+class UploadStore:
+    """In-progress chunked uploads. Incomplete uploads idle for `ttl` seconds are dropped with their files.
+
+    An incomplete upload already being analyzed is only dropped once
+    `job_active(task_id)` is false, e.g. after its job gave up waiting for data.
+    """
+
+    def __init__(self, directory, ttl=3600, job_active=None):
+        self.directory = directory
+        self.ttl = ttl
+        self.job_active = job_active
+        self.uploads = {}
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def create(self, filename, size=None, options=None):
+        self.prune()
+        upload_id = str(uuid.uuid4())
+        path = os.path.join(self.directory, f'{upload_id}_{filename}')
+        open(path, 'wb').close()
+        upload = Upload(upload_id, filename, path, size, options)
+        with self.lock:
+            self.uploads[upload_id] = upload
+        return upload
+
+    def get(self, upload_id):
+        with self.lock:
+            return self.uploads.get(upload_id)
+
+    def remove(self, upload_id, delete_file=False):
+        with self.lock:
+            upload = self.uploads.pop(upload_id, None)
+        if upload is not None and delete_file and os.path.exists(upload.path):
+            os.remove(upload.path)
+        return upload
+
+    def prune(self):
+        cutoff = time.time() - self.ttl
+        with self.lock:
+            idle = [u for u in self.uploads.values() if u.updated_at < cutoff]
+        stale = [u for u in idle if u.complete or u.task_id is None or
+                 (self.job_active is not None and not self.job_active(u.task_id))]
+        for upload in stale:
+            self.remove(upload.upload_id, delete_file=not upload.complete)
+
+def stream_to_file(stream, path, chunk_size=1 << 20):
+    """Copy a file-like stream to `path` in chunks and return its SHA-256 hex digest."""
+    sha256 = hashlib.sha256()
+    with open(path, 'wb') as f:
+        while True:
+            data = stream.read(chunk_size)
+            if not data:
+                break
+            f.write(data)
+            sha256.update(data)
+    return sha256.hexdigest()
+
+def job_key(content_hash, params):
+    # Identical content analyzed with identical parameters gives identical results
+    return hashlib.sha256(json.dumps({'content': content_hash, 'params': params}, sort_keys=True).encode()).hexdigest()
+
+class JobIndex:
+    """Maps job keys (content hash + analysis parameters) to task ids.
+
+    With a path, entries are appended to a JSON-lines file and reloaded on
+    start, so finished results are still found after a restart. The file is
+    rewritten without stale lines on load and whenever discard() drops tasks.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.tasks = {}
+        self.lock = threading.Lock()
+        if path and os.path.exists(path):
+            lines = 0
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.tasks[entry['key']] = entry['task_id']
+                        lines += 1
+            # Re-submitted keys append a newer line; keep only the last one
+            if lines > len(self.tasks):
+                self._rewrite()
+
+    def get(self, key):
+        with self.lock:
+            return self.tasks.get(key)
+
+    def set(self, key, task_id):
+        with self.lock:
+            self.tasks[key] = task_id
+            if self.path:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps({'key': key, 'task_id': task_id}) + '\n')
+
+    def discard(self, task_ids):
+        # Drop the keys of tasks whose results are gone, e.g. evicted by the ResultStore
+        task_ids = set(task_ids)
+        with self.lock:
+            keys = [key for key, task_id in self.tasks.items() if task_id in task_ids]
+            for key in keys:
+                del self.tasks[key]
+            if keys and self.path:
+                self._rewrite()
+
+    def _rewrite(self):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            for key, task_id in self.tasks.items():
+                f.write(json.dumps({'key': key, 'task_id': task_id}) + '\n')
+        os.replace(temp_path, self.path)
+
+class GrowingCapture:
+    """cv2.VideoCapture stand-in that reads a video while its upload is still arriving.
+
+    When a read runs past the data written so far, it waits for more bytes,
+    reopens the file and seeks back to the current frame, so a FrameSampler
+    can consume it like any other capture. Reads only end once the upload is
+    complete and the final file is exhausted, `cancel` is set, or no data has
+    arrived for `idle_timeout` seconds (an abandoned upload). Needs a
+    container that can be decoded from a prefix (e.g. MP4 with the index at
+    the front, MKV, AVI).
+    """
+
+    def __init__(self, upload, cancel=None, poll=1.0, idle_timeout=600):
+        self.upload = upload
+        self.cancel = cancel
+        self.poll = poll
+        self.idle_timeout = idle_timeout
+        self.position = 0
+        self.cap = None
+        self._open()
+
+    def _open(self):
+        # Wait until enough of the file has arrived for the container header to parse
+        while True:
+            complete, received = self.upload.complete, self.upload.received
+            if self.cap is not None:
+                self.cap.release()
+            self.cap = cv2.VideoCapture(self.upload.path)
+            if self.cap.isOpened() or complete or self._stopped():
+                break
+            self.upload.wait(received, self.poll)
+        self.opened_complete = complete
+        if self.position:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, self.position)
+
+    def _stopped(self):
+        if self.cancel is not None and self.cancel.is_set():
+            return True
+        return time.time() - self.upload.updated_at > self.idle_timeout
+
+    def grab(self):
+        while not self.cap.grab():
+            # Past the end of what was readable when opened: wait for more data, then reopen
+            if self.opened_complete or self._stopped():
+                return False
+            self.upload.wait(self.upload.received, self.poll)
+            self._open()
+        self.position += 1
+        return True
+
+    def retrieve(self):
+        return self.cap.retrieve()
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def set(self, prop, value):
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            self.position = int(value)
+        return self.cap.set(prop, value)
+
+    def get(self, prop):
+        return self.cap.get(prop)
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def release(self):
+        self.cap.release()
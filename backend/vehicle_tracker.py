@@ -0,0 +1,275 @@
+import json
+import numpy as np
+
+def iou_matrix(a, b):
+    """Pairwise IoU of two (n, 4) / (m, 4) arrays of x1, y1, x2, y2 boxes."""
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)), dtype=np.float32)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-9), 0).astype(np.float32)
+
+def _to_cxcywh(boxes):
+    return np.column_stack([(boxes[:, 0] + boxes[:, 2]) / 2, (boxes[:, 1] + boxes[:, 3]) / 2,
+                            boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1]])
+
+def _to_xyxy(boxes):
+    half_w, half_h = boxes[:, 2] / 2, boxes[:, 3] / 2
+    return np.column_stack([boxes[:, 0] - half_w, boxes[:, 1] - half_h, boxes[:, 0] + half_w, boxes[:, 1] + half_h])
+
+def _side(a, b, points):
+    # Sign of the cross product: which side of line a->b each point is on
+    return np.sign((b[0] - a[0]) * (points[:, 1] - a[1]) - (b[1] - a[1]) * (points[:, 0] - a[0]))
+
+def parse_lines(value):
+    """Validate counting lines given as JSON, e.g. '[{"name": "stop", "points": [[0, 300], [640, 300]]}]'."""
+    lines = json.loads(value) if isinstance(value, str) else value
+    if not isinstance(lines, list):
+        raise ValueError('count_lines must be a list')
+    parsed = []
+    for i, line in enumerate(lines):
+        points = line.get('points') if isinstance(line, dict) else None
+        if not isinstance(points, list) or len(points) != 2 or any(not isinstance(p, list) or len(p) != 2 for p in points):
+            raise ValueError(f'count_lines[{i}] needs two [x, y] points')
+        parsed.append({'name': str(line.get('name', f'line_{i}')), 'points': [[float(v) for v in p] for p in points]})
+    return parsed
+
+def parse_tracking_options(options):
+    """Validate track_iou_threshold / track_max_age / track_min_hits / count_lines request fields."""
+    parsed = {}
+    for field, name, cast, minimum in (('track_iou_threshold', 'iou_threshold', float, 0.0),
+                                       ('track_max_age', 'max_age', int, 1),
+                                       ('track_min_hits', 'min_hits', int, 1)):
+        if options.get(field) in (None, ''):
+            continue
+        value = cast(options[field])
+        if value < minimum or (name == 'iou_threshold' and value > 1):
+            raise ValueError(f'{field} is out of range')
+        parsed[name] = value
+    if options.get('count_lines'):
+        parsed['lines'] = parse_lines(options['count_lines'])
+    return parsed
+
+class VehicleTracker:
+    """IoU tracker with a constant-velocity filter, run over a DetectionStore.
+
+    All live tracks are kept as arrays. Each frame, track boxes are predicted
+    forward and matched to same-class detections greedily by IoU. Matched
+    tracks are corrected with a fixed-gain (alpha-beta, i.e. steady-state
+    Kalman) update. Tracks unseen for more than `max_age` frames are retired.
+    A track counts as a unique vehicle once it has `min_hits` detections.
+    `lines` are counting lines, each {'name': ..., 'points': [[x1, y1], [x2, y2]]};
+    a track crossing one is counted once per direction. 'forward' is from the
+    left-hand to the right-hand side when facing from the first point to the second.
+    """
+
+    def __init__(self, class_names, fps, iou_threshold=0.3, max_age=None, min_hits=2,
+                 alpha=0.7, beta=0.3, lines=None):
+        self.class_names = list(class_names)
+        self.fps = fps or 1
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age if max_age is not None else int(self.fps * 2)
+        self.min_hits = min_hits
+        self.alpha = alpha
+        self.beta = beta
+        self.lines = [(l['name'], np.asarray(l['points'][0], dtype=np.float64), np.asarray(l['points'][1], dtype=np.float64))
+                      for l in (lines or [])]
+        self.next_id = 0
+        self.ids = np.zeros(0, dtype=np.int32)
+        self.classes = np.zeros(0, dtype=np.int16)
+        self.boxes = np.zeros((0, 4))
+        self.velocity = np.zeros((0, 2))
+        self.first_frame = np.zeros(0, dtype=np.int64)
+        self.last_frame = np.zeros(0, dtype=np.int64)
+        self.hits = np.zeros(0, dtype=np.int32)
+        self.centroid = np.zeros((0, 2))
+        self.crossed = {}
+        self.unique = np.zeros(len(self.class_names), dtype=np.int64)
+        self.dwell_sum = np.zeros(len(self.class_names))
+        self.dwell_max = np.zeros(len(self.class_names))
+        self.dwell_tracks = np.zeros(len(self.class_names), dtype=np.int64)
+        self.crossings = {name: np.zeros((2, len(self.class_names)), dtype=np.int64) for name, _, _ in self.lines}
+        self.rows_seen = 0
+
+    @classmethod
+    def from_options(cls, class_names, fps, options):
+        kwargs = {}
+        for name, cast in (('iou_threshold', float), ('max_age', int), ('min_hits', int)):
+            if options.get(name) not in (None, ''):
+                kwargs[name] = cast(options[name])
+        if options.get('lines'):
+            kwargs['lines'] = options['lines']
+        return cls(class_names, fps, **kwargs)
+
+    def observe_store(self, store):
+        """Track every frame added to `store` since the last call; writes store.track_id."""
+        for row in range(self.rows_seen, store.frame_count):
+            start, end = store._detection_range(row)
+            if store.reused[row] and row > 0:
+                # Gated frame repeats the previous frame's detections in the same order
+                prev_start, prev_end = store._detection_range(row - 1)
+                store.track_id[start:end] = store.track_id[prev_start:prev_end]
+                continue
+            store.track_id[start:end] = self.update(
+                int(store.frame_number[row]), store.bbox[start:end].astype(np.float64), store.class_id[start:end]
+            )
+        self.rows_seen = store.frame_count
+
+    def update(self, frame_number, boxes, classes):
+        """Associate one frame's (n, 4) x1, y1, x2, y2 boxes; returns their track ids."""
+        self._retire(frame_number)
+
+        # Predict live tracks forward to this frame
+        dt = (frame_number - self.last_frame).astype(np.float64)
+        predicted = self.boxes.copy()
+        predicted[:, :2] += self.velocity * dt[:, None]
+
+        detections = _to_cxcywh(boxes) if len(boxes) else np.zeros((0, 4))
+        iou = iou_matrix(_to_xyxy(predicted), boxes) if len(boxes) else np.zeros((len(predicted), 0))
+        iou[self.classes[:, None] != classes[None, :]] = 0
+
+        # Greedy assignment in descending IoU order
+        track_for = np.full(len(boxes), -1, dtype=np.int64)
+        if iou.size:
+            order = np.argsort(-iou, axis=None)
+            used_tracks = np.zeros(len(predicted), dtype=bool)
+            for flat in order:
+                t, d = divmod(int(flat), iou.shape[1])
+                if iou[t, d] < self.iou_threshold:
+                    break
+                if used_tracks[t] or track_for[d] >= 0:
+                    continue
+                used_tracks[t] = True
+                track_for[d] = t
+
+        matched_det = np.nonzero(track_for >= 0)[0]
+        if len(matched_det):
+            t = track_for[matched_det]
+            residual = detections[matched_det] - predicted[t]
+            self.boxes[t] = predicted[t] + self.alpha * residual
+            self.velocity[t] += self.beta * residual[:, :2] / np.maximum(dt[t], 1)[:, None]
+            self.last_frame[t] = frame_number
+            self.hits[t] += 1
+            newly_confirmed = t[self.hits[t] == self.min_hits]
+            np.add.at(self.unique, self.classes[newly_confirmed], 1)
+            self._count_crossings(t, detections[matched_det, :2])
+            self.centroid[t] = detections[matched_det, :2]
+
+        # Unmatched detections start new tracks
+        new_det = np.nonzero(track_for < 0)[0]
+        ids = np.zeros(len(boxes), dtype=np.int32)
+        if len(matched_det):
+            ids[matched_det] = self.ids[track_for[matched_det]]
+        if len(new_det):
+            new_ids = np.arange(self.next_id, self.next_id + len(new_det), dtype=np.int32)
+            self.next_id += len(new_det)
+            ids[new_det] = new_ids
+            self.ids = np.concatenate([self.ids, new_ids])
+            self.classes = np.concatenate([self.classes, classes[new_det]])
+            self.boxes = np.concatenate([self.boxes, detections[new_det]])
+            self.velocity = np.concatenate([self.velocity, np.zeros((len(new_det), 2))])
+            self.first_frame = np.concatenate([self.first_frame, np.full(len(new_det), frame_number)])
+            self.last_frame = np.concatenate([self.last_frame, np.full(len(new_det), frame_number)])
+            self.hits = np.concatenate([self.hits, np.ones(len(new_det), dtype=np.int32)])
+            self.centroid = np.concatenate([self.centroid, detections[new_det, :2]])
+            if self.min_hits <= 1:
+                np.add.at(self.unique, classes[new_det], 1)
+        return ids
+
+    def _count_crossings(self, tracks, centroids):
+        for name, a, b in self.lines:
+            before = _side(a, b, self.centroid[tracks])
+            after = _side(a, b, centroids)
+            changed = (before != after) & (before != 0) & (after != 0)
+            if not changed.any():
+                continue
+            # The movement must also straddle the line segment itself, not just its extension
+            for i in np.nonzero(changed)[0]:
+                p, q = self.centroid[tracks[i]], centroids[i]
+                ends = _side(p, q, np.vstack([a, b]))
+                if ends[0] == ends[1]:
+                    continue
+                direction = 0 if before[i] < 0 else 1
+                key = (int(self.ids[tracks[i]]), name, direction)
+                if key not in self.crossed:
+                    self.crossed[key] = True
+                    self.crossings[name][direction, self.classes[tracks[i]]] += 1
+
+    def _retire(self, frame_number):
+        expired = frame_number - self.last_frame > self.max_age
+        if expired.any():
+            self._close(expired)
+
+    def _close(self, mask):
+        confirmed = mask & (self.hits >= self.min_hits)
+        dwell = (self.last_frame[confirmed] - self.first_frame[confirmed]) / self.fps
+        classes = self.classes[confirmed]
+        np.add.at(self.dwell_sum, classes, dwell)
+        np.add.at(self.dwell_tracks, classes, 1)
+        np.maximum.at(self.dwell_max, classes, dwell)
+        retired = set(self.ids[mask].tolist())
+        self.crossed = {k: v for k, v in self.crossed.items() if k[0] not in retired}
+        keep = ~mask
+        for name in ('ids', 'classes', 'boxes', 'velocity', 'first_frame', 'last_frame', 'hits', 'centroid'):
+            setattr(self, name, getattr(self, name)[keep])
+
+    def finish(self):
+        self._close(np.ones(len(self.ids), dtype=bool))
+
+    def summary(self):
+        names = self.class_names
+        live = self.hits >= self.min_hits
+        return {
+            'unique_vehicles': {name: int(self.unique[i]) for i, name in enumerate(names)},
+            'total_unique_vehicles': int(self.unique.sum()),
+            'active_tracks': int(live.sum()),
+            'dwell_seconds': {
+                name: {
+                    'mean': float(self.dwell_sum[i] / self.dwell_tracks[i]) if self.dwell_tracks[i] else 0,
+                    'max': float(self.dwell_max[i])
+                }
+                for i, name in enumerate(names)
+            },
+            'line_crossings': {
+                name: {
+                    'forward': {c: int(counts[0, i]) for i, c in enumerate(names)},
+                    'backward': {c: int(counts[1, i]) for i, c in enumerate(names)}
+                }
+                for name, counts in self.crossings.items()
+            }
+        }
+
+def interpolate_track_boxes(store, frame_number):
+    """Estimate each track's box at an unsampled frame from its nearest keyframes.
+
+    Returns {track_id: [x1, y1, x2, y2]} for tracks seen both before and after
+    `frame_number` (or at it), linearly interpolated between the two detections.
+    """
+    d = store.detection_count
+    track_ids = store.track_id[:d]
+    frames = store.frame_number[store.frame_index[:d]]
+    # Tracked detections sorted by track, then frame; each track is one contiguous run
+    rows = np.nonzero(track_ids >= 0)[0]
+    rows = rows[np.lexsort((frames[rows], track_ids[rows]))]
+    tracks, track_frames = track_ids[rows], frames[rows]
+    starts = np.flatnonzero(np.r_[True, tracks[1:] != tracks[:-1]]) if len(rows) else np.zeros(0, dtype=np.int64)
+    ends = np.r_[starts[1:], len(rows)]
+    boxes = {}
+    for start, end in zip(starts, ends):
+        after = start + int(np.searchsorted(track_frames[start:end], frame_number))
+        if after == end or (after == start and track_frames[after] != frame_number):
+            continue
+        if track_frames[after] == frame_number:
+            boxes[int(tracks[start])] = store.bbox[rows[after]].tolist()
+            continue
+        f0, f1 = track_frames[after - 1], track_frames[after]
+        w = (frame_number - f0) / float(f1 - f0)
+        box = (1 - w) * store.bbox[rows[after - 1]] + w * store.bbox[rows[after]]
+        boxes[int(tracks[start])] = box.tolist()
+    return boxes
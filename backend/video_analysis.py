@@ -1,21 +1,169 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, send_file, stream_with_context
 import os
+import glob
+import json
+import time
 import uuid
+import threading
 from werkzeug.utils import secure_filename
 from yolo_processor import YOLOProcessor
-import threading
+from frame_sampler import FrameSampler
+from motion_gate import MotionGate
+from job_scheduler import JobScheduler, QueueFull, SchedulerClosed
+from result_store import ResultStore
+from vehicle_tracker import parse_tracking_options, interpolate_track_boxes
+from camera_roi import CameraROI
+from detectors import resolve_detector
+from upload_store import UploadStore, UploadError, OffsetMismatch, JobIndex, job_key, stream_to_file
+from metrics import metrics, tracer, profiler, merge_exposition
 
 video_bp = Blueprint('video', __name__)
-yolo = YOLOProcessor()
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'mp4', 'avi', 'mov'}
+MAX_SEGMENT_WORKERS = int(os.environ.get('VIDEO_MAX_SEGMENT_WORKERS', str(os.cpu_count() or 1)))
+
+# Shared by every worker's YOLOProcessor so /progress sees all tasks
+result_store = ResultStore.from_env()
+scheduler = JobScheduler(
+    lambda: YOLOProcessor(result_store=result_store),
+    workers=int(os.environ.get('VIDEO_WORKERS', '2')),
+    max_queue=int(os.environ.get('VIDEO_MAX_QUEUE', '20')),
+    lanes=('live', 'batch'),
+    # Streams end on the job's final status, so wake them once it is set
+    on_finish=lambda job: result_store.notify()
+)
 
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
+def _job_active(task_id):
+    job = scheduler.get(task_id)
+    return job is not None and job.status in ('queued', 'running')
+
+# Chunked uploads, and the content hash + parameters -> task index used to skip duplicate jobs
+upload_store = UploadStore(UPLOAD_FOLDER, ttl=int(os.environ.get('UPLOAD_TTL', '3600')), job_active=_job_active)
+job_index = JobIndex(os.path.join(result_store.directory, 'job_index.jsonl') if result_store.directory else None)
+# Evicted results can no longer answer a duplicate job, so their index entries go too
+result_store.on_evict = job_index.discard
+dedup_lock = threading.Lock()
+
+# Scheduler state is read when /metrics is scraped
+def _scheduler_gauges():
+    stats = scheduler.stats()
+    yield 'video_jobs', stats['running'], {'state': 'running'}
+    for lane, queued in stats['queued'].items():
+        yield 'video_jobs', queued, {'state': 'queued', 'lane': lane}
+metrics.register(_scheduler_gauges)
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# Form fields that change analysis results; with the content hash they identify duplicate jobs
+ANALYSIS_FIELDS = ('sample_fps', 'sample_interval', 'sample_stride', 'adaptive', 'pixel_threshold', 'motion_threshold',
+                   'max_skip', 'busy_vehicle_count', 'busy_hold', 'track_iou_threshold', 'track_max_age',
+                   'track_min_hits', 'count_lines')
+
+def _analysis_options(form):
+    """Parse the analysis form fields; returns (options, None) or (None, error response)."""
+    try:
+        # Optional sample_stride / sample_fps / sample_interval form fields
+        sampler = FrameSampler.from_options(form)
+        # Optional adaptive=1 plus motion gate thresholds
+        motion_gate = MotionGate.from_options(form)
+        # Optional workers=N splits a long video across N processes, up to MAX_SEGMENT_WORKERS
+        workers = int(form.get('workers') or 0)
+        if workers < 0:
+            raise ValueError('workers must not be negative')
+        workers = min(workers, MAX_SEGMENT_WORKERS)
+        # Optional camera_id (see CAMERA_CONFIG) or inline roi JSON with lane polygons
+        roi = CameraROI.from_options(form)
+        # Optional tracker settings and count_lines (JSON list of named two-point lines)
+        tracking = parse_tracking_options(form)
+    except ValueError as e:
+        return None, (jsonify({'error': f'Invalid analysis options: {str(e)}'}), 400)
+    if workers and motion_gate is not None:
+        return None, (jsonify({'error': 'Adaptive sampling cannot be combined with workers'}), 400)
+
+    # Live incident footage is scheduled ahead of batch archives
+    lane = form.get('priority', 'batch')
+    if lane not in scheduler.lanes:
+        return None, (jsonify({'error': f'Invalid priority: {lane}'}), 400)
+
+    params = {name: form[name] for name in ANALYSIS_FIELDS if form.get(name) not in (None, '')}
+    if roi is not None:
+        params['roi'] = roi.config()
+    params['detector'] = list(resolve_detector())
+    # Optional trace=1 records a per-task trace (see /trace/<task_id>); it does not change results
+    trace = form.get('trace') in ('1', 'true')
+    return {'sampler': sampler, 'motion_gate': motion_gate, 'workers': workers, 'roi': roi, 'tracking': tracking,
+            'lane': lane, 'params': params, 'trace': trace}, None
+
+def _queue_full():
+    return jsonify({'error': 'Too many queued videos, try again later'}), 429, {'Retry-After': '30'}
+
+def _submit(task_id, file_path, options, upload=None):
+    # Raises QueueFull / SchedulerClosed from the scheduler
+    if options['workers']:
+        target, kwargs = YOLOProcessor.process_video_sharded, {'workers': options['workers'], 'sampler': options['sampler'],
+                                                               'tracking': options['tracking'], 'roi': options['roi']}
+    else:
+        target, kwargs = YOLOProcessor.process_video, {'sampler': options['sampler'], 'motion_gate': options['motion_gate'],
+                                                       'tracking': options['tracking'], 'roi': options['roi'],
+                                                       'upload': upload}
+    if options['trace']:
+        tracer.start(task_id)
+    try:
+        scheduler.submit(task_id, target, args=(file_path, task_id), kwargs=kwargs, lane=options['lane'])
+    except Exception:
+        tracer.finish(task_id)
+        raise
+
+def _existing_task(key):
+    # Task that already has, or is producing, the results for a job key: (task_id, 'finished' / 'attached')
+    task_id = job_index.get(key)
+    if task_id is None:
+        return None, None
+    job = scheduler.get(task_id)
+    if job is not None and job.status in ('queued', 'running'):
+        return task_id, 'attached'
+    if job is not None and job.status != 'done':
+        return None, None
+    if not result_store.is_running(task_id) and result_store.progress(task_id)['current_results'] is not None:
+        return task_id, 'finished'
+    return None, None
+
+def _task_response(task_id, duplicate=None):
+    response = {
+        'message': 'Video upload successful',
+        'task_id': task_id,
+        'queue_position': scheduler.queue_position(task_id)
+    }
+    if duplicate:
+        response['duplicate'] = duplicate
+    return jsonify(response), 200
+
+def _submit_unique(file_path, content_hash, options):
+    """Submit a job for an uploaded file unless identical content and parameters already have one."""
+    key = job_key(content_hash, options['params'])
+    with dedup_lock:
+        task_id, duplicate = _existing_task(key)
+        if task_id is not None:
+            # Same footage, same settings: reuse the results instead of storing and analyzing it again
+            os.remove(file_path)
+            return _task_response(task_id, duplicate)
+
+        task_id = str(uuid.uuid4())
+        try:
+            _submit(task_id, file_path, options)
+        except QueueFull:
+            os.remove(file_path)
+            return _queue_full()
+        except SchedulerClosed:
+            os.remove(file_path)
+            return jsonify({'error': 'Video analysis is unavailable'}), 503
+        job_index.set(key, task_id)
+    return _task_response(task_id)
+
 @video_bp.route('/upload', methods=['POST'])
 def upload_video():
     if 'video' not in request.files:
@@ -26,23 +174,288 @@ def upload_video():
         return jsonify({'error': 'No selected file'}), 400
     
     if file and allowed_file(file.filename):
-        task_id = str(uuid.uuid4())
+        options, error = _analysis_options(request.form)
+        if error:
+            return error
+
+        # Refuse early when saturated so the upload is not saved for nothing
+        if scheduler.queued_count() >= scheduler.max_queue:
+            return _queue_full()
         filename = secure_filename(file.filename)
-        file_path = os.path.join(UPLOAD_FOLDER, f"{task_id}_{filename}")
-        file.save(file_path)
-        
-        # Start processing in background
-        thread = threading.Thread(target=yolo.process_video, args=(file_path, task_id))
-        thread.start()
+        file_path = os.path.join(UPLOAD_FOLDER, f"{uuid.uuid4()}_{filename}")
+        # Hash while streaming to disk
+        content_hash = stream_to_file(file.stream, file_path)
         
-        return jsonify({
-            'message': 'Video upload successful',
-            'task_id': task_id
-        }), 200
+        # Queue processing in background
+        return _submit_unique(file_path, content_hash, options)
     
     return jsonify({'error': 'Invalid file type'}), 400
 
+@video_bp.route('/uploads', methods=['POST'])
+def create_upload():
+    """Start a chunked, resumable upload.
+
+    Takes filename, optional size (bytes) and the same analysis fields as
+    /upload. With analyze_early=1 analysis starts on the received prefix while
+    chunks are still arriving, and the task_id is returned right away; such
+    jobs skip duplicate detection since the content hash is not known yet.
+    """
+    filename = secure_filename(request.form.get('filename', ''))
+    if not filename or not allowed_file(filename):
+        return jsonify({'error': 'Invalid file type'}), 400
+    try:
+        size = int(request.form['size']) if request.form.get('size') else None
+    except ValueError:
+        return jsonify({'error': 'size must be an integer'}), 400
+    options, error = _analysis_options(request.form)
+    if error:
+        return error
+    analyze_early = request.form.get('analyze_early') in ('1', 'true', 'True')
+    if analyze_early and options['workers']:
+        return jsonify({'error': 'Early analysis cannot be combined with workers'}), 400
+    if scheduler.queued_count() >= scheduler.max_queue:
+        return _queue_full()
+
+    upload = upload_store.create(filename, size, request.form.to_dict())
+    if analyze_early:
+        task_id = str(uuid.uuid4())
+        try:
+            _submit(task_id, upload.path, options, upload=upload)
+        except QueueFull:
+            upload_store.remove(upload.upload_id, delete_file=True)
+            return _queue_full()
+        except SchedulerClosed:
+            upload_store.remove(upload.upload_id, delete_file=True)
+            return jsonify({'error': 'Video analysis is unavailable'}), 503
+        upload.task_id = task_id
+    return jsonify(upload.summary()), 201
+
+@video_bp.route('/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    # Raw chunk body at ?offset=N or Content-Range: bytes N-M/total; a mismatch answers 409 with the offset to resume from
+    upload = upload_store.get(upload_id)
+    if upload is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    try:
+        content_range = request.headers.get('Content-Range')
+        if content_range:
+            offset = int(content_range.split()[1].split('-')[0])
+        else:
+            offset = int(request.args.get('offset', upload.received))
+    except (ValueError, IndexError):
+        return jsonify({'error': 'Invalid offset or Content-Range'}), 400
+    try:
+        received = upload.write(offset, request.stream)
+    except OffsetMismatch as e:
+        return jsonify({'error': str(e), 'offset': e.expected}), 409
+    except UploadError as e:
+        return jsonify({'error': str(e), 'offset': upload.received}), 400
+    return jsonify({'upload_id': upload_id, 'offset': received})
+
+@video_bp.route('/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    upload = upload_store.get(upload_id)
+    if upload is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    return jsonify(upload.summary())
+
+@video_bp.route('/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    upload = upload_store.get(upload_id)
+    if upload is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    try:
+        content_hash = upload.finish()
+    except UploadError as e:
+        return jsonify({'error': str(e), 'offset': upload.received}), 400
+    options, error = _analysis_options(upload.options)
+    if error:
+        upload_store.remove(upload_id, delete_file=True)
+        return error
+    upload_store.remove(upload_id)
+
+    if upload.task_id is not None:
+        # Early analysis is already running on this file; later duplicates attach to it
+        key = job_key(content_hash, options['params'])
+        with dedup_lock:
+            if _existing_task(key)[0] is None:
+                job_index.set(key, upload.task_id)
+        return _task_response(upload.task_id)
+    return _submit_unique(upload.path, content_hash, options)
+
 @video_bp.route('/progress/<task_id>', methods=['GET'])
 def get_progress(task_id):
-    result = yolo.get_task_progress(task_id)
+    # Summary and progress only; per-frame data is paged from /results
+    result = result_store.progress(task_id)
+    job = scheduler.get(task_id)
+    if job is not None:
+        result['status'] = job.status
+        result['queue_position'] = scheduler.queue_position(task_id)
+        if job.error:
+            result['error'] = job.error
     return jsonify(result)
+
+@video_bp.route('/results/<task_id>/<any(frame_by_frame, traffic_density):key>', methods=['GET'])
+def get_result_page(task_id, key):
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+        limit = min(1000, max(1, int(request.args.get('limit', 100))))
+    except ValueError:
+        return jsonify({'error': 'offset and limit must be integers'}), 400
+
+    items = result_store.page(task_id, key, offset, limit)
+    if items is None:
+        return jsonify({'error': 'Task not found'}), 404
+    return jsonify({'task_id': task_id, 'offset': offset, 'limit': limit, key: items})
+
+@video_bp.route('/results/<task_id>/boxes/<int:frame_number>', methods=['GET'])
+def get_track_boxes(task_id, frame_number):
+    # Track boxes at any frame, interpolated between sampled keyframes, so sparse sampling still gives positions
+    store = result_store.detections(task_id)
+    if store is None:
+        return jsonify({'error': 'Task not found'}), 404
+    boxes = interpolate_track_boxes(store, frame_number)
+    return jsonify({'task_id': task_id, 'frame_number': frame_number,
+                    'boxes': {str(track_id): box for track_id, box in boxes.items()}})
+
+STREAM_CHUNK = 500
+
+def _stream_events(task_id, cursor):
+    # Yields (event, payload) pairs: only frames after `cursor` plus running totals
+    version = result_store.version
+    while True:
+        frames = result_store.page(task_id, 'frame_by_frame', cursor, STREAM_CHUNK) or []
+        if frames:
+            density = result_store.page(task_id, 'traffic_density', cursor, len(frames))
+            cursor += len(frames)
+            state = result_store.progress(task_id)
+            yield 'delta', {
+                'cursor': cursor,
+                'progress': state['progress'],
+                'frames': frames,
+                'traffic_density': density,
+                'totals': state['current_results']
+            }
+            continue
+
+        job = scheduler.get(task_id)
+        if job is not None and job.status in ('failed', 'cancelled'):
+            yield 'end', {'status': job.status, 'error': job.error}
+            return
+        if not result_store.is_running(task_id) and (job is None or job.status == 'done'):
+            state = result_store.progress(task_id)
+            if state['current_results'] is not None:
+                yield 'end', {'status': 'done', 'cursor': cursor, 'summary': state['current_results']}
+                return
+
+        new_version = result_store.wait_for_update(version, timeout=15)
+        if new_version == version:
+            yield 'heartbeat', {'cursor': cursor}
+        version = new_version
+
+@video_bp.route('/stream/<task_id>', methods=['GET'])
+def stream_progress(task_id):
+    """Stream new frame summaries, density points and running totals as they are produced.
+
+    ?format=sse (default) sends Server-Sent Events; ?format=ndjson sends one JSON
+    object per line. ?cursor=N resumes after the first N frames.
+    """
+    if scheduler.get(task_id) is None and result_store.progress(task_id)['current_results'] is None:
+        return jsonify({'error': 'Task not found'}), 404
+    try:
+        cursor = max(0, int(request.args.get('cursor', 0)))
+    except ValueError:
+        return jsonify({'error': 'cursor must be an integer'}), 400
+
+    if request.args.get('format') == 'ndjson':
+        def generate():
+            for event, payload in _stream_events(task_id, cursor):
+                yield json.dumps(dict(payload, event=event)) + '\n'
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    def generate():
+        for event, payload in _stream_events(task_id, cursor):
+            if event == 'heartbeat':
+                yield ': heartbeat\n\n'
+            else:
+                yield f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@video_bp.route('/results/<task_id>/detections.npz', methods=['GET'])
+def get_detections_export(task_id):
+    # Columnar detections of a finished task, for offline analytics
+    path = result_store.export_path(task_id)
+    if path is None:
+        return jsonify({'error': 'Task not found or not finished'}), 404
+    return send_file(os.path.abspath(path), mimetype='application/octet-stream',
+                     as_attachment=True, download_name=f'{task_id}_detections.npz')
+
+@video_bp.route('/results/<task_id>/detections.<any(parquet, feather):fmt>', methods=['GET'])
+def get_detections_table(task_id, fmt):
+    # Same detections as a flat Arrow table (Parquet or Feather), written next to the .npz on first request
+    path = result_store.export_path(task_id)
+    if path is None:
+        return jsonify({'error': 'Task not found or not finished'}), 404
+    table_path = os.path.join(os.path.dirname(path), f'detections.{fmt}')
+    if not os.path.exists(table_path):
+        temporary = os.path.join(os.path.dirname(path), f'detections.{uuid.uuid4().hex}.{fmt}')
+        try:
+            result_store.detections(task_id).to_arrow(temporary)
+        except ImportError:
+            return jsonify({'error': 'Arrow export needs pyarrow installed'}), 501
+        os.replace(temporary, table_path)
+    return send_file(os.path.abspath(table_path), mimetype='application/octet-stream',
+                     as_attachment=True, download_name=f'{task_id}_detections.{fmt}')
+
+@video_bp.route('/cancel/<task_id>', methods=['POST'])
+def cancel_task(task_id):
+    if not scheduler.cancel(task_id):
+        return jsonify({'error': 'Task not found or already finished'}), 404
+    return jsonify({'message': 'Cancellation requested', 'task_id': task_id})
+
+@video_bp.route('/queue', methods=['GET'])
+def queue_status():
+    return jsonify(scheduler.stats())
+
+# Worker metric files not rewritten for this long belong to exited workers
+METRICS_STALE_SECONDS = int(os.environ.get('METRICS_STALE_SECONDS', '60'))
+
+@video_bp.route('/metrics', methods=['GET'])
+def metrics_text():
+    # This process's metrics plus those exported by live ANPR workers (METRICS_DIR)
+    texts = [metrics.render()]
+    metrics_dir = os.environ.get('METRICS_DIR')
+    if metrics_dir:
+        cutoff = time.time() - METRICS_STALE_SECONDS
+        for path in sorted(glob.glob(os.path.join(metrics_dir, '*.prom'))):
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    continue
+                with open(path, encoding='utf-8') as f:
+                    texts.append(f.read())
+            except OSError:
+                continue
+    return Response(merge_exposition(texts), mimetype='text/plain; version=0.0.4')
+
+@video_bp.route('/trace/<task_id>', methods=['GET'])
+def task_trace(task_id):
+    trace = tracer.load(task_id)
+    if trace is None:
+        return jsonify({'error': 'No trace for this task; submit it with trace=1'}), 404
+    return jsonify(trace)
+
+@video_bp.route('/profile', methods=['GET'])
+def profile_process():
+    # Collapsed stacks of every thread in this process, for flamegraph.pl or speedscope.
+    # Exposes code paths and ties up a request thread, so it is off unless METRICS_PROFILE_ENABLED=1
+    if os.environ.get('METRICS_PROFILE_ENABLED', '0') not in ('1', 'true', 'True'):
+        return jsonify({'error': 'Not found'}), 404
+    try:
+        seconds = min(float(request.args.get('seconds', 10)), 60)
+    except ValueError:
+        return jsonify({'error': 'Invalid seconds'}), 400
+    stacks = profiler.profile(seconds)
+    if stacks is None:
+        return jsonify({'error': 'A profile is already being recorded'}), 409
+    return Response(stacks, mimetype='text/plain')
@@ -1,104 +1,417 @@
 import cv2
-import numpy as np
-from ultralytics import YOLO
 import json
 import os
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from datetime import datetime
+from frame_sampler import FrameSampler
+from job_scheduler import JobCancelled
+from result_store import ResultStore
+from detection_store import DetectionStore
+from vehicle_tracker import VehicleTracker
+from detectors import get_detector
+from metrics import metrics, tracer, record_stage
+
+# Marks the end of a pipeline queue
+_END = object()
+
+def _put(q, item, stop):
+    # Blocking put that gives up once the pipeline is stopping
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
 
 class YOLOProcessor:
-    def __init__(self):
-        self.model = YOLO('yolov8n.pt')  # Load the YOLOv8 model
+    def __init__(self, batch_size=4, queue_size=16, result_store=None, detector=None):
+        # Loaded on first inference; one per thread unless the backend is thread-safe (see get_detector)
+        self.detector = detector if detector is not None else get_detector()
         self.vehicle_classes = ['car', 'truck', 'bus', 'motorcycle', 'bicycle']
-        self.results_cache = {}
+        # Several processors (one per scheduler worker) can share one store
+        self.result_store = result_store if result_store is not None else ResultStore()
+        self.sampler = FrameSampler(stride=5)  # Process every 5th frame to improve performance
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+
+    def process_video(self, video_path, task_id, batch_size=None, sampler=None, motion_gate=None, tracking=None,
+                      roi=None, upload=None, cancel=None):
+        batch_size = batch_size or self.batch_size
+        sampler = sampler or self.sampler
+        if motion_gate is not None:
+            motion_gate.reset()
+        # An upload still arriving is read as it grows (see upload_store.GrowingCapture)
+        cap = upload.capture(cancel) if upload is not None else cv2.VideoCapture(video_path)
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        analysis_results = self._new_results(total_frames, fps, roi)
+        tracker = VehicleTracker.from_options(self.vehicle_classes, fps, tracking or {})
+        track_seconds = [0.0]
+        started = time.perf_counter()
+
+        def on_batch(last_frame):
+            tracking_started = time.perf_counter()
+            self._track(tracker, analysis_results)
+            track_seconds[0] += record_stage('video', 'tracking', tracking_started)
+            # Save intermediate results
+            total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) if upload is not None else total_frames
+            progress = min(((last_frame + 1) / total) * 100, 100) if total else 0
+            self.result_store.set_progress(task_id, progress, analysis_results)
+
+        try:
+            # Spans of every pipeline thread go to the task's trace, if one was started
+            with tracer.bind(tracer.get(task_id)):
+                frames_analyzed, timings = self.analyze_range(
+                    cap, fps, sampler, batch_size, analysis_results,
+                    motion_gate=motion_gate, roi=roi, on_batch=on_batch, cancel=cancel, task_id=task_id
+                )
+            if upload is not None:
+                # The frame count is only final once the whole file has arrived
+                total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+                analysis_results['total_frames'] = total_frames
+                analysis_results['duration'] = total_frames / fps if fps else 0
+        except BaseException:
+            self.result_store.discard(task_id)
+            tracer.finish(task_id)
+            raise
+        finally:
+            cap.release()
+
+        timings['tracking'] = track_seconds[0]
+        self._finalize_results(analysis_results, sampler, motion_gate, tracker, roi, frames_analyzed, timings,
+                               time.perf_counter() - started, {'batch_size': batch_size})
+
+        # Save final results
+        with tracer.bind(tracer.get(task_id)):
+            self.result_store.complete(task_id, analysis_results)
+        tracer.finish(task_id)
+
+        return analysis_results
 
-    def process_video(self, video_path, task_id):
+    def process_video_sharded(self, video_path, task_id, workers=None, segments=None, batch_size=None, sampler=None,
+                              tracking=None, roi=None, cancel=None):
+        """Split the video into frame-range segments and analyze them in a process pool.
+
+        Each worker process loads its own model. Segment results are merged in
+        order and, because FrameSampler positions are absolute, match a serial
+        process_video run with the same sampler. Tracking runs here in the parent
+        over the merged frames, so tracks continue across segment boundaries.
+        Motion gating is sequential and is not available here.
+        """
+        batch_size = batch_size or self.batch_size
+        sampler = sampler or self.sampler
         cap = cv2.VideoCapture(video_path)
         fps = cap.get(cv2.CAP_PROP_FPS)
         total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        
-        analysis_results = {
+        cap.release()
+        if total_frames <= 0:
+            # Without a frame count the video cannot be split; analyze it serially
+            return self.process_video(video_path, task_id, batch_size=batch_size, sampler=sampler, tracking=tracking,
+                                      roi=roi, cancel=cancel)
+
+        workers = workers or max(1, (os.cpu_count() or 2) // 2)
+        segments = max(1, min(segments or workers, total_frames))
+        bounds = [(total_frames * i) // segments for i in range(segments + 1)]
+        # The reported frame count can be short; the last segment reads to the end of the file
+        ends = bounds[1:-1] + [None]
+        analysis_results = self._new_results(total_frames, fps, roi)
+        tracker = VehicleTracker.from_options(self.vehicle_classes, fps, tracking or {})
+        started = time.perf_counter()
+
+        context = multiprocessing.get_context('spawn')
+        progress_queue = context.Queue()
+        # Set on cancel or failure so running segments stop at their next batch
+        segment_cancel = context.Event()
+        threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+        done_frames = [0] * segments
+        finished = {}
+        next_merge = 0
+        frames_analyzed = 0
+        timings = {'tracking': 0.0}
+
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_segment_worker,
+                                       initargs=(batch_size, progress_queue, threads_per_worker, segment_cancel))
+        try:
+            # The parent's merge/tracking spans go to the task's trace; segment workers are not traced
+            with tracer.bind(tracer.get(task_id)):
+                pending = {
+                    executor.submit(_process_segment, index, video_path, fps, bounds[index], ends[index], sampler, roi)
+                    for index in range(segments)
+                }
+                while pending:
+                    if cancel is not None and cancel.is_set():
+                        raise JobCancelled()
+                    completed, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                    for future in completed:
+                        index, partial, segment_frames, segment_timings = future.result()
+                        finished[index] = partial
+                        done_frames[index] = bounds[index + 1] - bounds[index]
+                        frames_analyzed += segment_frames
+                        # Stage metrics of segment workers stay in their processes; count the frames here
+                        metrics.inc('video_frames_total', segment_frames)
+                        for stage, seconds in segment_timings.items():
+                            timings[stage] = timings.get(stage, 0.0) + seconds
+
+                    # Merge finished segments in order so current_results is always a prefix of the video
+                    while next_merge in finished:
+                        self._merge_results(analysis_results, finished.pop(next_merge))
+                        next_merge += 1
+                        tracking_started = time.perf_counter()
+                        self._track(tracker, analysis_results)
+                        timings['tracking'] += record_stage('video', 'tracking', tracking_started)
+
+                    while True:
+                        try:
+                            index, frames_done = progress_queue.get_nowait()
+                        except queue.Empty:
+                            break
+                        done_frames[index] = max(done_frames[index], frames_done)
+
+                    progress = min((sum(done_frames) / total_frames) * 100, 100)
+                    self.result_store.set_progress(task_id, progress, analysis_results)
+        except BaseException:
+            # Don't wait for running segments: they see segment_cancel and exit on their own
+            segment_cancel.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+            self.result_store.discard(task_id)
+            tracer.finish(task_id)
+            raise
+        executor.shutdown()
+
+        self._finalize_results(analysis_results, sampler, None, tracker, roi, frames_analyzed, timings,
+                               time.perf_counter() - started,
+                               {'batch_size': batch_size, 'workers': workers, 'segments': segments})
+
+        with tracer.bind(tracer.get(task_id)):
+            self.result_store.complete(task_id, analysis_results)
+        tracer.finish(task_id)
+
+        return analysis_results
+
+    def _new_results(self, total_frames, fps, roi=None):
+        return {
             'vehicle_counts': {class_name: 0 for class_name in self.vehicle_classes},
-            'frame_by_frame': [],
-            'traffic_density': [],
+            # Columnar per-frame detections; exported as frame_by_frame / traffic_density on demand
+            'detections': DetectionStore(self.vehicle_classes, fps, lanes=roi.lanes() if roi is not None else None),
             'total_frames': total_frames,
             'fps': fps,
             'duration': total_frames / fps if fps else 0,
             'timestamp': datetime.now().isoformat()
         }
 
-        frame_count = 0
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                break
-
-            # Process every 5th frame to improve performance
-            if frame_count % 5 == 0:
-                results = self.model(frame)
-                frame_data = self._analyze_frame(results[0], frame_count, fps)
-                analysis_results['frame_by_frame'].append(frame_data)
-                
-                # Update total counts
-                for vehicle_type, count in frame_data['counts'].items():
-                    analysis_results['vehicle_counts'][vehicle_type] += count
-
-                # Calculate traffic density
-                density = len(results[0].boxes) / (frame.shape[0] * frame.shape[1])
-                analysis_results['traffic_density'].append({
-                    'frame': frame_count,
-                    'density': density,
-                    'time': frame_count / fps
-                })
-
-            frame_count += 1
-            
-            # Save intermediate results
-            if frame_count % 100 == 0:
-                self.results_cache[task_id] = {
-                    'progress': (frame_count / total_frames) * 100,
-                    'current_results': analysis_results
-                }
+    def _merge_results(self, analysis_results, partial):
+        for vehicle_type, count in partial['vehicle_counts'].items():
+            analysis_results['vehicle_counts'][vehicle_type] += count
+        analysis_results['detections'].extend(partial['detections'])
+
+    def _track(self, tracker, analysis_results):
+        # Assign track ids to the frames added since the last call
+        tracker.observe_store(analysis_results['detections'])
+        analysis_results['tracking'] = tracker.summary()
+
+    def _finalize_results(self, analysis_results, sampler, motion_gate, tracker, roi, frames_analyzed, timings,
+                          elapsed, settings):
+        fps = analysis_results['fps']
 
-        cap.release()
-        
         # Calculate averages and final statistics
-        analysis_results['average_density'] = np.mean([d['density'] for d in analysis_results['traffic_density']])
-        analysis_results['peak_density'] = max([d['density'] for d in analysis_results['traffic_density']])
+        # Running aggregates kept by the store as frames arrive
+        store = analysis_results['detections']
+        analysis_results['average_density'] = store.average_density()
+        analysis_results['peak_density'] = float(store.density_peak)
         analysis_results['total_vehicles'] = sum(analysis_results['vehicle_counts'].values())
-        
-        # Save final results
-        self.results_cache[task_id] = {
-            'progress': 100,
-            'current_results': analysis_results
-        }
-        
-        return analysis_results
+        # vehicle_counts are detections summed over frames; unique counts come from tracks
+        tracker.finish()
+        analysis_results['tracking'] = tracker.summary()
+        analysis_results['unique_vehicle_counts'] = analysis_results['tracking']['unique_vehicles']
+        analysis_results['sampling'] = sampler.describe(fps, frames_analyzed)
+        analysis_results['motion_gate'] = motion_gate.stats() if motion_gate is not None else {'enabled': False}
+        analysis_results['roi'] = roi.describe() if roi is not None else {'enabled': False}
+        analysis_results['lanes'] = store.lane_summary()
 
-    def _analyze_frame(self, result, frame_number, fps):
-        frame_data = {
-            'frame_number': frame_number,
-            'timestamp': frame_number / fps,
-            'counts': {class_name: 0 for class_name in self.vehicle_classes},
-            'detections': []
-        }
+        analysis_results['performance'] = dict(settings, **{
+            'frames_analyzed': frames_analyzed,
+            'elapsed': elapsed,
+            'analysis_fps': frames_analyzed / elapsed if elapsed else 0,
+            'stage_seconds': timings
+        })
+
+    def analyze_range(self, cap, fps, sampler, batch_size, results, motion_gate=None, roi=None,
+                      start_frame=0, end_frame=None, on_batch=None, cancel=None, task_id=None):
+        """Run the decode/inference/postprocess pipeline over [start_frame, end_frame).
+
+        Appends to the vehicle_counts and detections entries of `results` and
+        returns (frames_analyzed, stage_timings). With a CameraROI, only the
+        ROI crop is decoded into the pipeline and inferred.
+        """
+        # Decoder thread -> frame queue -> inference thread -> batch queue -> postprocess (this thread)
+        timings = {'decode': 0.0, 'motion_gate': 0.0, 'inference': 0.0, 'postprocess': 0.0}
+        frame_queue = queue.Queue(maxsize=self.queue_size)
+        batch_queue = queue.Queue(maxsize=2)
+        stop = threading.Event()
+        errors = []
+
+        decoder = threading.Thread(target=tracer.wrap(self._decode_worker), args=(cap, sampler, fps, motion_gate, roi, start_frame, end_frame, frame_queue, stop, timings, errors), daemon=True)
+        inference = threading.Thread(target=tracer.wrap(self._inference_worker), args=(frame_queue, batch_queue, batch_size, roi.imgsz if roi is not None else None, stop, timings, errors), daemon=True)
+        decoder.start()
+        inference.start()
 
-        for box in result.boxes:
-            class_id = int(box.cls[0])
-            class_name = result.names[class_id]
-            confidence = float(box.conf[0])
-            
-            if class_name in self.vehicle_classes and confidence > 0.5:
-                frame_data['counts'][class_name] += 1
-                
-                # Get bounding box coordinates
-                x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                frame_data['detections'].append({
-                    'class': class_name,
-                    'confidence': confidence,
-                    'bbox': [float(x1), float(y1), float(x2), float(y2)]
-                })
-
-        return frame_data
+        frames_analyzed = 0
+        store = results['detections']
+        vehicle_counts = results['vehicle_counts']
+        try:
+            while True:
+                try:
+                    batch = batch_queue.get(timeout=0.1)
+                except queue.Empty:
+                    # Inference stopped early (error) without delivering the end marker
+                    if not inference.is_alive() and batch_queue.empty():
+                        break
+                    continue
+                if batch is _END:
+                    break
+                metrics.set('video_queue_depth', frame_queue.qsize(), queue='frames', task=task_id)
+                metrics.set('video_queue_depth', batch_queue.qsize(), queue='batches', task=task_id)
+
+                postprocess_started = time.perf_counter()
+                for frame_count, frame_shape, result in batch:
+                    if result is None:
+                        # Motion gate skipped inference: reuse the last detections
+                        counts = store.add_reused_frame(frame_count)
+                    else:
+                        boxes = result
+                        if roi is None:
+                            counts = store.add_frame(frame_count, frame_shape, boxes, self.detector.names)
+                        else:
+                            boxes = roi.to_frame(boxes)
+                            counts = store.add_frame(frame_count, frame_shape, boxes, self.detector.names,
+                                                     area=roi.area, lane_ids=roi.assign_lanes(boxes))
+                        if motion_gate is not None:
+                            motion_gate.observe(int(counts.sum()))
+
+                    # Update total counts
+                    for i, vehicle_type in enumerate(self.vehicle_classes):
+                        vehicle_counts[vehicle_type] += int(counts[i])
+                    frames_analyzed += 1
+                timings['postprocess'] += record_stage('video', 'postprocess', postprocess_started, frames=len(batch))
+                metrics.inc('video_frames_total', len(batch))
+
+                if on_batch is not None:
+                    on_batch(batch[-1][0])
+                if cancel is not None and cancel.is_set():
+                    raise JobCancelled()
+        finally:
+            stop.set()
+            decoder.join()
+            inference.join()
+            metrics.remove('video_queue_depth', queue='frames', task=task_id)
+            metrics.remove('video_queue_depth', queue='batches', task=task_id)
+
+        if errors:
+            raise errors[0]
+        return frames_analyzed, timings
+
+    def _decode_worker(self, cap, sampler, fps, motion_gate, roi, start_frame, end_frame, frame_queue, stop, timings, errors):
+        try:
+            frames = sampler.frames(cap, fps, start_frame, end_frame, stop=stop)
+            while True:
+                decode_started = time.perf_counter()
+                item = next(frames, None)
+                timings['decode'] += record_stage('video', 'decode', decode_started)
+                if item is None:
+                    break
+
+                frame_count, frame = item
+                if roi is not None:
+                    frame = roi.crop(frame)
+                infer = True
+                if motion_gate is not None:
+                    gate_started = time.perf_counter()
+                    infer = motion_gate.should_infer(frame)
+                    timings['motion_gate'] += record_stage('video', 'motion_gate', gate_started)
+                # Gated frames travel without pixels so they don't pin memory
+                if not _put(frame_queue, (frame_count, frame.shape, frame if infer else None), stop):
+                    return
+        except Exception as e:
+            errors.append(e)
+        finally:
+            _put(frame_queue, _END, stop)
+
+    def _inference_worker(self, frame_queue, batch_queue, batch_size, imgsz, stop, timings, errors):
+        try:
+            batch = []
+            pending = 0
+            done = False
+            while not done and not stop.is_set():
+                try:
+                    item = frame_queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item is _END:
+                    done = True
+                else:
+                    batch.append(item)
+                    pending += item[2] is not None
+
+                if batch and (done or pending >= batch_size):
+                    results = iter([])
+                    inferred = [frame for _, _, frame in batch if frame is not None]
+                    if inferred:
+                        inference_started = time.perf_counter()
+                        results = iter(self.detector.predict(inferred, imgsz=imgsz))
+                        timings['inference'] += record_stage('video', 'inference', inference_started,
+                                                             frames=len(inferred))
+                        metrics.inc('video_frames_inferred_total', len(inferred))
+                    # Gated frames keep their place in the stream with a None result
+                    output = [(n, shape, next(results) if frame is not None else None) for n, shape, frame in batch]
+                    if not _put(batch_queue, output, stop):
+                        return
+                    batch = []
+                    pending = 0
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            _put(batch_queue, _END, stop)
 
     def get_task_progress(self, task_id):
-        return self.results_cache.get(task_id, {'progress': 0, 'current_results': None})
+        return self.result_store.progress(task_id)
+
+# Per-process state for process_video_sharded workers
+_segment_processor = None
+_segment_progress = None
+_segment_cancel = None
+
+def _init_segment_worker(batch_size, progress_queue, threads, cancel):
+    global _segment_processor, _segment_progress, _segment_cancel
+    # Keep each worker's torch thread pool to its share of the cores
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    _segment_processor = YOLOProcessor(batch_size=batch_size)
+    _segment_progress = progress_queue
+    _segment_cancel = cancel
+
+def _process_segment(index, video_path, fps, start_frame, end_frame, sampler, roi=None):
+    processor = _segment_processor
+    partial = {
+        'vehicle_counts': {class_name: 0 for class_name in processor.vehicle_classes},
+        'detections': DetectionStore(processor.vehicle_classes, fps, lanes=roi.lanes() if roi is not None else None)
+    }
+    cap = cv2.VideoCapture(video_path)
+    try:
+        frames_analyzed, timings = processor.analyze_range(
+            cap, fps, sampler, processor.batch_size, partial, roi=roi,
+            start_frame=start_frame, end_frame=end_frame,
+            on_batch=lambda last_frame: _segment_progress.put((index, last_frame + 1 - start_frame)),
+            cancel=_segment_cancel
+        )
+    finally:
+        cap.release()
+    return index, partial, frames_analyzed, timings
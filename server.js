@@ -8,6 +8,8 @@ const fs = require('fs');
 const { Sequelize } = require('sequelize');
 require('dotenv').config();
 const { spawn } = require('child_process');
+const crypto = require('crypto');
+const readline = require('readline');
 
 const app = express();
 const server = http.createServer(app);
@@ -150,47 +152,6 @@ const mockResults = {
   peak_density: 0.75
 };
 
-// Mock ANPR analysis results
-const mockANPRResults = {
-  plate_number: "KA01M1234",
-  confidence: 0.95,
-  vehicle_type: "Car",
-  timestamp: new Date().toISOString(),
-  violations: {
-    speed: 12,
-    red_light: 3,
-    lane: 8,
-    tax_due: 2,
-    other: 4
-  },
-  recent_violations: [
-    {
-      date: "2025-01-11",
-      description: "Speed limit exceeded by 20km/h"
-    },
-    {
-      date: "2025-01-10",
-      description: "Red light violation"
-    },
-    {
-      date: "2025-01-09",
-      description: "Improper lane change"
-    }
-  ],
-  payment_history: [
-    {
-      date: "2025-01-01",
-      amount: 250,
-      status: "Paid"
-    },
-    {
-      date: "2024-12-15",
-      amount: 180,
-      status: "Pending"
-    }
-  ]
-};
-
 // Video Analysis Routes
 app.post('/api/video/upload', upload2.single('video'), (req, res) => {
   if (!req.file) {
@@ -214,26 +175,177 @@ app.get('/api/video/progress/:taskId', (req, res) => {
   });
 });
 
+// Persistent ANPR worker: loads the OCR model once and serves requests over
+// newline-delimited JSON on stdin/stdout instead of one Python process per image
+
+const anprWorker = {
+  process: null,
+  ready: false,
+  nextId: 1,
+  pending: new Map(),
+  progressHandlers: new Map(),
+  lastHealth: null
+};
+
+function startANPRWorker() {
+  const workerProcess = spawn('python', [
+    path.join(__dirname, 'backend', 'anpr_processor.py'),
+    '--worker'
+  ]);
+  anprWorker.process = workerProcess;
+  anprWorker.ready = false;
+
+  readline.createInterface({ input: workerProcess.stdout }).on('line', (line) => {
+    let message;
+    try {
+      message = JSON.parse(line);
+    } catch (parseError) {
+      console.error('Unparseable ANPR worker output:', line);
+      return;
+    }
+
+    if (message.health) {
+      anprWorker.lastHealth = message.health;
+      if (message.id === null) {
+        anprWorker.ready = message.health.status === 'ok';
+        console.log('ANPR worker status:', message.health.status);
+      }
+    }
+
+    if (message.progress) {
+      const onProgress = anprWorker.progressHandlers.get(message.id);
+      if (onProgress) {
+        onProgress(message.progress);
+      }
+      return;
+    }
+
+    const callback = anprWorker.pending.get(message.id);
+    if (callback) {
+      anprWorker.progressHandlers.delete(message.id);
+      anprWorker.pending.delete(message.id);
+      callback(null, message);
+    }
+  });
+
+  workerProcess.stderr.on('data', (data) => {
+    console.error('ANPR worker:', data.toString());
+  });
+
+  workerProcess.on('error', (error) => {
+    console.error('Failed to start ANPR worker:', error);
+  });
+
+  workerProcess.on('close', (code) => {
+    console.error('ANPR worker exited with code:', code);
+    anprWorker.process = null;
+    anprWorker.ready = false;
+    for (const callback of anprWorker.pending.values()) {
+      callback(new Error('ANPR worker exited'));
+    }
+    anprWorker.pending.clear();
+    anprWorker.progressHandlers.clear();
+    // Restart after a short delay so a crashing worker does not spin
+    setTimeout(startANPRWorker, 5000);
+  });
+}
+
+// A request fails if the worker sends nothing for it (result or progress) for this long
+const ANPR_REQUEST_TIMEOUT_MS = parseInt(process.env.ANPR_REQUEST_TIMEOUT_MS || '120000', 10);
+
+// onDone runs once the worker is finished with the request's files: on its reply
+// (even one that arrives after a timeout) or when the worker exits
+function sendToANPRWorker(request, callback, onProgress, onDone = () => {}) {
+  if (!anprWorker.process) {
+    callback(new Error('ANPR worker not running'));
+    return onDone();
+  }
+  const id = String(anprWorker.nextId++);
+  let timer = null;
+  const armTimer = () => {
+    clearTimeout(timer);
+    timer = setTimeout(() => {
+      // The worker may still be reading the upload, so a late reply only runs onDone
+      anprWorker.pending.set(id, () => onDone());
+      anprWorker.progressHandlers.delete(id);
+      const error = new Error('ANPR worker timed out');
+      error.code = 'ETIMEDOUT';
+      callback(error);
+    }, ANPR_REQUEST_TIMEOUT_MS);
+  };
+  anprWorker.pending.set(id, (error, message) => {
+    clearTimeout(timer);
+    callback(error, message);
+    onDone();
+  });
+  if (onProgress) {
+    anprWorker.progressHandlers.set(id, (progress) => {
+      armTimer();
+      onProgress(progress);
+    });
+  }
+  armTimer();
+  anprWorker.process.stdin.write(JSON.stringify({ ...request, id }) + '\n');
+}
+
+startANPRWorker();
+
+// ANPR upload tasks; images and videos are analyzed by the ANPR worker.
+// Finished tasks are kept for ANPR_TASK_TTL_MS so clients can collect results, then dropped
+const anprTasks = new Map();
+const ANPR_TASK_TTL_MS = parseInt(process.env.ANPR_TASK_TTL_MS || '3600000', 10);
+
 // ANPR Routes
 app.post('/api/anpr/upload', upload2.single('image'), (req, res) => {
   if (!req.file) {
     return res.status(400).json({ error: 'No image file uploaded' });
   }
 
-  const taskId = Date.now().toString();
+  const taskId = crypto.randomUUID();
+  const isVideo = (req.file.mimetype || '').startsWith('video/');
+  const task = { progress: 0, current_results: null, error: null };
+  anprTasks.set(taskId, task);
+
+  sendToANPRWorker(
+    { image_path: path.resolve(req.file.path), op: isVideo ? 'video' : undefined },
+    (error, message) => {
+      if (error) {
+        task.error = error.message;
+      } else if (message.result.error) {
+        task.error = message.result.error;
+      } else {
+        task.current_results = message.result;
+      }
+      task.progress = 100;
+      setTimeout(() => anprTasks.delete(taskId), ANPR_TASK_TTL_MS);
+    },
+    (progress) => {
+      task.progress = progress.progress;
+      task.partial_results = progress;
+    },
+    () => fs.unlink(req.file.path, () => {})
+  );
 
   res.json({
-    message: 'Image upload successful',
+    message: isVideo ? 'Video upload successful' : 'Image upload successful',
     taskId: taskId
   });
 });
 
 app.get('/api/anpr/progress/:taskId', (req, res) => {
-  const progress = Math.min(100, Math.random() * 100 + 10);
-  
-  res.json({
-    progress: progress,
-    current_results: progress > 90 ? mockANPRResults : null
+  const task = anprTasks.get(req.params.taskId);
+  if (!task) {
+    return res.status(404).json({ error: 'Unknown task' });
+  }
+  res.json(task);
+});
+
+app.get('/api/anpr/health', (req, res) => {
+  sendToANPRWorker({ op: 'health' }, (error, message) => {
+    if (error) {
+      return res.status(503).json({ status: 'unavailable', details: error.message });
+    }
+    res.json(message.health);
   });
 });
 
@@ -248,52 +360,26 @@ app.post('/api/anpr/analyze', upload.single('file'), (req, res) => {
 
   console.log('Processing file:', req.file.path);
 
-  const pythonProcess = spawn('python', [
-    path.join(__dirname, 'backend', 'anpr_processor.py'),
-    req.file.path
-  ]);
-
-  let result = '';
-  let errorOutput = '';
-
-  pythonProcess.stdout.on('data', (data) => {
-    console.log('Python output:', data.toString());
-    result += data.toString();
-  });
-
-  pythonProcess.stderr.on('data', (data) => {
-    console.error('Python error:', data.toString());
-    errorOutput += data.toString();
-  });
-
-  pythonProcess.on('close', (code) => {
-    console.log('Python process exited with code:', code);
-    
+  sendToANPRWorker({ image_path: path.resolve(req.file.path) }, (error, message) => {
     try {
-      // Clean up uploaded file
-      fs.unlinkSync(req.file.path);
-      
-      if (code !== 0) {
-        console.error('Python process failed:', errorOutput);
-        return res.status(500).json({ 
+      if (error) {
+        console.error('ANPR worker failed:', error);
+        return res.status(error.code === 'ETIMEDOUT' ? 504 : 500).json({ 
           error: 'Error processing image',
-          details: errorOutput
+          details: error.message
         });
       }
 
-      try {
-        const parsedResult = JSON.parse(result);
-        if (parsedResult.error) {
-          return res.status(400).json(parsedResult);
-        }
-        res.json(parsedResult);
-      } catch (parseError) {
-        console.error('Error parsing Python output:', parseError);
-        res.status(500).json({ 
-          error: 'Error parsing analysis results',
-          details: result
-        });
+      const parsedResult = message.result;
+      if (message.busy) {
+        // Worker at its pending limit: ask the client to retry instead of reporting a bad request
+        res.set('Retry-After', '5');
+        return res.status(503).json(parsedResult);
       }
+      if (parsedResult.error) {
+        return res.status(400).json(parsedResult);
+      }
+      res.json(parsedResult);
     } catch (error) {
       console.error('Server error:', error);
       res.status(500).json({ 
@@ -301,14 +387,9 @@ app.post('/api/anpr/analyze', upload.single('file'), (req, res) => {
         details: error.message
       });
     }
-  });
-
-  pythonProcess.on('error', (error) => {
-    console.error('Failed to start Python process:', error);
-    res.status(500).json({ 
-      error: 'Failed to start analysis process',
-      details: error.message
-    });
+  }, undefined, () => {
+    // Clean up uploaded file once the worker is done with it, not when the request times out
+    fs.unlink(req.file.path, () => {});
   });
 });
 